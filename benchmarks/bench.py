@@ -0,0 +1,372 @@
+"""
+Offline end-to-end benchmarks for the cloudmanager runner.
+
+Every scenario runs the real runner (precheck, deploy, readiness, upload, setup and teardown)
+against a local moto EC2 server, with the ``terraform``, ``ssh`` and ``scp`` binaries replaced by
+the shims in ``benchmarks/shims``. The shims sleep for configurable latencies, so results measure
+cloudmanager's own orchestration overhead: wall-clock time, per-phase totals, AWS API calls by
+operation and the number of subprocesses started.
+
+Usage:
+    python benchmarks/bench.py                      # run the default scenarios and compare
+    python benchmarks/bench.py -s smoke -s fleet-50 # run selected scenarios
+    python benchmarks/bench.py --list               # list scenarios
+    python benchmarks/bench.py --compare-only       # compare the last two recorded runs
+
+Results are appended to ``benchmarks/results.jsonl``, tagged with the current git commit, and
+compared with the most recent earlier run of the same scenario.
+"""
+import os
+import sys
+import json
+import logging
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+SHIM_DIR = os.path.join(BENCH_DIR, 'shims')
+DEFAULT_HISTORY_PATH = os.path.join(BENCH_DIR, 'results.jsonl')
+
+REGIONS = [
+    'us-east-1', 'us-east-2', 'us-west-1', 'us-west-2', 'ca-central-1',
+    'eu-west-1', 'eu-west-2', 'eu-west-3', 'eu-central-1', 'eu-north-1',
+    'ap-south-1', 'ap-northeast-1', 'ap-northeast-2', 'ap-southeast-1', 'ap-southeast-2',
+]
+
+# name: (number of VMs, number of regions, runner options)
+SCENARIOS = {
+    'smoke': (2, 2, {'parallel': 2}),
+    'serial-10': (10, 3, {'parallel': 1}),
+    'parallel-50': (50, 5, {'parallel': 16}),
+    'fleet-50': (50, 5, {'parallel': 16, 'fleet': True}),
+    'async-50': (50, 5, {'parallel': 16, 'engine': 'async'}),
+    'async-fleet-50': (50, 5, {'parallel': 16, 'fleet': True, 'engine': 'async'}),
+    'ec2-50': (50, 5, {'parallel': 16, 'backend_name': 'ec2'}),
+    'ec2-500': (500, 15, {'parallel': 64, 'backend_name': 'ec2'}),
+    'pipeline-50': (50, 5, {'parallel': 16, 'pipeline': True}),
+    'pipeline-ec2-50': (50, 5, {'parallel': 16, 'backend_name': 'ec2', 'pipeline': True}),
+    # Deploys twice; the second run restarts the instances the first one stopped into the warm pool
+    'warm-ec2-50': (50, 5, {'parallel': 16, 'backend_name': 'ec2', 'warm_pool_size': 50, 'runs': 2}),
+    # Deploys twice; the second run places VMs by the launch latency history of the first
+    'latency-ec2-50': (50, 5, {'parallel': 16, 'backend_name': 'ec2', 'placement': 'latency', 'runs': 2}),
+    'fleet-200': (200, 10, {'parallel': 32, 'fleet': True}),
+    'fleet-500': (500, 15, {'parallel': 64, 'fleet': True}),
+}
+DEFAULT_SCENARIOS = ['smoke', 'serial-10', 'parallel-50', 'fleet-50', 'async-50', 'ec2-50']
+
+# Seconds slept by the shims; override any of them through the environment
+DEFAULT_LATENCIES = {
+    'TF_SHIM_INIT_LATENCY': '0.5',
+    'TF_SHIM_PLAN_LATENCY': '0.2',
+    'TF_SHIM_APPLY_LATENCY': '0.2',
+    'TF_SHIM_RESOURCE_LATENCY': '0.5',
+    'SSH_SHIM_CONNECT_LATENCY': '0.05',
+    'SSH_SHIM_COMMAND_LATENCY': '0.05',
+    'SCP_SHIM_LATENCY': '0.05',
+}
+
+# Canonical's account, so the Ubuntu image lookup in cloudmanager.deploy finds the fixture image
+CANONICAL_OWNER_ID = '099720109477'
+FIXTURE_AMI = {
+    'ami_id': 'ami-0bench0focal00001',
+    'name': 'ubuntu/images/hvm-ssd/ubuntu-focal-20.04-amd64-server-20240101',
+    'description': 'Canonical, Ubuntu, 20.04 LTS, amd64 focal image (benchmark fixture)',
+    'owner_id': CANONICAL_OWNER_ID,
+    'public': True,
+    'state': 'available',
+    'image_location': 'amazon/ubuntu-focal-20.04-amd64-server-20240101',
+    'image_type': 'machine',
+    'platform': None,
+    'architecture': 'x86_64',
+    'root_device_type': 'ebs',
+    'root_device_name': '/dev/sda1',
+    'virtualization_type': 'hvm',
+    'hypervisor': 'xen',
+    'sriov': 'simple',
+}
+
+
+def git_commit():
+    """Return the short hash of the checked-out commit, marked dirty when the tree has changes."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                                capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                               capture_output=True, text=True).stdout.strip()
+        return f"{commit}-dirty" if dirty else commit
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def start_moto_server(work_dir):
+    """Start a local moto server whose image catalogue contains the Ubuntu fixture image."""
+    amis_path = os.path.join(work_dir, 'amis.json')
+    with open(amis_path, 'w') as f:
+        json.dump([FIXTURE_AMI], f)
+    # moto reads the image catalogue when it is first imported
+    os.environ['MOTO_AMIS_PATH'] = amis_path
+    from moto.server import ThreadedMotoServer
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    return server, f"http://{host}:{port}"
+
+def reset_and_seed(endpoint, regions):
+    """Reset the moto server and give every region an SSH security group and a key pair."""
+    import boto3
+    import urllib.request
+
+    urllib.request.urlopen(urllib.request.Request(f"{endpoint}/moto-api/reset", method='POST')).read()
+    for region in regions:
+        ec2_client = boto3.client('ec2', region_name=region, endpoint_url=endpoint,
+                                  aws_access_key_id='testing', aws_secret_access_key='testing')
+        vpc_id = ec2_client.describe_vpcs()['Vpcs'][0]['VpcId']
+        group_id = ec2_client.create_security_group(
+            GroupName='bench-ssh', Description='SSH for benchmarks', VpcId=vpc_id)['GroupId']
+        ec2_client.authorize_security_group_ingress(
+            GroupId=group_id,
+            IpPermissions=[{'IpProtocol': 'tcp', 'FromPort': 22, 'ToPort': 22,
+                            'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}]
+        )
+        ec2_client.create_key_pair(KeyName='bench-key')
+
+def write_scenario_config(path, vm_count, region_count, payload_dir):
+    """Write a runner config with ``vm_count`` VMs spread round-robin over ``region_count`` regions."""
+    import yaml
+
+    regions = REGIONS[:region_count]
+    vm_configs = []
+    for index in range(vm_count):
+        vm_configs.append({
+            'region': regions[index % len(regions)],
+            'instance_type': 't2.micro',
+            'vm_name': f"bench-vm-{index}",
+            'custom_code_path': payload_dir,
+            'files': [os.path.join(payload_dir, 'run.sh')],
+            'initial_commands': ['echo setup', 'bash ~/run.sh'],
+        })
+    config = {'Config': {'cloud_providers': [{
+        'name': 'AWS',
+        'credentials': {'access_key': 'testing', 'secret_key': 'testing'},
+        'vm_configs': vm_configs,
+    }]}}
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return regions
+
+def prepare_home(home_dir):
+    """Create the SSH key pair the runner reads from ``~/.ssh``."""
+    ssh_dir = os.path.join(home_dir, '.ssh')
+    os.makedirs(ssh_dir, exist_ok=True)
+    with open(os.path.join(ssh_dir, 'id_rsa'), 'w') as f:
+        f.write('benchmark key\n')
+    with open(os.path.join(ssh_dir, 'id_rsa.pub'), 'w') as f:
+        f.write('ssh-rsa AAAAbenchmark bench@localhost\n')
+
+def count_subprocesses(log_path):
+    """Count the shim invocations recorded in ``log_path`` by binary and Terraform command."""
+    counts = {}
+    if not os.path.exists(log_path):
+        return counts
+    with open(log_path) as f:
+        for line in f:
+            words = line.split()
+            if not words:
+                continue
+            key = ' '.join(words[:2]) if words[0] == 'terraform' else words[0]
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+def run_scenario(name, endpoint, work_dir):
+    """Run one scenario in a child process and return its result record."""
+    vm_count, region_count, options = SCENARIOS[name]
+    scenario_dir = os.path.join(work_dir, name)
+    shutil.rmtree(scenario_dir, ignore_errors=True)
+    home_dir = os.path.join(scenario_dir, 'home')
+    payload_dir = os.path.join(scenario_dir, 'payload')
+    os.makedirs(payload_dir)
+    with open(os.path.join(payload_dir, 'run.sh'), 'w') as f:
+        f.write('echo benchmark\n')
+    prepare_home(home_dir)
+
+    config_path = os.path.join(scenario_dir, 'config.yaml')
+    regions = write_scenario_config(config_path, vm_count, region_count, payload_dir)
+    reset_and_seed(endpoint, regions)
+
+    env = dict(os.environ)
+    for key, value in DEFAULT_LATENCIES.items():
+        env.setdefault(key, value)
+    env.update({
+        'HOME': home_dir,
+        'PATH': SHIM_DIR + os.pathsep + env.get('PATH', ''),
+        'PYTHONPATH': REPO_DIR + os.pathsep + env.get('PYTHONPATH', ''),
+        'AWS_ENDPOINT_URL': endpoint,
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+        'SHIM_LOG': os.path.join(scenario_dir, 'shim.log'),
+    })
+    trace_path = os.path.join(scenario_dir, 'trace')
+    child_args = {
+        'config_path': config_path,
+        'output_dir': os.path.join(scenario_dir, 'terraform'),
+        'trace_path': trace_path,
+        'parallel': options.get('parallel', 1),
+        'fleet': options.get('fleet', False),
+        'engine': options.get('engine', 'threads'),
+        'backend_name': options.get('backend_name', 'terraform'),
+        'pipeline': options.get('pipeline', False),
+        'warm_pool_size': options.get('warm_pool_size'),
+        'placement': options.get('placement'),
+        'runs': options.get('runs', 1),
+    }
+
+    print(f"Running scenario {name}: {vm_count} VMs in {region_count} regions, options {options}")
+    start = time.monotonic()
+    child = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), '--child', json.dumps(child_args)],
+        env=env,
+        stdout=open(os.path.join(scenario_dir, 'runner.log'), 'w'),
+        stderr=subprocess.STDOUT,
+    )
+    wall = time.monotonic() - start
+    if child.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed with exit code {child.returncode}; "
+                           f"see {os.path.join(scenario_dir, 'runner.log')}")
+
+    with open(f"{trace_path}.json") as f:
+        trace = json.load(f)
+    counters = trace['counters']
+    return {
+        'scenario': name,
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'vms': vm_count,
+        'regions': region_count,
+        'options': options,
+        'wall_seconds': round(wall, 3),
+        'phases': {phase['name']: round(phase['total'], 3) for phase in trace['phases']},
+        'api_calls': sum(value for key, value in counters.items() if key.startswith('api.')),
+        'api_calls_by_operation': {key: value for key, value in counters.items() if key.startswith('api.')},
+        'subprocesses': count_subprocesses(env['SHIM_LOG']),
+    }
+
+def run_child(child_args):
+    """
+    Run the runner in this process.
+
+    Only two calls are faked: the SSH banner probe, as moto's IPs are not routable, and the
+    vCPU quota lookup, as moto does not implement GetAWSDefaultServiceQuota.
+    """
+    from cloudmanager import precheck, readiness, runner
+
+    precheck.vcpu_quota_limit = lambda quotas_client, quota_code: 100000
+
+    async def probe_ssh_banner_async(host, port=22, timeout=5):
+        return True
+
+    readiness.probe_ssh_banner = lambda host, port=22, timeout=5: True
+    readiness.probe_ssh_banner_async = probe_ssh_banner_async
+    for _ in range(child_args.pop('runs', 1)):
+        runner.main(**child_args)
+
+def read_history(path):
+    """Return every recorded result, oldest first."""
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def append_history(path, result):
+    with open(path, 'a') as f:
+        f.write(json.dumps(result) + '\n')
+
+def compare(result, history, threshold):
+    """
+    Compare a result with the latest earlier result of the same scenario.
+
+    :return: True when the wall-clock time, API calls or subprocess count regressed by more than ``threshold``.
+    """
+    previous = [entry for entry in history if entry['scenario'] == result['scenario'] and entry is not result]
+    if not previous:
+        print(f"  {result['scenario']}: {result['wall_seconds']:.2f}s, {result['api_calls']} API calls, "
+              f"{sum(result['subprocesses'].values())} subprocesses (no baseline)")
+        return False
+    baseline = previous[-1]
+    metrics = [
+        ('wall', baseline['wall_seconds'], result['wall_seconds']),
+        ('api calls', baseline['api_calls'], result['api_calls']),
+        ('subprocesses', sum(baseline['subprocesses'].values()), sum(result['subprocesses'].values())),
+    ]
+    regressed = False
+    parts = []
+    for label, before, after in metrics:
+        change = (after - before) / before if before else 0.0
+        flag = ''
+        if change > threshold:
+            flag = ' REGRESSION'
+            regressed = True
+        parts.append(f"{label} {before:g} -> {after:g} ({change:+.0%}){flag}")
+    print(f"  {result['scenario']} vs {baseline['commit']}: " + ", ".join(parts))
+    return regressed
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the offline cloudmanager benchmarks.")
+    parser.add_argument("-s", "--scenario", action="append", choices=sorted(SCENARIOS),
+                        help=f"Scenario to run; may be repeated (default: {', '.join(DEFAULT_SCENARIOS)}).")
+    parser.add_argument("--list", action="store_true", help="List the scenarios and exit.")
+    parser.add_argument("--history", type=str, default=DEFAULT_HISTORY_PATH,
+                        help="JSON lines file the results are appended to.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Relative increase reported as a regression (default: 0.2).")
+    parser.add_argument("--compare-only", action="store_true", help="Compare the recorded results without running anything.")
+    parser.add_argument("--fail-on-regression", action="store_true", help="Exit with status 1 when a regression is found.")
+    parser.add_argument("--keep", action="store_true", help="Keep the working directory with logs and traces.")
+    parser.add_argument("--child", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    if args.list:
+        for name, (vm_count, region_count, options) in SCENARIOS.items():
+            print(f"{name}: {vm_count} VMs in {region_count} regions, options {options}")
+        return
+
+    history = read_history(args.history)
+    if args.compare_only:
+        latest = {}
+        for entry in history:
+            latest[entry['scenario']] = entry
+        results = list(latest.values())
+    else:
+        work_dir = tempfile.mkdtemp(prefix='cloudmanager-bench-')
+        server, endpoint = start_moto_server(work_dir)
+        results = []
+        try:
+            for name in args.scenario or DEFAULT_SCENARIOS:
+                result = run_scenario(name, endpoint, work_dir)
+                append_history(args.history, result)
+                results.append(result)
+        finally:
+            server.stop()
+            if args.keep:
+                print(f"Logs and traces kept in {work_dir}")
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\nResults:")
+    regressed = False
+    for result in results:
+        regressed = compare(result, [entry for entry in history if entry is not result], args.threshold) or regressed
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 # cloudmanager/__init__.py
 
 # from .runner import main
-# from .deploy import deploy_aws_vm, terminate_aws_instance
+# from .deploy import deploy_aws_vm
+# from .teardown import terminate_aws_instance
 # from .precheck import check_aws_configs
 # from .utils import divide_configs, get_security_group_with_ssh
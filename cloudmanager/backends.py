@@ -0,0 +1,253 @@
+import asyncio
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from cloudmanager.deploy import (
+    assign_vm_names, get_aws_resources, render_user_data, resolved_resources_by_name, record_state, vm_result,
+    launch_single_aws_vm, deploy_aws_vm, deploy_aws_fleet, finish_aws_vms, deploy_aws_vm_async, deploy_aws_fleet_async, finish_aws_vms_async
+)
+from cloudmanager.discovery import DiscoveryCache, account_key
+from cloudmanager.clients import get_ec2_client
+from cloudmanager.latency import get_launch_timings
+from cloudmanager.tracing import span
+
+# Instances launched by one run_instances call; MinCount equals MaxCount, so a call that cannot
+# get capacity for the whole batch launches nothing
+RUN_INSTANCES_BATCH_SIZE = 100
+LAUNCH_GROUP_TAG = 'cloudmanager:launch-group'
+
+
+class LaunchBackend:
+    """
+    How the instances of an AWS provider entry are created.
+
+    A backend deploys every VM of a provider entry and returns the per-VM result dictionaries
+    of ``deploy.vm_result``. Waiting for SSH, file upload and setup commands are shared by all
+    backends through ``finish_aws_vms``.
+    """
+
+    name = None
+
+    def deploy(self, aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None, state=None):
+        """Deploy every VM of ``aws_config`` on threads and return the per-VM results."""
+        raise NotImplementedError
+
+    async def deploy_async(self, aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None,
+                           state=None):
+        """Coroutine counterpart of ``deploy`` for the asyncio engine."""
+        raise NotImplementedError
+
+    def launch_one(self, aws_config, vm_config, resources, output_dir, state=None):
+        """
+        Create the instance of a single VM with already resolved resources and set its ``instance_id``.
+
+        Used by the pipeline scheduler, which launches each VM as soon as its own resources are resolved.
+        """
+        raise NotImplementedError
+
+
+class TerraformBackend(LaunchBackend):
+    """Create instances with Terraform, from one working directory per VM or one for the whole fleet."""
+
+    name = 'terraform'
+
+    def __init__(self, fleet=False, terraform_parallelism=10, fleet_name='aws-fleet'):
+        self.fleet = fleet
+        self.terraform_parallelism = terraform_parallelism
+        self.fleet_name = fleet_name
+
+    def deploy(self, aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None, state=None):
+        if self.fleet:
+            return deploy_aws_fleet(aws_config, output_dir, parallel, self.terraform_parallelism, self.fleet_name,
+                                    discovery_cache, vm_resources, state)
+        return deploy_aws_vm(aws_config, output_dir, parallel, discovery_cache, vm_resources, state)
+
+    async def deploy_async(self, aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None,
+                           state=None):
+        if self.fleet:
+            return await deploy_aws_fleet_async(aws_config, output_dir, parallel, self.terraform_parallelism,
+                                                self.fleet_name, discovery_cache, vm_resources, state)
+        return await deploy_aws_vm_async(aws_config, output_dir, parallel, discovery_cache, vm_resources, state)
+
+    def launch_one(self, aws_config, vm_config, resources, output_dir, state=None):
+        # A single VM always gets its own working directory; a fleet apply would wait for every VM
+        launch_single_aws_vm(aws_config['credentials']['access_key'], aws_config['credentials']['secret_key'],
+                             vm_config, output_dir, resources, state)
+
+
+class EC2Backend(LaunchBackend):
+    """
+    Create instances directly with the EC2 API, without Terraform.
+
+    VMs in the same region with identical launch parameters are created by one
+    ``run_instances`` call with MinCount and MaxCount set to their number, so instance IDs
+    come straight from the response. Each instance is then tagged with its VM name.
+    """
+
+    name = 'ec2'
+
+    def __init__(self, parallel_regions=16, tag_parallelism=16):
+        """
+        :param parallel_regions: The maximum number of regions launching at once.
+        :param tag_parallelism: The maximum number of create_tags calls in flight per region.
+        """
+        self.parallel_regions = parallel_regions
+        self.tag_parallelism = tag_parallelism
+
+    def deploy(self, aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None, state=None):
+        errors = self.launch(aws_config, discovery_cache, vm_resources, state)
+        return self._finish_results(aws_config, errors, finish_aws_vms(
+            aws_config, self._launched(aws_config, errors), parallel, state))
+
+    async def deploy_async(self, aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None,
+                           state=None):
+        errors = await asyncio.to_thread(self.launch, aws_config, discovery_cache, vm_resources, state)
+        return self._finish_results(aws_config, errors, await finish_aws_vms_async(
+            aws_config, self._launched(aws_config, errors), parallel, state))
+
+    def launch_one(self, aws_config, vm_config, resources, output_dir, state=None):
+        ec2_client = get_ec2_client(aws_config['credentials']['access_key'], aws_config['credentials']['secret_key'],
+                                    vm_config['region'])
+        launch_aws_instances(ec2_client, [(vm_config, resources)], render_user_data(), self.tag_parallelism)
+        record_state(state, vm_config, 'launched')
+
+    def launch(self, aws_config, discovery_cache=None, vm_resources=None, state=None):
+        """
+        Launch every VM of a provider entry and set its ``instance_id``.
+
+        :return: A dictionary mapping the names of VMs that could not be launched to their error.
+        """
+        access_key = aws_config['credentials']['access_key']
+        secret_key = aws_config['credentials']['secret_key']
+        vm_configs = aws_config['vm_configs']
+        assign_vm_names(vm_configs)
+        if discovery_cache is None:
+            discovery_cache = DiscoveryCache(path=None)
+        account = account_key(access_key)
+        account_state = state.for_account(access_key) if state is not None else None
+        resources_by_name = resolved_resources_by_name(vm_configs, vm_resources)
+        user_data = render_user_data()
+
+        vms_by_region = {}
+        for vm_config in vm_configs:
+            vms_by_region.setdefault(vm_config['region'], []).append(vm_config)
+
+        def launch_region(region):
+            ec2_client = get_ec2_client(access_key, secret_key, region)
+            errors = {}
+            groups = {}
+            with span('deploy.discovery', region=region):
+                for vm_config in vms_by_region[region]:
+                    try:
+                        resources = resources_by_name.get(vm_config['vm_name']) or get_aws_resources(
+                            ec2_client, vm_config, discovery_cache, account)
+                    except Exception as e:
+                        errors[vm_config['vm_name']] = str(e)
+                        continue
+                    groups.setdefault(launch_key(vm_config, resources), []).append((vm_config, resources))
+
+            with span('deploy.run_instances', region=region):
+                for members in groups.values():
+                    for start in range(0, len(members), RUN_INSTANCES_BATCH_SIZE):
+                        batch = members[start:start + RUN_INSTANCES_BATCH_SIZE]
+                        try:
+                            launch_aws_instances(ec2_client, batch, user_data, self.tag_parallelism)
+                        except Exception as e:
+                            print(f"Launching {len(batch)} instances in {region} failed: {e}")
+                            for vm_config, _ in batch:
+                                errors[vm_config['vm_name']] = str(e)
+                            continue
+                        for vm_config, _ in batch:
+                            record_state(account_state, vm_config, 'launched')
+            return errors
+
+        errors = {}
+        regions = list(vms_by_region)
+        if regions:
+            with ThreadPoolExecutor(max_workers=max(1, min(self.parallel_regions, len(regions)))) as executor:
+                for region_errors in executor.map(launch_region, regions):
+                    errors.update(region_errors)
+        return errors
+
+    @staticmethod
+    def _launched(aws_config, errors):
+        return [vm_config for vm_config in aws_config['vm_configs'] if vm_config['vm_name'] not in errors]
+
+    @staticmethod
+    def _finish_results(aws_config, errors, finished):
+        results_by_name = {result['vm_name']: result for result in finished}
+        return [
+            results_by_name.get(vm_config['vm_name']) or vm_result(vm_config, errors[vm_config['vm_name']])
+            for vm_config in aws_config['vm_configs']
+        ]
+
+
+def launch_key(vm_config, resources):
+    """Return the launch parameters a VM shares with the other VMs of its run_instances call."""
+    return (
+        vm_config['region'],
+        resources['ami_id'],
+        vm_config['instance_type'],
+        resources['subnet_id'],
+        tuple(resources['security_group_ids']),
+        resources['key_pair_name'],
+        bool(resources.get('baked', False)),
+    )
+
+def launch_aws_instances(ec2_client, members, user_data, tag_parallelism=16):
+    """
+    Launch identical instances with one run_instances call and give each one its VM's Name tag.
+
+    Each call gets a fresh client token, which botocore resends on its own retries, so a retried
+    request never launches the batch twice while a later run of the same config still gets new instances.
+
+    :param members: (vm_config, resources) pairs sharing the same ``launch_key``.
+    :param user_data: The user_data script, used unless the image is baked.
+    """
+    vm_configs = [vm_config for vm_config, _ in members]
+    resources = members[0][1]
+    token = uuid.uuid4().hex
+    params = {
+        'ImageId': resources['ami_id'],
+        'InstanceType': vm_configs[0]['instance_type'],
+        'SubnetId': resources['subnet_id'],
+        'SecurityGroupIds': list(resources['security_group_ids']),
+        'KeyName': resources['key_pair_name'],
+        'MinCount': len(vm_configs),
+        'MaxCount': len(vm_configs),
+        'ClientToken': token,
+        'TagSpecifications': [{'ResourceType': 'instance', 'Tags': [{'Key': LAUNCH_GROUP_TAG, 'Value': token}]}],
+    }
+    if not resources.get('baked'):
+        params['UserData'] = user_data
+
+    timings = get_launch_timings()
+    timings.start(members)
+    instances = sorted(ec2_client.run_instances(**params)['Instances'], key=lambda instance: instance['AmiLaunchIndex'])
+    for vm_config, instance in zip(vm_configs, instances):
+        vm_config['instance_id'] = instance['InstanceId']
+        vm_config['public_ip'] = instance.get('PublicIpAddress')
+        timings.mark(vm_config, 'launch', availability_zone=instance.get('Placement', {}).get('AvailabilityZone'))
+        print(f"[{vm_config['vm_name']}] Launched instance {instance['InstanceId']}")
+
+    def tag(vm_config):
+        # A missing Name tag does not affect the deployment, so it is only reported
+        try:
+            ec2_client.create_tags(Resources=[vm_config['instance_id']],
+                                   Tags=[{'Key': 'Name', 'Value': vm_config['vm_name']}])
+        except ClientError as e:
+            print(f"[{vm_config['vm_name']}] Unable to tag instance {vm_config['instance_id']}: {e}")
+
+    with ThreadPoolExecutor(max_workers=max(1, min(tag_parallelism, len(vm_configs)))) as executor:
+        list(executor.map(tag, vm_configs))
+
+BACKENDS = {
+    TerraformBackend.name: TerraformBackend,
+    EC2Backend.name: EC2Backend,
+}
+
+def get_backend(name, **options):
+    """Create the launch backend registered under ``name`` with the given options."""
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend '{name}'. Available: {', '.join(sorted(BACKENDS))}.")
+    return BACKENDS[name](**options)
@@ -0,0 +1,149 @@
+import hashlib
+import json
+from cloudmanager.clients import get_ec2_client
+from cloudmanager.deploy import render_user_data, run_initial_setup_commands
+from cloudmanager.readiness import InstanceReadiness, wait_for_ssh
+from cloudmanager.upload import collect_upload_entries, file_sha256, upload_files
+
+BAKE_HASH_TAG = 'cloudmanager:bake-hash'
+
+
+def bake_hash(vm_config, base_image_name, user_data):
+    """
+    Hash everything that goes into a provisioned VM: base image, user_data, files and setup commands.
+
+    Two VMs with the same hash end up identical after provisioning, so they can share one baked image.
+    The base image is identified by name because AMI IDs differ between regions.
+    """
+    files = [
+        (arcname, file_sha256(local_path))
+        for local_path, arcname in collect_upload_entries(vm_config.get('files', []), vm_config.get('custom_code_path'))
+    ]
+    payload = json.dumps({
+        'base_image': base_image_name,
+        'user_data': user_data,
+        'files': sorted(files),
+        'initial_commands': vm_config.get('initial_commands', []),
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def base_image_name(ec2_client, ami_id):
+    """Return the name of an image, which is the same in every region it is published to."""
+    return ec2_client.describe_images(ImageIds=[ami_id])['Images'][0]['Name']
+
+def find_baked_ami(ec2_client, image_hash):
+    """Return the ID of this account's newest image tagged with the bake hash, or None."""
+    response = ec2_client.describe_images(
+        Owners=['self'],
+        Filters=[
+            {'Name': f'tag:{BAKE_HASH_TAG}', 'Values': [image_hash]},
+            {'Name': 'state', 'Values': ['available', 'pending']}
+        ]
+    )
+    if not response['Images']:
+        return None
+    image = max(response['Images'], key=lambda image: image['CreationDate'])
+    if image['State'] == 'pending':
+        ec2_client.get_waiter('image_available').wait(ImageIds=[image['ImageId']])
+    return image['ImageId']
+
+def provision_bake_instance(public_ip, vm_config, user='experiment'):
+    """Upload the VM's files and run its setup commands on the instance being baked."""
+    wait_for_ssh(public_ip, user=user)
+    upload_files(public_ip, user, vm_config.get('files', []), vm_config.get('custom_code_path'))
+    run_initial_setup_commands(public_ip, user, vm_config.get('initial_commands', []), label='bake')
+
+def bake_ami(ec2_client, vm_config, resources, image_hash, user_data, provision=provision_bake_instance):
+    """
+    Provision one instance from the base image, snapshot it into an AMI tagged with the bake hash, and terminate it.
+
+    :param provision: Called with the instance's public IP and vm_config once it has an address;
+                      defaults to uploading files and running initial_commands over SSH.
+    :return: The ID of the new AMI.
+    """
+    region = vm_config['region']
+    name = f"cloudmanager-bake-{image_hash[:16]}"
+    response = ec2_client.run_instances(
+        ImageId=resources['ami_id'],
+        InstanceType=vm_config['instance_type'],
+        MinCount=1,
+        MaxCount=1,
+        SubnetId=resources['subnet_id'],
+        SecurityGroupIds=resources['security_group_ids'],
+        KeyName=resources['key_pair_name'],
+        UserData=user_data,
+        TagSpecifications=[{'ResourceType': 'instance', 'Tags': [{'Key': 'Name', 'Value': name}]}]
+    )
+    instance_id = response['Instances'][0]['InstanceId']
+    print(f"Baking image {name} from instance {instance_id} in {region}...")
+
+    try:
+        readiness = InstanceReadiness({region: ec2_client})
+        readiness.track(region, [instance_id])
+        provision(readiness.wait_for_public_ip(instance_id), vm_config)
+
+        image_id = ec2_client.create_image(
+            InstanceId=instance_id,
+            Name=name,
+            TagSpecifications=[{'ResourceType': 'image', 'Tags': [{'Key': BAKE_HASH_TAG, 'Value': image_hash}]}]
+        )['ImageId']
+        ec2_client.get_waiter('image_available').wait(ImageIds=[image_id])
+    finally:
+        ec2_client.terminate_instances(InstanceIds=[instance_id])
+
+    print(f"Baked image {image_id} in {region}.")
+    return image_id
+
+def copy_baked_ami(source_client, target_client, image_id, image_hash):
+    """Copy a baked image to another region, tag it with its bake hash, and return the new image ID."""
+    copied_id = target_client.copy_image(
+        SourceImageId=image_id,
+        SourceRegion=source_client.meta.region_name,
+        Name=f"cloudmanager-bake-{image_hash[:16]}"
+    )['ImageId']
+    target_client.create_tags(Resources=[copied_id], Tags=[{'Key': BAKE_HASH_TAG, 'Value': image_hash}])
+    target_client.get_waiter('image_available').wait(ImageIds=[copied_id])
+    print(f"Copied baked image {image_id} to {target_client.meta.region_name} as {copied_id}.")
+    return copied_id
+
+def apply_baked_images(aws_config, vm_resources, provision=provision_bake_instance):
+    """
+    Point every VM at a baked image matching its bake hash, baking one first when none exists.
+
+    Each distinct hash is baked at most once; other regions receive a copy of that image.
+    The VM's resources are updated in place so deploy boots from the baked AMI without user_data,
+    and ``baked_ami_id`` is set on the vm_config so file upload and setup are skipped.
+
+    :param aws_config: The AWS provider entry from the configuration file.
+    :param vm_resources: The resources resolved for each VM by precheck, in ``vm_configs`` order.
+    """
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    user_data = render_user_data()
+    images = {}
+    baked_in = {}
+    base_names = {}
+
+    for vm_config, resources in zip(aws_config['vm_configs'], vm_resources):
+        if resources is None:
+            continue
+        region = vm_config['region']
+        ec2_client = get_ec2_client(access_key, secret_key, region)
+        if (region, resources['ami_id']) not in base_names:
+            base_names[(region, resources['ami_id'])] = base_image_name(ec2_client, resources['ami_id'])
+        image_hash = bake_hash(vm_config, base_names[(region, resources['ami_id'])], user_data)
+
+        if (region, image_hash) not in images:
+            image_id = find_baked_ami(ec2_client, image_hash)
+            if image_id is None and image_hash in baked_in:
+                source_region, source_image_id = baked_in[image_hash]
+                image_id = copy_baked_ami(
+                    get_ec2_client(access_key, secret_key, source_region), ec2_client, source_image_id, image_hash)
+            elif image_id is None:
+                image_id = bake_ami(ec2_client, vm_config, resources, image_hash, user_data, provision)
+            baked_in.setdefault(image_hash, (region, image_id))
+            images[(region, image_hash)] = image_id
+
+        resources['ami_id'] = images[(region, image_hash)]
+        resources['baked'] = True
+        vm_config['baked_ami_id'] = resources['ami_id']
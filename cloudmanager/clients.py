@@ -0,0 +1,131 @@
+import hashlib
+import threading
+import boto3
+from botocore.config import Config
+from cloudmanager.tracing import count
+from cloudmanager.ratelimit import RateLimiterRegistry
+from cloudmanager.discovery import account_key
+
+# Enough connections for every worker thread to talk to a region at once, and
+# adaptive retries so throttled calls back off instead of failing
+DEFAULT_CLIENT_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    connect_timeout=10,
+    read_timeout=60
+)
+# Services whose calls go through a shared rate limiter per account and region. Their clients use
+# standard retries, as botocore's adaptive mode would add a second, per-client rate limiter.
+RATE_LIMITED_SERVICES = ('ec2',)
+RATE_LIMITED_CLIENT_CONFIG = Config(retries={'max_attempts': 10, 'mode': 'standard'})
+
+
+class ClientPool:
+    """
+    Thread-safe cache of boto3 clients keyed by service, credentials and region.
+
+    boto3 clients are safe to share between threads once created, but creating them is slow
+    and sessions are not thread-safe, so creation happens under a lock and each client is
+    built at most once per key.
+    """
+
+    def __init__(self, config=DEFAULT_CLIENT_CONFIG, rate_limited_services=RATE_LIMITED_SERVICES):
+        """
+        :param config: The botocore Config every client is created with.
+        :param rate_limited_services: Services whose calls share one AdaptiveRateLimiter per account and region.
+        """
+        self.config = config
+        self.rate_limited_services = rate_limited_services
+        self.rate_limiters = RateLimiterRegistry()
+        self.created = 0
+        self.reused = 0
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._clients = {}
+        self._client_keys = {}
+
+    def get_client(self, service, access_key=None, secret_key=None, region=None):
+        """Return a cached client for the service, credentials and region, creating it on first use."""
+        credentials_key = (access_key, hashlib.sha256(str(secret_key).encode()).hexdigest())
+        return self._get_client(service, credentials_key, region, access_key, secret_key)
+
+    def sibling_client(self, client, service):
+        """
+        Return a client for another service with the same credentials and region as ``client``.
+
+        :return: The client, or None if ``client`` was not created by this pool.
+        """
+        with self._lock:
+            key = self._client_keys.get(id(client))
+        if key is None:
+            return None
+        _, credentials_key, region = key
+        return self._get_client(service, credentials_key, region)
+
+    def _get_client(self, service, credentials_key, region, access_key=None, secret_key=None):
+        key = (service, credentials_key, region)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self.reused += 1
+                return client
+
+            # A sibling client's session always exists, as its original client was created from it
+            session = self._sessions.get(credentials_key)
+            if session is None:
+                session = boto3.session.Session(
+                    aws_access_key_id=access_key,
+                    aws_secret_access_key=secret_key
+                )
+                self._sessions[credentials_key] = session
+            if service in self.rate_limited_services:
+                client = session.client(service, region_name=region,
+                                        config=self.config.merge(RATE_LIMITED_CLIENT_CONFIG))
+                self.rate_limiters.attach(client, (service, account_key(credentials_key[0]), region))
+            else:
+                client = session.client(service, region_name=region, config=self.config)
+            client.meta.events.register('before-call', _count_api_call)
+            self._clients[key] = client
+            self._client_keys[id(client)] = key
+            self.created += 1
+            return client
+
+    def stats(self):
+        """Return the number of clients created and reused so far."""
+        with self._lock:
+            return {'created': self.created, 'reused': self.reused}
+
+    def clear(self):
+        """Drop every cached client and session."""
+        with self._lock:
+            self._clients.clear()
+            self._client_keys.clear()
+            self._sessions.clear()
+
+
+def _count_api_call(model, **kwargs):
+    count(f"api.{model.service_model.service_name}.{model.name}")
+
+
+_default_pool = ClientPool()
+
+
+def get_ec2_client(access_key=None, secret_key=None, region=None):
+    """Return a shared EC2 client from the default pool."""
+    return _default_pool.get_client('ec2', access_key, secret_key, region)
+
+def get_ssm_client(access_key=None, secret_key=None, region=None):
+    """Return a shared SSM client from the default pool."""
+    return _default_pool.get_client('ssm', access_key, secret_key, region)
+
+def get_sibling_client(client, service):
+    """Return a pooled client for another service with the same credentials and region as ``client``, or None."""
+    return _default_pool.sibling_client(client, service)
+
+def get_client_pool():
+    """Return the default client pool used across cloudmanager."""
+    return _default_pool
+
+def get_rate_limiters():
+    """Return the rate limiters shared by the clients of the default pool."""
+    return _default_pool.rate_limiters
@@ -0,0 +1,201 @@
+import gzip
+import os
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from cloudmanager.ssh import get_ssh_manager
+from cloudmanager.tracing import span
+
+DEFAULT_COLLECT_DIR = 'results'
+# Files requested per ssh call, which keeps the remote command line well below ARG_MAX
+COLLECT_BATCH_SIZE = 500
+# Collection is bound by the network rather than by --parallel, which throttles launches and setup
+COLLECT_PARALLEL = 32
+CHUNK_SIZE = 1024 * 1024
+PARTIAL_SUFFIX = '.part'
+
+# Sends one file from a byte offset as '<length>\n<bytes>', or '-\n' if it no longer exists. The
+# length is read when the file is sent, and the bytes are cut or zero-padded to it, so every frame is
+# exact even if the file grows or shrinks while it is sent. A padded copy is longer than the remote
+# file, which makes the next collection download it again from the start
+_SEND_FUNCTION = (
+    'send() { size=$(stat -c %s -- "$1" 2>/dev/null) || { echo -; return; }; n=$(( size - $2 )); '
+    '[ "$n" -lt 0 ] && n=0; printf "%d\\n" "$n"; '
+    'if [ "$n" -gt 0 ]; then { tail -c +$(( $2 + 1 )) -- "$1"; head -c "$n" /dev/zero; } | head -c "$n"; fi; }'
+)
+
+
+def collect_local_dir(vm_config):
+    """Return the local directory a VM's results are collected into."""
+    collect = vm_config.get('collect') or {}
+    return os.path.join(os.path.expanduser(collect.get('local_dir', DEFAULT_COLLECT_DIR)), vm_config['vm_name'])
+
+def local_relative_path(remote_path):
+    """Map a remote path, relative to the home directory or absolute, to a safe relative local path."""
+    parts = [part for part in remote_path.split('/') if part not in ('', '.', '..')]
+    return os.path.join(*parts) if parts else None
+
+def list_remote_files(host, user, patterns, ssh_manager):
+    """
+    Expand remote glob patterns, relative to the home directory, into a {path: size} dictionary.
+
+    Directories matched by a pattern are listed recursively. Patterns matching nothing are ignored.
+    """
+    script = (
+        'cd ~ && shopt -s nullglob globstar && set -- ' + ' '.join(patterns) +
+        " && [ $# -gt 0 ] && find \"$@\" -type f -printf '%s\\t%p\\n'; true"
+    )
+    result = ssh_manager.run(host, user, 'bash -c ' + shlex.quote(script), capture_output=True, text=True,
+                             check=True)
+    files = {}
+    for line in result.stdout.splitlines():
+        size, _, path = line.partition('\t')
+        if path and size.isdigit():
+            files[path] = int(size)
+    return files
+
+def plan_transfers(remote_files, local_dir):
+    """
+    Decide what to download for each remote file, resuming from any partial or shorter local copy.
+
+    :return: (remote path, local path, offset) tuples for the files that are not complete locally.
+    """
+    transfers = []
+    for remote_path, size in sorted(remote_files.items()):
+        relative_path = local_relative_path(remote_path)
+        if relative_path is None:
+            continue
+        local_path = os.path.join(local_dir, relative_path)
+        partial_path = local_path + PARTIAL_SUFFIX
+        if os.path.exists(local_path):
+            if os.path.getsize(local_path) == size:
+                continue
+            # The remote file grew since it was collected; fetch only the new bytes
+            os.replace(local_path, partial_path)
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        if offset > size:
+            # The remote file was truncated or replaced; start over
+            offset = 0
+        transfers.append((remote_path, local_path, offset))
+    return transfers
+
+def download_files(host, user, transfers, ssh_manager):
+    """
+    Stream the given files from a host over one ssh call, gzip-compressed on the remote side.
+
+    Each file is appended to its ``.part`` file from its offset, chunk by chunk, and renamed into
+    place once complete, so an interrupted download resumes where it stopped.
+
+    :return: The number of bytes written locally.
+    """
+    script = _SEND_FUNCTION + '; cd ~ && { ' + ' '.join(
+        f"send {shlex.quote(remote_path)} {offset};" for remote_path, _, offset in transfers
+    ) + ' } 2>/dev/null | gzip -1'
+    process = ssh_manager.popen(host, user, 'bash -c ' + shlex.quote(script),
+                                stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    written = 0
+    try:
+        with gzip.GzipFile(fileobj=process.stdout, mode='rb') as stream:
+            for remote_path, local_path, offset in transfers:
+                header = stream.readline().strip()
+                if header == b'-':
+                    print(f"{remote_path} was removed from {host} before it could be downloaded.")
+                    continue
+                if not header.isdigit():
+                    raise RuntimeError(f"Unexpected data while downloading {remote_path}.")
+                remaining = int(header)
+                partial_path = local_path + PARTIAL_SUFFIX
+                os.makedirs(os.path.dirname(local_path), exist_ok=True)
+                with open(partial_path, 'ab' if offset else 'wb') as f:
+                    while remaining:
+                        chunk = stream.read(min(CHUNK_SIZE, remaining))
+                        if not chunk:
+                            raise RuntimeError(f"Connection closed while downloading {remote_path}.")
+                        f.write(chunk)
+                        remaining -= len(chunk)
+                        written += len(chunk)
+                os.replace(partial_path, local_path)
+    except (EOFError, OSError) as e:
+        raise RuntimeError(f"Download from {host} was interrupted: {e}")
+    finally:
+        process.stdout.close()
+        stderr = process.stderr.read().decode(errors='replace').strip()
+        process.stderr.close()
+        exit_code = process.wait()
+    if exit_code != 0:
+        raise RuntimeError(f"Download from {host} exited with code {exit_code}. {stderr}")
+    return written
+
+def collect_files(host, user, patterns, local_dir, attempts=3, label=None, ssh_manager=None):
+    """
+    Download the remote files matching ``patterns`` into ``local_dir``, mirroring their paths.
+
+    Files already complete locally are skipped and partial ones are resumed. A failed
+    download is retried up to ``attempts`` times in total, each time resuming from what arrived.
+
+    :return: A dictionary with the number of files downloaded, skipped and bytes written.
+    """
+    ssh_manager = ssh_manager or get_ssh_manager()
+    label = label or host
+    result = {'downloaded': 0, 'skipped': 0, 'bytes': 0}
+    for attempt in range(1, attempts + 1):
+        try:
+            remote_files = list_remote_files(host, user, patterns, ssh_manager)
+            transfers = plan_transfers(remote_files, local_dir)
+            result['skipped'] = len(remote_files) - len(transfers)
+            for start in range(0, len(transfers), COLLECT_BATCH_SIZE):
+                batch = transfers[start:start + COLLECT_BATCH_SIZE]
+                result['bytes'] += download_files(host, user, batch, ssh_manager)
+                result['downloaded'] += len(batch)
+            break
+        except (RuntimeError, subprocess.CalledProcessError) as e:
+            if attempt == attempts:
+                raise RuntimeError(f"Collecting results failed after {attempts} attempts: {e}")
+            print(f"[{label}] Collecting results failed ({e}); resuming, attempt {attempt + 1}/{attempts}.")
+    print(f"[{label}] Collected {result['downloaded']} files ({result['bytes']} bytes) into {local_dir}; "
+          f"{result['skipped']} already complete.")
+    return result
+
+def collect_vm_results(vm_config, user='experiment', ssh_manager=None):
+    """Collect the results configured in a VM's 'collect' setting, or return None if it has none."""
+    collect = vm_config.get('collect')
+    if not collect or not collect.get('paths'):
+        return None
+    with span('collect.vm', vm=vm_config['vm_name']):
+        return collect_files(vm_config['public_ip'], user, collect['paths'], collect_local_dir(vm_config),
+                             label=vm_config['vm_name'], ssh_manager=ssh_manager)
+
+def collect_aws_fleet(aws_configs, parallel=COLLECT_PARALLEL, on_collected=None):
+    """
+    Collect the results of every deployed VM with a 'collect' setting, up to ``parallel`` VMs at once.
+
+    :param on_collected: Called as ``on_collected(aws_config, vm_config)`` as soon as each VM's own
+                         collection has finished, successfully or not, e.g. to terminate it.
+    :return: A list of dictionaries with each VM's name, transfer counts and error.
+    """
+    targets = [
+        (aws_config, vm_config)
+        for aws_config in aws_configs
+        for vm_config in aws_config['vm_configs']
+        if vm_config.get('collect') and vm_config.get('public_ip')
+    ]
+    results = []
+    if not targets:
+        return results
+
+    def collect_one(aws_config, vm_config):
+        result = {'vm_name': vm_config['vm_name'], 'error': None}
+        try:
+            result.update(collect_vm_results(vm_config) or {})
+        except Exception as e:
+            print(f"[{vm_config['vm_name']}] {e}")
+            result['error'] = str(e)
+        if on_collected is not None:
+            on_collected(aws_config, vm_config)
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(targets)))) as executor:
+        futures = [executor.submit(collect_one, aws_config, vm_config) for aws_config, vm_config in targets]
+        for future in as_completed(futures):
+            results.append(future.result())
+    return results
@@ -1,32 +1,72 @@
-import boto3
-import json
+import asyncio
 import os
+import re
 import subprocess
-import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
 from jinja2 import Template
-from cloudmanager.utils import divide_configs,  get_security_group_with_ssh
-
-
-def get_aws_resources(ec2_client, vm_config):
-    """Retrieve or validate AWS resources like VPC, Subnet, Security Group, Key Pair, and AMI ID."""
+from cloudmanager.utils import (
+    divide_configs, get_security_group_with_ssh, get_vpc_id, get_subnet_availability_zone, list_subnets,
+    get_key_pair_name
+)
+from cloudmanager.terraform import run_terraform, read_terraform_outputs, run_terraform_async, read_terraform_outputs_async
+from cloudmanager.readiness import InstanceReadiness, AsyncInstanceReadiness, wait_for_ssh, wait_for_ssh_async
+from cloudmanager.discovery import DiscoveryCache, account_key
+from cloudmanager.clients import get_ec2_client, get_sibling_client
+from cloudmanager.images import image_selector, selector_key, find_latest_image
+from cloudmanager.upload import upload_files, upload_files_async
+from cloudmanager.fanout import run_commands_on_host, run_commands_on_host_async
+from cloudmanager.latency import get_launch_timings, place_subnet
+from cloudmanager.tracing import span
+
+
+def get_aws_resources(ec2_client, vm_config, discovery_cache=None, account=''):
+    """
+    Retrieve or validate AWS resources like VPC, AMI ID, Subnet, Security Group, and Key Pair.
+
+    Lookups go through ``discovery_cache`` when one is given, so VMs in the same account and
+    region share a single set of describe calls. A VM with ``availability_zones`` or the 'latency'
+    placement gets its subnet from ``latency.place_subnet``.
+    """
     resources = {}
+    region = vm_config['region']
+
+    def discover(kind, query, fetch):
+        if discovery_cache is None:
+            return fetch()
+        return discovery_cache.lookup(account, region, kind, query, fetch)
 
     # Check or get VPC
     if 'vpc_id' in vm_config:
         vpc_id = vm_config['vpc_id']
     else:
-        vpc_response = ec2_client.describe_vpcs()
-        vpc_id = vpc_response['Vpcs'][0]['VpcId']  # Assuming the first VPC found
+        # The default VPC, or the first VPC found if there is none
+        vpc_id = discover('vpc', 'default', lambda: get_vpc_id(ec2_client))
     resources['vpc_id'] = vpc_id
     vm_config['vpc_id'] = vpc_id
 
-    # Check or get Subnet
+    # Get the latest AMI matching the VM's image selector in the region
+    selector = image_selector(vm_config)
+    ami_id = discover('ami', selector_key(selector), lambda: get_ami_id(ec2_client, vm_config))
+    resources['ami_id'] = ami_id
+
+    # Check or get Subnet, noting its availability zone for the launch latency history
     if 'subnet_id' in vm_config:
         subnet_id = vm_config['subnet_id']
+        resources['availability_zone'] = discover(
+            'subnet', subnet_id, lambda: get_subnet_availability_zone(ec2_client, subnet_id))
     else:
-        subnet_response = ec2_client.describe_subnets(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])
-        subnet_id = subnet_response['Subnets'][0]['SubnetId']  # Assuming the first subnet found
+        subnets = discover('subnets', vpc_id, lambda: list_subnets(ec2_client, vpc_id))
+        if vm_config.get('availability_zones') or vm_config.get('placement') == 'latency':
+            # A subnet in one of the allowed availability zones, chosen by the placement mode
+            subnet = place_subnet(subnets, vm_config, ami_id)
+        elif subnets:
+            # A default subnet of the VPC, or the first available one
+            subnet = subnets[0]
+        else:
+            raise ValueError(f"No available subnet found in VPC {vpc_id}.")
+        subnet_id = subnet['subnet_id']
+        resources['availability_zone'] = subnet['availability_zone']
         vm_config['subnet_id'] = subnet_id
     resources['subnet_id'] = subnet_id
 
@@ -34,7 +74,7 @@ def get_aws_resources(ec2_client, vm_config):
     if 'security_group_ids' in vm_config:
         security_group_ids = vm_config['security_group_ids']
     else:
-        security_group_ids = get_security_group_with_ssh(ec2_client, vpc_id)
+        security_group_ids = discover('security_group', vpc_id, lambda: get_security_group_with_ssh(ec2_client, vpc_id))
     resources['security_group_ids'] = security_group_ids
     vm_config['security_group_ids'] = security_group_ids
 
@@ -42,101 +82,158 @@ def get_aws_resources(ec2_client, vm_config):
     if 'key_pair_name' in vm_config:
         key_pair_name = vm_config['key_pair_name']
     else:
-        kp_response = ec2_client.describe_key_pairs()
-        key_pair_name = kp_response['KeyPairs'][0]['KeyName']  # Assuming the first key pair found
+        # Assuming the first key pair found
+        key_pair_name = discover('key_pair', 'first', lambda: get_key_pair_name(ec2_client))
         vm_config['key_pair_name'] = key_pair_name
     resources['key_pair_name'] = key_pair_name
 
-    # Get AMI ID based on the instance type and region
-    ami_id = get_ami_id(ec2_client)
-    resources['ami_id'] = ami_id
-
     return resources
 
+def get_ami_id(ec2_client, vm_config=None):
+    """
+    Retrieve the latest AMI ID matching a VM's image selector in the client's region.
 
-
-def get_ami_id(ec2_client):
-    """Retrieve an appropriate AMI ID based on the instance type and region."""
+    The image is read from the publisher's public SSM parameter when the client comes from the
+    shared client pool, with a filtered describe_images scan as the fallback.
+    """
     try:
-        # Example: Find the latest Ubuntu 20.04 LTS AMI in the region
-        ami_response = ec2_client.describe_images(
-            Filters=[
-                {'Name': 'name', 'Values': ['ubuntu/images/hvm-ssd/ubuntu-focal-20.04-amd64-server-*']},
-                {'Name': 'state', 'Values': ['available']}
-            ],
-            Owners=['099720109477'],  # Canonical's AWS account ID
-        )
-        if ami_response['Images']:
-            # Sort the AMIs by creation date to get the latest one
-            ami_response['Images'].sort(key=lambda x: x['CreationDate'], reverse=True)
-            return ami_response['Images'][0]['ImageId']  # Return the most recent AMI ID
-        else:
-            raise ValueError("No AMI found matching criteria.")
+        return find_latest_image(ec2_client, image_selector(vm_config or {}), get_sibling_client(ec2_client, 'ssm'))
     except ClientError as e:
         print(f"Error retrieving AMI ID: {e}")
         raise
 
-def generate_aws_terraform(access_key, secret_key, vm_config, resources, output_dir):
-    """Generate Terraform configuration file."""
-    ssh_public_key = ""  # Insert your SSH public key here as a string
+AWS_USER_DATA = """#!/bin/bash
+# Create the 'experiment' user
+sudo adduser experiment --gecos "Experiment User,,," --disabled-password
+echo "experiment:experimentpassword" | sudo chpasswd
+
+# Allow the 'experiment' user to use sudo without a password
+echo "experiment ALL=(ALL) NOPASSWD:ALL" | sudo tee /etc/sudoers.d/90-cloud-init-users
+
+# Permit password authentication in sshd_config
+sudo sed -i 's/^PasswordAuthentication no/PasswordAuthentication yes/' /etc/ssh/sshd_config
+
+# Add SSH public key to the 'experiment' user
+sudo mkdir -p /home/experiment/.ssh
+echo "{{ ssh_public_key }}" | sudo tee /home/experiment/.ssh/authorized_keys
+sudo chown -R experiment:experiment /home/experiment/.ssh
+sudo chmod 600 /home/experiment/.ssh/authorized_keys
+
+# Restart SSH service to apply changes
+sudo systemctl restart sshd
+"""
+
+# Templates are compiled once at import time and reused for every render.
+AWS_VM_TEMPLATE = Template("""
+provider "aws" {
+  region = "{{ region }}"
+  access_key = "{{ access_key }}"
+  secret_key = "{{ secret_key }}"
+}
+
+resource "aws_instance" "vm_instance" {
+  ami           = "{{ ami_id }}"
+  instance_type = "{{ instance_type }}"
+  subnet_id     = "{{ subnet_id }}"
+  vpc_security_group_ids = {{ security_group_ids }}
+  key_name      = "{{ key_pair_name }}"
+{% if not baked %}
+  user_data = <<-EOF
+""" + AWS_USER_DATA + """EOF
+{% endif %}
+
+  tags = {
+    Name = "{{ vm_name }}"
+  }
+}
+
+output "instance_id" {
+  value = aws_instance.vm_instance.id
+}
+
+output "public_ip" {
+  value = aws_instance.vm_instance.public_ip
+}
+
+output "private_ip" {
+  value = aws_instance.vm_instance.private_ip
+}
+""")
+
+AWS_FLEET_TEMPLATE = Template("""
+{% for region in regions %}
+provider "aws" {
+  alias      = "{{ region | replace('-', '_') }}"
+  region     = "{{ region }}"
+  access_key = "{{ access_key }}"
+  secret_key = "{{ secret_key }}"
+}
+{% endfor %}
+
+locals {
+  user_data = <<-EOF
+""" + AWS_USER_DATA + """EOF
+}
+{% for vm in vms %}
+resource "aws_instance" "{{ vm.resource_name }}" {
+  provider      = aws.{{ vm.region | replace('-', '_') }}
+  ami           = "{{ vm.ami_id }}"
+  instance_type = "{{ vm.instance_type }}"
+  subnet_id     = "{{ vm.subnet_id }}"
+  vpc_security_group_ids = {{ vm.security_group_ids }}
+  key_name      = "{{ vm.key_pair_name }}"
+{% if not vm.baked %}
+  user_data     = local.user_data
+{% endif %}
+
+  tags = {
+    Name = "{{ vm.vm_name }}"
+  }
+}
+{% endfor %}
+output "instances" {
+  value = {
+{% for vm in vms %}
+    "{{ vm.vm_name }}" = {
+      instance_id = aws_instance.{{ vm.resource_name }}.id
+      public_ip   = aws_instance.{{ vm.resource_name }}.public_ip
+      private_ip  = aws_instance.{{ vm.resource_name }}.private_ip
+    }
+{% endfor %}
+  }
+}
+""")
+
+AWS_USER_DATA_TEMPLATE = Template(AWS_USER_DATA)
+
+def read_ssh_public_key():
+    """Read the SSH public key that is installed for the 'experiment' user."""
     with open(os.path.expanduser("~/.ssh/id_rsa.pub"), "r") as key_file:
-        ssh_public_key = key_file.read().strip()
+        return key_file.read().strip()
 
-    template = Template("""
-    provider "aws" {
-      region = "{{ region }}"
-      access_key = "{{ access_key }}"
-      secret_key = "{{ secret_key }}"
-    }
+def render_user_data():
+    """Render the user_data script that prepares the 'experiment' user on a stock image."""
+    return AWS_USER_DATA_TEMPLATE.render(ssh_public_key=read_ssh_public_key())
 
-    resource "aws_instance" "vm_instance" {
-      ami           = "{{ ami_id }}"
-      instance_type = "{{ instance_type }}"
-      subnet_id     = "{{ subnet_id }}"
-      vpc_security_group_ids = {{ security_group_ids }}
-      key_name      = "{{ key_pair_name }}"
-
-      user_data = <<-EOF
-                  #!/bin/bash
-                  # Create the 'experiment' user
-                  sudo adduser experiment --gecos "Experiment User,,," --disabled-password
-                  echo "experiment:experimentpassword" | sudo chpasswd
-
-                  # Allow the 'experiment' user to use sudo without a password
-                  echo "experiment ALL=(ALL) NOPASSWD:ALL" | sudo tee /etc/sudoers.d/90-cloud-init-users
-
-                  # Permit password authentication in sshd_config
-                  sudo sed -i 's/^PasswordAuthentication no/PasswordAuthentication yes/' /etc/ssh/sshd_config
-
-                  # Add SSH public key to the 'experiment' user
-                  sudo mkdir -p /home/experiment/.ssh
-                  echo "{{ ssh_public_key }}" | sudo tee /home/experiment/.ssh/authorized_keys
-                  sudo chown -R experiment:experiment /home/experiment/.ssh
-                  sudo chmod 600 /home/experiment/.ssh/authorized_keys
-
-                  # Restart SSH service to apply changes
-                  sudo systemctl restart sshd
-                  EOF
-
-      tags = {
-        Name = "{{ vm_name }}"
-      }
-    }
-    """)
-    vm_config["vm_name"] = f"test-vm-{vm_config['region']}"
-    # Ensure security_group_ids is a valid Terraform list
-    security_group_ids_list = str(resources['security_group_ids']).replace("'", '"')
-    terraform_config = template.render(
+def to_terraform_list(values):
+    """Render a Python list of strings as a Terraform list literal."""
+    return str(list(values)).replace("'", '"')
+
+def generate_aws_terraform(access_key, secret_key, vm_config, resources, output_dir):
+    """Generate Terraform configuration file."""
+    vm_config.setdefault("vm_name", f"test-vm-{vm_config['region']}")
+    terraform_config = AWS_VM_TEMPLATE.render(
         region=vm_config['region'],
         access_key=str(access_key),  # Convert access_key to string
         secret_key=str(secret_key),  # Convert secret_key to string
         ami_id=resources['ami_id'],
         instance_type=vm_config['instance_type'],
         subnet_id=resources['subnet_id'],
-        security_group_ids=security_group_ids_list,
-        key_name=resources['key_pair_name'],
-        vm_name=vm_config.get('vm_name', f"test-vm-{vm_config['region']}"),
-        ssh_public_key=ssh_public_key
+        security_group_ids=to_terraform_list(resources['security_group_ids']),
+        key_pair_name=resources['key_pair_name'],
+        vm_name=vm_config['vm_name'],
+        baked=resources.get('baked', False),
+        ssh_public_key=read_ssh_public_key()
     )
 
     tf_file_path = os.path.join(output_dir, 'main.tf')
@@ -145,172 +242,566 @@ def generate_aws_terraform(access_key, secret_key, vm_config, resources, output_
     
     return tf_file_path
 
+def generate_aws_fleet_terraform(access_key, secret_key, vm_configs, resources_list, output_dir):
+    """
+    Generate a single Terraform configuration covering every VM of an AWS provider entry.
+
+    One aliased ``aws`` provider is emitted per region and one ``aws_instance`` resource per VM,
+    so the whole fleet is created by a single ``terraform apply``. Instance IDs and IPs are
+    exposed through the ``instances`` output, keyed by VM name.
+
+    :param vm_configs: The VM configurations to render; each must already have a ``vm_name``.
+    :param resources_list: The resources returned by ``get_aws_resources`` for each VM, in the same order.
+    :return: The path to the generated ``main.tf``.
+    """
+    vms = []
+    for vm_config, resources in zip(vm_configs, resources_list):
+        vms.append({
+            'resource_name': terraform_resource_name(vm_config['vm_name']),
+            'vm_name': vm_config['vm_name'],
+            'region': vm_config['region'],
+            'ami_id': resources['ami_id'],
+            'instance_type': vm_config['instance_type'],
+            'subnet_id': resources['subnet_id'],
+            'security_group_ids': to_terraform_list(resources['security_group_ids']),
+            'key_pair_name': resources['key_pair_name'],
+            'baked': resources.get('baked', False),
+        })
+
+    terraform_config = AWS_FLEET_TEMPLATE.render(
+        regions=sorted({vm['region'] for vm in vms}),
+        access_key=str(access_key),
+        secret_key=str(secret_key),
+        vms=vms,
+        ssh_public_key=read_ssh_public_key()
+    )
 
+    tf_file_path = os.path.join(output_dir, 'main.tf')
+    with open(tf_file_path, 'w') as f:
+        f.write(terraform_config)
 
+    return tf_file_path
 
-def run_terraform(output_dir):
-    """Initialize and apply Terraform configuration."""
-    subprocess.run(['terraform', 'init'], cwd=output_dir)
-    subprocess.run(['terraform', 'apply', '-auto-approve'], cwd=output_dir)
+def terraform_resource_name(vm_name):
+    """Turn a VM name into a valid Terraform resource name."""
+    return "vm_" + re.sub(r'[^A-Za-z0-9_]', '_', vm_name)
+
+def finish_aws_vm(readiness, vm_config, state=None):
+    """Wait for a launched VM to accept SSH logins, then copy files and run setup commands on it."""
+    vm_name = vm_config['vm_name']
+
+    # Wait until the public IP becomes available, unless Terraform already reported it
+    with span('deploy.wait_public_ip', vm=vm_name):
+        public_ip = vm_config.get('public_ip') or readiness.wait_for_public_ip(vm_config['instance_id'])
+    record_public_ip(readiness, vm_config, public_ip)
+
+    # Wait until the 'experiment' user can log in
+    with span('deploy.wait_ssh', vm=vm_name):
+        wait_for_ssh(public_ip, user='experiment')
+    record_ssh_ready(vm_config, state)
+
+    if skip_provisioning(vm_config, state):
+        return
+
+    # Upload files and custom code to the instance as one compressed bundle
+    with span('deploy.upload', vm=vm_name):
+        upload_files(public_ip, 'experiment', vm_config.get('files', []), vm_config.get('custom_code_path'))
+
+    # Optional: Run any initial setup commands via SSH
+    with span('deploy.setup', vm=vm_name):
+        run_initial_setup_commands(public_ip, 'experiment', vm_config.get('initial_commands', []), label=vm_name)
+    record_state(state, vm_config, 'provisioned')
+
+def record_public_ip(readiness, vm_config, public_ip):
+    """Set a VM's public IP once it is known and note it in the VM's launch timer."""
+    print(f"[{vm_config['vm_name']}] Deployed instance with public IP: {public_ip}")
+    vm_config['public_ip'] = public_ip
+    mark_public_ip(readiness, vm_config)
+
+def record_ssh_ready(vm_config, state=None):
+    """Finish a VM's launch timer and record it as ready once it accepts SSH logins."""
+    print(f"[{vm_config['vm_name']}] Instance is accepting SSH connections.")
+    get_launch_timings().finish(vm_config)
+    record_state(state, vm_config, 'ready')
+
+def skip_provisioning(vm_config, state=None):
+    """Return True, recording the VM as provisioned, if its instance needs no file upload or setup."""
+    vm_name = vm_config['vm_name']
+    # A baked image already contains the files and the result of the setup commands
+    if vm_config.get('baked_ami_id'):
+        print(f"[{vm_name}] Booted from baked image {vm_config['baked_ami_id']}; skipping file upload and setup.")
+    # A warm pool instance was provisioned with the same files and setup commands before it was stopped
+    elif is_warm_pool_instance(vm_config):
+        print(f"[{vm_name}] Restarted warm pool instance {vm_config['instance_id']}; skipping file upload and setup.")
+    else:
+        return False
+    record_state(state, vm_config, 'provisioned')
+    return True
+
+def is_warm_pool_instance(vm_config):
+    """Return True if a VM runs on an instance claimed from the warm pool rather than a new one."""
+    return bool(vm_config.get('instance_id')) and vm_config.get('warm_pool_instance_id') == vm_config['instance_id']
+
+def mark_public_ip(readiness, vm_config):
+    """Record in a VM's launch timer when it had a public IP and, if the poller saw it, when it was running."""
+    timings = get_launch_timings()
+    observation = readiness.observations.get(vm_config.get('instance_id')) or {}
+    if observation.get('running_at') is not None:
+        timings.mark(vm_config, 'running', at=observation['running_at'])
+    timings.mark(vm_config, 'public_ip', availability_zone=observation.get('availability_zone'))
+
+def record_state(state, vm_config, status):
+    """Record a VM's status in the deployment state, if one is being kept."""
+    if state is not None:
+        state.record(vm_config, status)
+
+def track_pending_instances(readiness, vm_configs):
+    """Start waiting for the public IP of every VM that has an instance ID but no IP yet."""
+    pending = {}
+    for vm_config in vm_configs:
+        if vm_config.get('instance_id') and not vm_config.get('public_ip'):
+            pending.setdefault(vm_config['region'], []).append(vm_config['instance_id'])
+    for region, instance_ids in pending.items():
+        readiness.track(region, instance_ids)
+
+def deploy_single_aws_vm(access_key, secret_key, vm_config, output_dir, discovery_cache=None, resources=None,
+                         state=None, readiness=None):
+    """
+    Deploy one AWS VM in its own Terraform working directory and update its config.
+
+    :param readiness: An ``InstanceReadiness`` shared by the VMs deployed together, so their public
+                      IPs are polled with one batched call per region; one for this VM if omitted.
+    """
+    vm_name = vm_config['vm_name']
+    ec2_client = get_ec2_client(access_key, secret_key, vm_config['region'])
+    if resources is None:
+        with span('deploy.discovery', vm=vm_name, region=vm_config['region']):
+            resources = get_aws_resources(ec2_client, vm_config, discovery_cache, account_key(access_key))
+    launch_single_aws_vm(access_key, secret_key, vm_config, output_dir, resources, state)
+
+    if readiness is None:
+        readiness = InstanceReadiness({vm_config['region']: ec2_client})
+    track_pending_instances(readiness, [vm_config])
+    finish_aws_vm(readiness, vm_config, state)
+
+def launch_single_aws_vm(access_key, secret_key, vm_config, output_dir, resources, state=None):
+    """Create one AWS VM with Terraform in ``output_dir/vm_name`` and set its instance ID and public IP."""
+    vm_output_dir = prepare_vm_terraform(access_key, secret_key, vm_config, resources, output_dir)
+
+    # Run Terraform to deploy the VM
+    with span('deploy.terraform', vm=vm_config['vm_name']):
+        run_terraform(vm_output_dir)
+
+    # Read the instance ID back from the Terraform outputs
+    record_vm_instance(vm_config, get_deployed_instance_info(vm_config, vm_output_dir), state)
+
+def prepare_vm_terraform(access_key, secret_key, vm_config, resources, output_dir):
+    """Render one VM's Terraform configuration into ``output_dir/vm_name``, start its launch timer and return that directory."""
+    vm_output_dir = os.path.join(output_dir, vm_config['vm_name'])
+    os.makedirs(vm_output_dir, exist_ok=True)
+    tf_file_path = generate_aws_terraform(access_key, secret_key, vm_config, resources, vm_output_dir)
+    print(f"[{vm_config['vm_name']}] Generated Terraform configuration at: {tf_file_path}")
+    get_launch_timings().start([(vm_config, resources)])
+    return vm_output_dir
+
+def record_vm_instance(vm_config, outputs, state=None):
+    """Set a VM's instance ID and public IP from its Terraform outputs and record it as launched."""
+    print(f"[{vm_config['vm_name']}] Instance ID for the deployed VM: {outputs.get('instance_id')}")
+    vm_config['instance_id'] = outputs.get('instance_id')
+    vm_config['public_ip'] = outputs.get('public_ip')
+    get_launch_timings().mark(vm_config, 'launch')
+    record_state(state, vm_config, 'launched')
+
+def assign_vm_names(vm_configs):
+    """Give every VM configuration without an explicit ``vm_name`` a default one."""
+    for index, vm_config in enumerate(vm_configs):
+        vm_config.setdefault('vm_name', f"test-vm-{vm_config['region']}-{index}")
+
+def resolved_resources_by_name(vm_configs, vm_resources):
+    """Map VM names to the resources precheck resolved for them, skipping VMs it could not resolve."""
+    if not vm_resources:
+        return {}
+    return {
+        vm_config['vm_name']: resources
+        for vm_config, resources in zip(vm_configs, vm_resources)
+        if resources is not None
+    }
+
+def vm_result(vm_config, error=None):
+    """Build the per-VM result dictionary returned by the deploy functions."""
+    return {
+        'vm_name': vm_config['vm_name'],
+        'region': vm_config['region'],
+        'instance_id': vm_config.get('instance_id'),
+        'public_ip': vm_config.get('public_ip'),
+        'error': error
+    }
 
-def deploy_aws_vm(aws_config, output_dir):
-    """Deploy AWS VMs using Terraform and SCP files to the instance, and update config with new information."""
+def _run_traced(func, *args):
+    vm_config = args[-1]
+    with span('deploy.vm', vm=vm_config['vm_name'], region=vm_config['region']):
+        return func(*args)
+
+def run_per_vm(vm_configs, parallel, func, *args, state=None):
+    """
+    Call ``func(*args, vm_config)`` for each VM on a bounded thread pool.
+
+    A failure on one VM is recorded in its result, and in ``state`` if the VM has an
+    instance, and does not abort the others.
+
+    :return: A list of per-VM result dictionaries, in ``vm_configs`` order.
+    """
+    results = [None] * len(vm_configs)
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        futures = {
+            executor.submit(_run_traced, func, *args, vm_config): index
+            for index, vm_config in enumerate(vm_configs)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            vm_config = vm_configs[index]
+            try:
+                future.result()
+                results[index] = vm_result(vm_config)
+            except Exception as e:
+                print(f"[{vm_config['vm_name']}] Deployment failed: {e}")
+                results[index] = vm_result(vm_config, str(e))
+                if vm_config.get('instance_id'):
+                    record_state(state, vm_config, 'failed')
+
+    return results
+
+def deploy_aws_vm(aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None, state=None):
+    """
+    Deploy AWS VMs using Terraform and SCP files to the instances, and update config with new information.
+
+    Each VM is deployed from its own working directory under ``output_dir`` so that
+    up to ``parallel`` VMs can be provisioned at once without sharing Terraform state.
+
+    :param aws_config: The AWS provider entry from the configuration file.
+    :param output_dir: The directory under which per-VM Terraform directories are created.
+    :param parallel: The maximum number of VMs to deploy concurrently.
+    :param discovery_cache: An optional DiscoveryCache; an in-memory one is used if omitted.
+    :param vm_resources: Optional resources already resolved by precheck, one entry per VM.
+    :param state: An optional DeploymentState that records every VM as it changes status.
+    :return: A list of per-VM result dictionaries, in ``vm_configs`` order.
+    """
     access_key = aws_config['credentials']['access_key']
     secret_key = aws_config['credentials']['secret_key']
+    vm_configs = aws_config['vm_configs']
+    assign_vm_names(vm_configs)
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache(path=None)
+    resources_by_name = resolved_resources_by_name(vm_configs, vm_resources)
+    account_state = state.for_account(access_key) if state is not None else None
+    readiness = InstanceReadiness({
+        region: get_ec2_client(access_key, secret_key, region)
+        for region in {vm_config['region'] for vm_config in vm_configs}
+    })
+
+    def deploy_one(vm_config):
+        deploy_single_aws_vm(access_key, secret_key, vm_config, output_dir, discovery_cache,
+                             resources_by_name.get(vm_config['vm_name']), account_state, readiness)
+
+    return run_per_vm(vm_configs, parallel, deploy_one, state=account_state)
+
+def deploy_aws_fleet(aws_config, output_dir, parallel=1, terraform_parallelism=10, fleet_name='aws-fleet',
+                     discovery_cache=None, vm_resources=None, state=None):
+    """
+    Deploy every VM of an AWS provider entry with a single Terraform plan.
+
+    All VMs are rendered into ``output_dir/fleet_name/main.tf`` and created by one
+    ``terraform apply`` that uses Terraform's own parallelism. File copies and setup
+    commands then run on up to ``parallel`` VMs at once.
+
+    :return: A list of per-VM result dictionaries, in ``vm_configs`` order.
+    """
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    vm_configs = aws_config['vm_configs']
+    assign_vm_names(vm_configs)
+
+    fleet_output_dir = os.path.join(output_dir, fleet_name)
+    os.makedirs(fleet_output_dir, exist_ok=True)
+
+    ec2_clients = {}
+    for region in {vm_config['region'] for vm_config in vm_configs}:
+        ec2_clients[region] = get_ec2_client(access_key, secret_key, region)
+
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache(path=None)
+    account = account_key(access_key)
+    resources_by_name = resolved_resources_by_name(vm_configs, vm_resources)
+    with span('deploy.discovery', fleet=fleet_name):
+        resources_list = [
+            resources_by_name.get(vm_config['vm_name'])
+            or get_aws_resources(ec2_clients[vm_config['region']], vm_config, discovery_cache, account)
+            for vm_config in vm_configs
+        ]
+    tf_file_path = generate_aws_fleet_terraform(access_key, secret_key, vm_configs, resources_list, fleet_output_dir)
+    print(f"Generated fleet Terraform configuration for {len(vm_configs)} VMs at: {tf_file_path}")
+
+    account_state = state.for_account(access_key) if state is not None else None
+    get_launch_timings().start(zip(vm_configs, resources_list))
+    apply_error = None
+    try:
+        with span('deploy.terraform', fleet=fleet_name):
+            run_terraform(fleet_output_dir, parallelism=terraform_parallelism)
+    except subprocess.CalledProcessError as e:
+        # Carry on with whatever was created, so those instances are provisioned and torn down as usual
+        apply_error = f"Terraform apply of {fleet_name} failed: {e}"
+        print(apply_error)
+    launched = record_fleet_instances(vm_configs, get_fleet_instance_info(fleet_output_dir), account_state)
+
+    return fleet_results(vm_configs, finish_aws_vms(aws_config, launched, parallel, state), apply_error)
+
+def record_fleet_instances(vm_configs, fleet_info, state=None):
+    """
+    Set the instance ID and public IP of every VM the fleet apply created, even partially, and record it as launched.
+
+    :param fleet_info: The fleet's 'instances' output, mapping each VM name to its instance ID and public IP.
+    :return: The VMs that got an instance.
+    """
+    launched = []
+    for vm_config in vm_configs:
+        instance_info = fleet_info.get(vm_config['vm_name'], {})
+        if instance_info.get('instance_id'):
+            vm_config['instance_id'] = instance_info['instance_id']
+            vm_config['public_ip'] = instance_info.get('public_ip')
+            get_launch_timings().mark(vm_config, 'launch')
+            record_state(state, vm_config, 'launched')
+            launched.append(vm_config)
+    return launched
+
+def fleet_results(vm_configs, finished, apply_error=None):
+    """Merge the launched VMs' results with a failure for each VM the fleet apply did not create, in ``vm_configs`` order."""
+    results_by_name = {result['vm_name']: result for result in finished}
+    return [
+        results_by_name.get(vm_config['vm_name'])
+        or vm_result(vm_config, apply_error or "Terraform did not report an instance ID for this VM.")
+        for vm_config in vm_configs
+    ]
+
+def finish_aws_vms(aws_config, vm_configs, parallel=1, state=None):
+    """
+    Bring already launched VMs of an AWS provider entry to the provisioned state.
+
+    One batched poll per region covers every instance still waiting for an IP, and up to
+    ``parallel`` VMs upload files and run setup commands at once.
+
+    :return: A list of per-VM result dictionaries, in ``vm_configs`` order.
+    """
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    readiness = InstanceReadiness({
+        region: get_ec2_client(access_key, secret_key, region)
+        for region in {vm_config['region'] for vm_config in vm_configs}
+    })
+    track_pending_instances(readiness, vm_configs)
+    account_state = state.for_account(access_key) if state is not None else None
+
+    def finish_one(vm_config):
+        if not vm_config.get('instance_id'):
+            raise RuntimeError("Terraform did not report an instance ID for this VM.")
+        finish_aws_vm(readiness, vm_config, account_state)
 
-    for vm_config in aws_config['vm_configs']:
-        ec2_client = boto3.client(
-            'ec2',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=vm_config['region']  # Default to the first region in the list
-        )
-        resources = get_aws_resources(ec2_client, vm_config)
-        tf_file_path = generate_aws_terraform(access_key, secret_key, vm_config, resources, output_dir)
-        print(f"Generated Terraform configuration at: {tf_file_path}")
-        
-        # Run Terraform to deploy the VM
-        run_terraform(output_dir)
-
-        # Wait until instance_id is available
-        instance_id = wait_for_instance_id(ec2_client, f"test-vm-{vm_config['region']}")
-        print(f"Instance ID for the deployed VM: {instance_id}")
-        vm_config['instance_id'] = instance_id
-        
-        # Wait until the public IP becomes available
-        public_ip = wait_for_public_ip(ec2_client, instance_id)
-        print(f"Deployed instance with public IP: {public_ip}")
-
-        # Allow some time for the instance to be fully ready (optional, depends on your use case)
-        time.sleep(30)  # Wait 30 seconds for the instance to be fully ready
-
-        # SCP files to the instance
-        scp_files_to_instance(public_ip, 'experiment', vm_config.get('files', []))
-
-        # Optional: Run any initial setup commands via SSH
-        run_initial_setup_commands(public_ip, 'experiment', vm_config.get('initial_commands', []))
-
-        # Update vm_config with instance_id and public_ip
-        vm_config['instance_id'] = instance_id
-        vm_config['public_ip'] = public_ip
-
-def run_terraform(output_dir):
-    """Initialize and apply Terraform configuration."""
-    subprocess.run(['terraform', 'init'], cwd=output_dir)
-    subprocess.run(['terraform', 'apply', '-auto-approve'], cwd=output_dir)
-
-def wait_for_instance_id(ec2_client, vm_name, timeout=300, interval=10):
-    """Wait until the instance ID is available using boto3."""
-    elapsed_time = 0
-    while elapsed_time < timeout:
-        try:
-            response = ec2_client.describe_instances(
-                Filters=[
-                    {'Name': 'tag:Name', 'Values': [vm_name]},
-                    {'Name': 'instance-state-name', 'Values': ['pending', 'running']}
-                ]
-            )
-            instances = response.get('Reservations', [])
-            for reservation in instances:
-                for instance in reservation['Instances']:
-                    instance_id = instance.get('InstanceId')
-                    if instance_id:
-                        return instance_id
-
-        except Exception as e:
-            print(f"Error retrieving instance ID: {e}")
-        
-        time.sleep(interval)
-        elapsed_time += interval
-        print(f"Waiting for instance ID... Elapsed time: {elapsed_time}s")
-
-    raise TimeoutError(f"Timeout waiting for instance ID for VM with name {vm_name}")
+    return run_per_vm(vm_configs, parallel, finish_one, state=account_state)
 
 def get_deployed_instance_info(vm_config, output_dir):
     """Retrieve information about the deployed instance from Terraform output."""
-    terraform_output = subprocess.run(
-        ['terraform', 'output', '-json'],
-        cwd=output_dir,
-        capture_output=True,
-        text=True
-    )
-    outputs = json.loads(terraform_output.stdout)
+    outputs = read_terraform_outputs(output_dir)
 
     instance_info = {
-        'instance_id': outputs.get('instance_id', {}).get('value'),
-        'public_ip': outputs.get('public_ip', {}).get('value'),
-        'private_ip': outputs.get('private_ip', {}).get('value'),
+        'instance_id': outputs.get('instance_id'),
+        'public_ip': outputs.get('public_ip'),
+        'private_ip': outputs.get('private_ip'),
         'vm_name': vm_config.get('vm_name', f"test-vm-{vm_config['region']}")
     }
 
     return instance_info
 
-def wait_for_public_ip(ec2_client, instance_id, timeout=300, interval=10):
-    """Wait until the instance has a public IP address."""
-    elapsed_time = 0
-    while elapsed_time < timeout:
-        try:
-            response = ec2_client.describe_instances(InstanceIds=[instance_id])
-            public_ip = response['Reservations'][0]['Instances'][0].get('PublicIpAddress')
-            if public_ip:
-                return public_ip
-        except Exception as e:
-            print(f"Error retrieving public IP: {e}")
-        
-        time.sleep(interval)
-        elapsed_time += interval
-        print(f"Waiting for public IP... Elapsed time: {elapsed_time}s")
-
-    raise TimeoutError(f"Timeout waiting for public IP for instance {instance_id}")
-
-def scp_files_to_instance(public_ip, user, files):
-    """SCP files to the instance."""
-    # Ensure the SSH private key has the correct permissions
-    ssh_private_key_path = os.path.expanduser("~/.ssh/id_rsa")
-    subprocess.run(['chmod', '600', ssh_private_key_path])
-
-    for file in files:
-        print(f"Copying {file} to {user}@{public_ip}:~")
-        subprocess.run([
-            'scp',
-            '-o', 'StrictHostKeyChecking=no',  # Disable host key checking prompt
-            '-i', ssh_private_key_path,  # Specify the private key to use
-            file, f"{user}@{public_ip}:~"
-        ])
-
-def run_initial_setup_commands(public_ip, user, commands):
-    """Run initial setup commands via SSH."""
-    for command in commands:
-        print(f"Running command on {user}@{public_ip}: {command}")
-        subprocess.run(['ssh', f"{user}@{public_ip}", command])
-
-def terminate_aws_instance(access_key, secret_key, region, instance_id):
-    """Terminate a specific AWS EC2 instance by instance ID."""
-    ec2_client = boto3.client(
-            'ec2',
-            aws_access_key_id=access_key,
-            aws_secret_access_key=secret_key,
-            region_name=region # Default to the first region in the list
-        )
-
-    print("===============================================================: " , instance_id)
+def get_fleet_instance_info(output_dir):
+    """Retrieve information about every instance of a fleet, keyed by VM name, from Terraform output."""
+    outputs = read_terraform_outputs(output_dir)
+    return outputs.get('instances') or {}
+
+def run_initial_setup_commands(public_ip, user, commands, label=None):
+    """Run initial setup commands via SSH, streaming their output, and raise if any of them fails."""
+    result = run_commands_on_host(public_ip, user, commands, label=label)
+    if result['error']:
+        raise RuntimeError(result['error'])
+    return result
+
+async def finish_aws_vm_async(readiness, vm_config, state=None):
+    """Coroutine counterpart of ``finish_aws_vm``, waiting on an ``AsyncInstanceReadiness``."""
+    vm_name = vm_config['vm_name']
+
+    with span('deploy.wait_public_ip', vm=vm_name):
+        public_ip = vm_config.get('public_ip') or await readiness.wait_for_public_ip(vm_config['instance_id'])
+    record_public_ip(readiness, vm_config, public_ip)
+
+    with span('deploy.wait_ssh', vm=vm_name):
+        await wait_for_ssh_async(public_ip, user='experiment')
+    # Finishing the timer writes to the latency history
+    await asyncio.to_thread(record_ssh_ready, vm_config, state)
+
+    if skip_provisioning(vm_config, state):
+        return
+
+    with span('deploy.upload', vm=vm_name):
+        await upload_files_async(public_ip, 'experiment', vm_config.get('files', []), vm_config.get('custom_code_path'))
+
+    with span('deploy.setup', vm=vm_name):
+        await run_initial_setup_commands_async(public_ip, 'experiment', vm_config.get('initial_commands', []),
+                                               label=vm_name)
+    record_state(state, vm_config, 'provisioned')
+
+async def deploy_single_aws_vm_async(access_key, secret_key, vm_config, output_dir, readiness, discovery_cache=None,
+                                     resources=None, state=None):
+    """Coroutine counterpart of ``deploy_single_aws_vm``, sharing one ``AsyncInstanceReadiness`` across VMs."""
+    vm_name = vm_config['vm_name']
+    if resources is None:
+        ec2_client = readiness.ec2_clients[vm_config['region']]
+        with span('deploy.discovery', vm=vm_name, region=vm_config['region']):
+            resources = await asyncio.to_thread(
+                get_aws_resources, ec2_client, vm_config, discovery_cache, account_key(access_key))
+    vm_output_dir = prepare_vm_terraform(access_key, secret_key, vm_config, resources, output_dir)
+
+    with span('deploy.terraform', vm=vm_name):
+        await run_terraform_async(vm_output_dir)
+    record_vm_instance(vm_config, await read_terraform_outputs_async(vm_output_dir), state)
+
+    track_pending_instances(readiness, [vm_config])
+    await finish_aws_vm_async(readiness, vm_config, state)
+
+async def _run_traced_async(semaphore, func, vm_config):
+    async with semaphore:
+        with span('deploy.vm', vm=vm_config['vm_name'], region=vm_config['region']):
+            return await func(vm_config)
+
+async def run_per_vm_async(vm_configs, parallel, func, state=None):
+    """
+    Coroutine counterpart of ``run_per_vm``: await ``func(vm_config)`` for each VM, at most
+    ``parallel`` at once, recording a failure on one VM without aborting the others.
+
+    :return: A list of per-VM result dictionaries, in ``vm_configs`` order.
+    """
+    semaphore = asyncio.Semaphore(max(1, parallel))
+    outcomes = await asyncio.gather(
+        *(_run_traced_async(semaphore, func, vm_config) for vm_config in vm_configs),
+        return_exceptions=True
+    )
+    results = []
+    for vm_config, outcome in zip(vm_configs, outcomes):
+        if isinstance(outcome, Exception):
+            print(f"[{vm_config['vm_name']}] Deployment failed: {outcome}")
+            results.append(vm_result(vm_config, str(outcome)))
+            if vm_config.get('instance_id'):
+                record_state(state, vm_config, 'failed')
+        else:
+            results.append(vm_result(vm_config))
+    return results
+
+async def ec2_clients_async(access_key, secret_key, vm_configs):
+    """Create, or reuse from the client pool, one EC2 client per region of the given VMs."""
+    regions = sorted({vm_config['region'] for vm_config in vm_configs})
+    clients = await asyncio.gather(*(
+        asyncio.to_thread(get_ec2_client, access_key, secret_key, region) for region in regions
+    ))
+    return dict(zip(regions, clients))
+
+async def deploy_aws_vm_async(aws_config, output_dir, parallel=1, discovery_cache=None, vm_resources=None, state=None):
+    """
+    Coroutine counterpart of ``deploy_aws_vm`` for the asyncio engine.
+
+    Terraform, ssh and scp run as asyncio subprocesses and blocking EC2 calls are offloaded to
+    worker threads, so ``parallel`` bounds the VMs in flight through a semaphore rather than a
+    thread per VM. Public IPs are polled with one batched call per region for all VMs.
+
+    :return: A list of per-VM result dictionaries, in ``vm_configs`` order.
+    """
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    vm_configs = aws_config['vm_configs']
+    assign_vm_names(vm_configs)
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache(path=None)
+    resources_by_name = resolved_resources_by_name(vm_configs, vm_resources)
+    account_state = state.for_account(access_key) if state is not None else None
+    readiness = AsyncInstanceReadiness(await ec2_clients_async(access_key, secret_key, vm_configs))
+
+    async def deploy_one(vm_config):
+        await deploy_single_aws_vm_async(access_key, secret_key, vm_config, output_dir, readiness, discovery_cache,
+                                         resources_by_name.get(vm_config['vm_name']), account_state)
+
+    return await run_per_vm_async(vm_configs, parallel, deploy_one, state=account_state)
+
+async def deploy_aws_fleet_async(aws_config, output_dir, parallel=1, terraform_parallelism=10, fleet_name='aws-fleet',
+                                 discovery_cache=None, vm_resources=None, state=None):
+    """Coroutine counterpart of ``deploy_aws_fleet``."""
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    vm_configs = aws_config['vm_configs']
+    assign_vm_names(vm_configs)
+
+    fleet_output_dir = os.path.join(output_dir, fleet_name)
+    os.makedirs(fleet_output_dir, exist_ok=True)
+    ec2_clients = await ec2_clients_async(access_key, secret_key, vm_configs)
+
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache(path=None)
+    account = account_key(access_key)
+    resources_by_name = resolved_resources_by_name(vm_configs, vm_resources)
+
+    async def resolve(vm_config):
+        resources = resources_by_name.get(vm_config['vm_name'])
+        if resources is None:
+            resources = await asyncio.to_thread(
+                get_aws_resources, ec2_clients[vm_config['region']], vm_config, discovery_cache, account)
+        return resources
+
+    with span('deploy.discovery', fleet=fleet_name):
+        resources_list = await asyncio.gather(*(resolve(vm_config) for vm_config in vm_configs))
+    tf_file_path = generate_aws_fleet_terraform(access_key, secret_key, vm_configs, resources_list, fleet_output_dir)
+    print(f"Generated fleet Terraform configuration for {len(vm_configs)} VMs at: {tf_file_path}")
+
+    account_state = state.for_account(access_key) if state is not None else None
+    get_launch_timings().start(zip(vm_configs, resources_list))
+    apply_error = None
     try:
-        # Terminate the instance
-        response = ec2_client.terminate_instances(InstanceIds=[instance_id])
-        print(f"Initiated termination for instance: {instance_id}")
-
-        # Check the status of the instance termination
-        for instance in response['TerminatingInstances']:
-            current_state = instance['CurrentState']['Name']
-            previous_state = instance['PreviousState']['Name']
-            print(f"Instance {instance['InstanceId']} is changing from {previous_state} to {current_state}.")
-        
-        return True
+        with span('deploy.terraform', fleet=fleet_name):
+            await run_terraform_async(fleet_output_dir, parallelism=terraform_parallelism)
+    except subprocess.CalledProcessError as e:
+        # Carry on with whatever was created, so those instances are provisioned and torn down as usual
+        apply_error = f"Terraform apply of {fleet_name} failed: {e}"
+        print(apply_error)
+    fleet_info = (await read_terraform_outputs_async(fleet_output_dir)).get('instances') or {}
+    launched = record_fleet_instances(vm_configs, fleet_info, account_state)
+
+    return fleet_results(vm_configs, await finish_aws_vms_async(aws_config, launched, parallel, state), apply_error)
+
+async def finish_aws_vms_async(aws_config, vm_configs, parallel=1, state=None):
+    """Coroutine counterpart of ``finish_aws_vms``."""
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    readiness = AsyncInstanceReadiness(await ec2_clients_async(access_key, secret_key, vm_configs))
+    track_pending_instances(readiness, vm_configs)
+    account_state = state.for_account(access_key) if state is not None else None
+
+    async def finish_one(vm_config):
+        if not vm_config.get('instance_id'):
+            raise RuntimeError("Terraform did not report an instance ID for this VM.")
+        await finish_aws_vm_async(readiness, vm_config, account_state)
+
+    return await run_per_vm_async(vm_configs, parallel, finish_one, state=account_state)
+
+async def run_initial_setup_commands_async(public_ip, user, commands, label=None):
+    """Coroutine counterpart of ``run_initial_setup_commands``."""
+    result = await run_commands_on_host_async(public_ip, user, commands, label=label)
+    if result['error']:
+        raise RuntimeError(result['error'])
+    return result
 
-    except ClientError as e:
-        print(f"Error terminating instance {instance_id}: {e}")
-        return False
-    
 # Example usage
 if __name__ == "__main__":
     output_dir = "./terraform"  # Directory where Terraform files will be generated
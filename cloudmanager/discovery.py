@@ -0,0 +1,96 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.expanduser('~/.cloudmanager/discovery-cache.json')
+
+# Seconds each kind of discovered resource stays valid on disk
+DEFAULT_TTLS = {
+    'vpc': 24 * 3600,
+    'subnet': 24 * 3600,
+    'subnets': 24 * 3600,
+    'security_group': 3600,
+    'key_pair': 3600,
+    'ami': 6 * 3600,
+}
+
+
+def account_key(access_key):
+    """Return a stable, non-reversible identifier for the account behind an access key."""
+    return hashlib.sha256(str(access_key).encode()).hexdigest()[:16]
+
+
+class DiscoveryCache:
+    """
+    Cache AWS resource discovery results in memory and on disk.
+
+    Entries are keyed by (account, region, kind, query) and expire after the TTL configured for
+    their kind. Concurrent lookups of the same key from several threads trigger a single fetch.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttls=None, refresh=False):
+        """
+        :param path: The JSON file the cache is persisted to, or None to keep it in memory only.
+        :param ttls: Optional overrides of DEFAULT_TTLS, in seconds per kind.
+        :param refresh: If True, ignore entries already on disk and rediscover everything.
+        """
+        self.path = path
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._entries = {}
+        if path and not refresh:
+            self._entries = self._load()
+
+    def lookup(self, account, region, kind, query, fetch):
+        """Return the cached value for the key, calling fetch() and storing its result on a miss."""
+        key = '|'.join([account, region, kind, query])
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry and time.time() - entry['stored_at'] < self.ttls.get(kind, 0):
+                    self.hits += 1
+                    return entry['value']
+                self.misses += 1
+
+            value = fetch()
+            with self._lock:
+                self._entries[key] = {'stored_at': time.time(), 'value': value}
+                self._save()
+            return value
+
+    def invalidate(self, account=None, region=None, kind=None):
+        """Drop every entry matching the given account, region and kind (None matches anything)."""
+        with self._lock:
+            for key in list(self._entries):
+                entry_account, entry_region, entry_kind, _ = key.split('|', 3)
+                if (account in (None, entry_account) and region in (None, entry_region)
+                        and kind in (None, entry_kind)):
+                    del self._entries[key]
+            self._save()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        if not self.path:
+            return
+        directory = os.path.dirname(self.path) or '.'
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so a crash never leaves a truncated cache behind
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._entries, f)
+        os.replace(tmp_path, self.path)
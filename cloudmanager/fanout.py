@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from cloudmanager.ssh import get_ssh_manager
+from cloudmanager.utils import divide_configs
+
+_print_lock = threading.Lock()
+
+
+def _stream(pipe, prefix, output):
+    """Copy lines from a pipe to an output stream, prefixing each one."""
+    for line in iter(pipe.readline, ''):
+        with _print_lock:
+            output.write(f"{prefix} {line}" if line.endswith('\n') else f"{prefix} {line}\n")
+            output.flush()
+    pipe.close()
+
+def run_commands_on_host(host, user, commands, label=None, stop_event=None, ssh_manager=None):
+    """
+    Run commands one after another on a host, streaming their output with a host prefix.
+
+    The host stops at its first failing command. If stop_event is set by another host,
+    commands that have not started yet are skipped.
+
+    :return: A dictionary with the host, per-command exit codes and durations, and an error if any command failed.
+    """
+    ssh_manager = ssh_manager or get_ssh_manager()
+    label = label or host
+    result = {'label': label, 'host': host, 'commands': [], 'duration': 0.0, 'error': None}
+    start = time.monotonic()
+
+    for command in commands:
+        if stop_event is not None and stop_event.is_set():
+            result['error'] = "Skipped after a failure on another host."
+            break
+
+        with _print_lock:
+            print(f"[{label}] $ {command}")
+        command_start = time.monotonic()
+        process = ssh_manager.popen(
+            host, user, command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        readers = [
+            threading.Thread(target=_stream, args=(process.stdout, f"[{label}]", sys.stdout)),
+            threading.Thread(target=_stream, args=(process.stderr, f"[{label}!]", sys.stderr)),
+        ]
+        for reader in readers:
+            reader.start()
+        exit_code = process.wait()
+        for reader in readers:
+            reader.join()
+
+        result['commands'].append({
+            'command': command,
+            'exit_code': exit_code,
+            'duration': time.monotonic() - command_start
+        })
+        if exit_code != 0:
+            result['error'] = f"Command '{command}' exited with code {exit_code}."
+            break
+
+    result['duration'] = time.monotonic() - start
+    return result
+
+async def _stream_async(reader, prefix, output):
+    """Coroutine counterpart of ``_stream`` for an asyncio stream."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        line = line.decode(errors='replace')
+        with _print_lock:
+            output.write(f"{prefix} {line}" if line.endswith('\n') else f"{prefix} {line}\n")
+            output.flush()
+
+async def run_commands_on_host_async(host, user, commands, label=None, ssh_manager=None):
+    """
+    Coroutine counterpart of ``run_commands_on_host``: run commands one after another on a host,
+    streaming their output with a host prefix and stopping at the first failure.
+
+    :return: A dictionary with the host, per-command exit codes and durations, and an error if any command failed.
+    """
+    ssh_manager = ssh_manager or get_ssh_manager()
+    label = label or host
+    result = {'label': label, 'host': host, 'commands': [], 'duration': 0.0, 'error': None}
+    start = time.monotonic()
+
+    for command in commands:
+        with _print_lock:
+            print(f"[{label}] $ {command}")
+        command_start = time.monotonic()
+        process = await ssh_manager.exec_async(host, user, command)
+        await asyncio.gather(
+            _stream_async(process.stdout, f"[{label}]", sys.stdout),
+            _stream_async(process.stderr, f"[{label}!]", sys.stderr),
+        )
+        exit_code = await process.wait()
+
+        result['commands'].append({
+            'command': command,
+            'exit_code': exit_code,
+            'duration': time.monotonic() - command_start
+        })
+        if exit_code != 0:
+            result['error'] = f"Command '{command}' exited with code {exit_code}."
+            break
+
+    result['duration'] = time.monotonic() - start
+    return result
+
+def fan_out(targets, commands, parallel=10, fail_fast=False, ssh_manager=None):
+    """
+    Run the same command list on many hosts at once.
+
+    :param targets: A list of dictionaries with 'host', 'user' and an optional 'label'.
+    :param commands: The commands to run, in order, on every host.
+    :param parallel: The maximum number of hosts running commands at once.
+    :param fail_fast: If True, stop starting new commands anywhere once one host fails.
+    :return: A list of per-host results from run_commands_on_host, in targets order.
+    """
+    stop_event = threading.Event()
+
+    def run_target(target):
+        result = run_commands_on_host(
+            target['host'], target['user'], commands, target.get('label'), stop_event, ssh_manager)
+        if result['error'] and fail_fast:
+            stop_event.set()
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, parallel)) as executor:
+        return list(executor.map(run_target, targets))
+
+def fleet_targets(aws_configs, user='experiment'):
+    """Build fan_out targets from every deployed VM (one with a public_ip) in the AWS configs."""
+    return [
+        {'host': vm_config['public_ip'], 'user': user, 'label': vm_config.get('vm_name', vm_config['public_ip'])}
+        for aws_config in aws_configs
+        for vm_config in aws_config['vm_configs']
+        if vm_config.get('public_ip')
+    ]
+
+def print_fan_out_summary(results):
+    """Print the exit code and duration of every host's run."""
+    for result in results:
+        exit_codes = ','.join(str(command['exit_code']) for command in result['commands']) or '-'
+        status = 'FAILED' if result['error'] else 'ok'
+        print(f"{result['label']:<30} {status:<7} exit codes: {exit_codes:<12} {result['duration']:.1f}s"
+              + (f"  {result['error']}" if result['error'] else ''))
+
+def main():
+    """Run ad-hoc commands on every instance of an existing deployment."""
+    parser = argparse.ArgumentParser(description="Run commands on every deployed instance.")
+    parser.add_argument("commands", nargs='+', help="Commands to run, in order, on every instance.")
+    parser.add_argument("-c", "--config", type=str, help="Configuration YAML file with public_ip set on deployed VMs.")
+    parser.add_argument("--host", action="append", default=[], help="Additional host to run on (repeatable).")
+    parser.add_argument("-u", "--user", type=str, default="experiment", help="Remote user (default: experiment).")
+    parser.add_argument("-p", "--parallel", type=int, default=10, help="Maximum number of hosts at once (default: 10).")
+    parser.add_argument("--fail-fast", action="store_true", help="Stop starting commands once any host fails.")
+    args = parser.parse_args()
+
+    targets = [{'host': host, 'user': args.user} for host in args.host]
+    if args.config:
+        aws_configs, _ = divide_configs(args.config)
+        targets.extend(fleet_targets(aws_configs, args.user))
+    if not targets:
+        print("No hosts to run on.")
+        sys.exit(1)
+
+    results = fan_out(targets, args.commands, parallel=args.parallel, fail_fast=args.fail_fast)
+    print_fan_out_summary(results)
+    sys.exit(1 if any(result['error'] for result in results) else 0)
+
+if __name__ == "__main__":
+    main()
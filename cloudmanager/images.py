@@ -0,0 +1,108 @@
+from botocore.exceptions import ClientError
+
+# The image used when a VM config has no 'image' selector
+DEFAULT_IMAGE = {'os': 'ubuntu', 'version': '20.04', 'arch': 'amd64'}
+
+# EC2 architecture names for the arch values accepted in selectors
+ARCHITECTURES = {'amd64': 'x86_64', 'x86_64': 'x86_64', 'arm64': 'arm64', 'aarch64': 'arm64'}
+
+# Supported image families. Each one is resolved from its publisher's public SSM parameter,
+# falling back to the newest image matching its name pattern when the parameter is unavailable.
+# Only Debian-family images are listed, since the user_data script relies on adduser and sudo.
+IMAGE_FAMILIES = {
+    'ubuntu': {
+        'owner': '099720109477',  # Canonical
+        'ssm_parameter': '/aws/service/canonical/ubuntu/server/{version}/stable/current/{arch}/hvm/{volume}/ami-id',
+        'name_pattern': 'ubuntu/images/hvm-ssd*/ubuntu-{codename}-{version}-{arch}-server-*',
+        # version: (codename, volume type used in the SSM path)
+        'versions': {
+            '20.04': ('focal', 'ebs-gp2'),
+            '22.04': ('jammy', 'ebs-gp2'),
+            '24.04': ('noble', 'ebs-gp3'),
+        },
+    },
+    'debian': {
+        'owner': '136693071363',  # Debian
+        'ssm_parameter': '/aws/service/debian/release/{version}/latest/{arch}',
+        'name_pattern': 'debian-{version}-{arch}-*',
+        'versions': {
+            '11': ('bullseye', None),
+            '12': ('bookworm', None),
+        },
+    },
+}
+
+
+def image_selector(vm_config):
+    """
+    Return the normalized image selector of a VM config, filling in defaults.
+
+    The optional 'image' field of a VM config may set 'os', 'version' and 'arch'.
+    """
+    selector = dict(DEFAULT_IMAGE, **(vm_config.get('image') or {}))
+    selector['os'] = str(selector['os']).lower()
+    selector['version'] = str(selector['version'])
+    family = IMAGE_FAMILIES.get(selector['os'])
+    if family is None:
+        raise ValueError(f"Unsupported image os '{selector['os']}'. Supported: {', '.join(sorted(IMAGE_FAMILIES))}.")
+    if selector['version'] not in family['versions']:
+        raise ValueError(f"Unsupported {selector['os']} version '{selector['version']}'. "
+                         f"Supported: {', '.join(sorted(family['versions']))}.")
+    if selector['arch'] not in ARCHITECTURES:
+        raise ValueError(f"Unsupported image arch '{selector['arch']}'. Supported: {', '.join(sorted(ARCHITECTURES))}.")
+    # Publishers name their images and parameters with Debian architecture names
+    selector['arch'] = 'amd64' if ARCHITECTURES[selector['arch']] == 'x86_64' else 'arm64'
+    return selector
+
+def selector_key(selector):
+    """Return a short string identifying an image selector, used as its discovery cache key."""
+    return f"{selector['os']}-{selector['version']}-{selector['arch']}"
+
+def latest_image_from_ssm(ssm_client, selector):
+    """Read the latest image ID from the publisher's public SSM parameter, or return None if unavailable."""
+    family = IMAGE_FAMILIES[selector['os']]
+    codename, volume = family['versions'][selector['version']]
+    name = family['ssm_parameter'].format(
+        version=selector['version'], arch=selector['arch'], codename=codename, volume=volume)
+    try:
+        return ssm_client.get_parameter(Name=name)['Parameter']['Value']
+    except ClientError:
+        return None
+
+def latest_image_from_describe(ec2_client, selector):
+    """Find the newest matching image with describe_images, filtering by owner, name and architecture server-side."""
+    family = IMAGE_FAMILIES[selector['os']]
+    codename, _ = family['versions'][selector['version']]
+    name_pattern = family['name_pattern'].format(version=selector['version'], arch=selector['arch'], codename=codename)
+
+    latest = None
+    paginator = ec2_client.get_paginator('describe_images')
+    for page in paginator.paginate(
+        Owners=[family['owner']],
+        Filters=[
+            {'Name': 'name', 'Values': [name_pattern]},
+            {'Name': 'state', 'Values': ['available']},
+            {'Name': 'architecture', 'Values': [ARCHITECTURES[selector['arch']]]},
+            {'Name': 'virtualization-type', 'Values': ['hvm']},
+            {'Name': 'root-device-type', 'Values': ['ebs']},
+        ]
+    ):
+        for image in page['Images']:
+            if latest is None or image['CreationDate'] > latest['CreationDate']:
+                latest = image
+    if latest is None:
+        raise ValueError(f"No AMI found matching {selector_key(selector)}.")
+    return latest['ImageId']
+
+def find_latest_image(ec2_client, selector, ssm_client=None):
+    """
+    Return the ID of the latest image matching a selector in the client's region.
+
+    The public SSM parameter answers with a single ID; the describe_images scan is only
+    used when no SSM client is given or the parameter cannot be read.
+    """
+    if ssm_client is not None:
+        image_id = latest_image_from_ssm(ssm_client, selector)
+        if image_id:
+            return image_id
+    return latest_image_from_describe(ec2_client, selector)
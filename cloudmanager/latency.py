@@ -0,0 +1,316 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+LATENCY_DB_PATH = os.path.expanduser('~/.cloudmanager/launch-latency.sqlite')
+
+# Milestones of a launch, each measured in seconds from the start of the launch call:
+# the API returned the instance ID, the instance was seen running, it had a public IP, and it accepted SSH
+STAGES = ('launch', 'running', 'public_ip', 'ssh')
+
+# Samples kept per (region, availability zone, instance type, AMI); older ones are dropped
+MAX_SAMPLES_PER_KEY = 200
+# Samples needed before a group's percentiles are trusted for placement
+MIN_PLACEMENT_SAMPLES = 3
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS launches (
+    recorded_at REAL NOT NULL,
+    region TEXT NOT NULL,
+    availability_zone TEXT,
+    instance_type TEXT NOT NULL,
+    ami_id TEXT,
+    launch REAL,
+    running REAL,
+    public_ip REAL,
+    ssh REAL
+);
+CREATE INDEX IF NOT EXISTS launches_key ON launches (region, availability_zone, instance_type, ami_id);
+"""
+GROUP_FIELDS = ('region', 'availability_zone', 'instance_type', 'ami_id')
+
+
+def percentile(values, p):
+    """Return the p-th percentile of a list of numbers, interpolating between the closest ranks."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = (len(values) - 1) * p / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (rank - low)
+
+
+class LaunchLatencyStore:
+    """
+    A local SQLite history of launch timings per region, availability zone, instance type and AMI.
+
+    Every sample holds the seconds from the launch call to each stage of ``STAGES``; stages that
+    were not observed are left empty. Only the newest ``MAX_SAMPLES_PER_KEY`` samples of each
+    combination are kept, so the database stays small however often it is written.
+    """
+
+    def __init__(self, path=LATENCY_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._connection.executescript(_SCHEMA)
+
+    def record(self, sample):
+        """Store one launch sample: its GROUP_FIELDS and the seconds to each of the STAGES."""
+        key = [sample.get(field) for field in GROUP_FIELDS]
+        with self._lock, self._connection:
+            self._connection.execute(
+                f"INSERT INTO launches (recorded_at, {', '.join(GROUP_FIELDS)}, {', '.join(STAGES)}) "
+                f"VALUES ({', '.join('?' * (1 + len(GROUP_FIELDS) + len(STAGES)))})",
+                [sample.get('recorded_at', time.time())] + key + [sample.get(stage) for stage in STAGES])
+            self._connection.execute(
+                "DELETE FROM launches WHERE rowid IN (SELECT rowid FROM launches WHERE "
+                + ' AND '.join(f"{field} IS ?" for field in GROUP_FIELDS)
+                + " ORDER BY recorded_at DESC LIMIT -1 OFFSET ?)",
+                key + [MAX_SAMPLES_PER_KEY])
+
+    def samples(self, stage='ssh', since=None, **where):
+        """
+        Return the recorded seconds to ``stage``, optionally only since a timestamp.
+
+        :param where: Equality filters on GROUP_FIELDS, e.g. ``region='us-east-1'``.
+        """
+        if stage not in STAGES:
+            raise ValueError(f"Unknown stage '{stage}'. Available: {', '.join(STAGES)}.")
+        clauses, params = self._where(since, where)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {stage} FROM launches WHERE {stage} IS NOT NULL{clauses}", params).fetchall()
+        return [row[0] for row in rows]
+
+    def percentiles(self, stage='ssh', percentiles=(50, 90, 99), since=None, **where):
+        """Return the sample count and the given percentiles of the seconds to ``stage``."""
+        values = self.samples(stage, since, **where)
+        result = {'count': len(values)}
+        for p in percentiles:
+            result[f"p{p:g}"] = percentile(values, p)
+        return result
+
+    def report(self, group_by=('region', 'availability_zone', 'instance_type'), percentiles=(50, 90), since=None,
+               **where):
+        """
+        Summarize every stage per group.
+
+        :return: One dictionary per group with its GROUP_FIELDS values, its sample count and, per
+                 stage, the requested percentiles (e.g. ``ssh_p90``), sorted by group.
+        """
+        clauses, params = self._where(since, where)
+        with self._lock:
+            rows = self._connection.execute(
+                f"SELECT {', '.join(group_by)}, {', '.join(STAGES)} FROM launches WHERE 1=1{clauses}",
+                params).fetchall()
+        groups = {}
+        for row in rows:
+            groups.setdefault(tuple(row[:len(group_by)]), []).append(row[len(group_by):])
+        report = []
+        for group, group_rows in sorted(groups.items(), key=lambda item: tuple(str(value) for value in item[0])):
+            entry = dict(zip(group_by, group), count=len(group_rows))
+            for index, stage in enumerate(STAGES):
+                values = [row[index] for row in group_rows if row[index] is not None]
+                for p in percentiles:
+                    entry[f"{stage}_p{p:g}"] = percentile(values, p)
+            report.append(entry)
+        return report
+
+    def expected_time_to_ready(self, region, availability_zone, instance_type, ami_id=None, p=50):
+        """
+        Estimate the seconds from launch to SSH-ready in an availability zone, or None without enough history.
+
+        The exact image is preferred; with too few samples for it, every image of the instance type counts.
+        """
+        for where in ({'ami_id': ami_id} if ami_id else None, {}):
+            if where is None:
+                continue
+            values = self.samples('ssh', region=region, availability_zone=availability_zone,
+                                  instance_type=instance_type, **where)
+            if len(values) >= MIN_PLACEMENT_SAMPLES:
+                return percentile(values, p)
+        return None
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    @staticmethod
+    def _where(since, where):
+        clauses = ''
+        params = []
+        for field, value in where.items():
+            if field not in GROUP_FIELDS:
+                raise ValueError(f"Unknown field '{field}'. Available: {', '.join(GROUP_FIELDS)}.")
+            clauses += f" AND {field} IS ?"
+            params.append(value)
+        if since is not None:
+            clauses += " AND recorded_at >= ?"
+            params.append(since)
+        return clauses, params
+
+
+class LaunchTimings:
+    """
+    Time each VM's launch in this process and store the result once the VM accepts SSH.
+
+    Timers are started when a launch call begins; VMs without one, such as restarted warm pool
+    instances, are not recorded.
+    """
+
+    def __init__(self, store=None):
+        """
+        :param store: The LaunchLatencyStore samples are written to, by default the one of ``get_latency_store``.
+        """
+        self.store = store
+        self._lock = threading.Lock()
+        self._timers = {}
+
+    def start(self, members):
+        """
+        Start the launch timers of VMs whose launch call is about to be made.
+
+        :param members: (vm_config, resources) pairs; the AMI and any chosen availability zone are taken from the resources.
+        """
+        now = time.monotonic()
+        with self._lock:
+            for vm_config, resources in members:
+                self._timers[id(vm_config)] = {'start': now, 'sample': {
+                    'ami_id': resources.get('ami_id'),
+                    'availability_zone': resources.get('availability_zone'),
+                }}
+
+    def mark(self, vm_config, stage, at=None, **details):
+        """Record that a VM reached a stage, now or at the monotonic time ``at``, with optional group fields."""
+        with self._lock:
+            timer = self._timers.get(id(vm_config))
+            if timer is None:
+                return
+            if stage is not None and timer['sample'].get(stage) is None:
+                timer['sample'][stage] = round((time.monotonic() if at is None else at) - timer['start'], 3)
+            for field, value in details.items():
+                if value is not None:
+                    timer['sample'][field] = value
+
+    def finish(self, vm_config):
+        """Mark a VM as SSH-ready and store its sample; history errors are reported, never raised."""
+        self.mark(vm_config, 'ssh')
+        with self._lock:
+            timer = self._timers.pop(id(vm_config), None)
+        if timer is None:
+            return None
+        sample = dict(timer['sample'], region=vm_config['region'], instance_type=vm_config['instance_type'])
+        try:
+            (self.store or get_latency_store()).record(sample)
+        except sqlite3.Error as e:
+            print(f"[{vm_config['vm_name']}] Unable to record launch timings: {e}")
+        return sample
+
+
+_latency_store = None
+_latency_store_lock = threading.Lock()
+_launch_timings = LaunchTimings()
+
+
+def get_latency_store():
+    """Return the process-wide LaunchLatencyStore at ``LATENCY_DB_PATH``, opening it on first use."""
+    global _latency_store
+    with _latency_store_lock:
+        if _latency_store is None:
+            _latency_store = LaunchLatencyStore()
+        return _latency_store
+
+def get_launch_timings():
+    """Return the launch timers shared by the deploy paths."""
+    return _launch_timings
+
+def place_subnet(subnets, vm_config, ami_id=None, store=None):
+    """
+    Choose the subnet a VM is launched in.
+
+    Only subnets in the VM's ``availability_zones``, when set, are candidates. With the 'latency'
+    placement, the candidate whose availability zone has the lowest median time to SSH-ready for
+    the VM's instance type is chosen; zones without ``MIN_PLACEMENT_SAMPLES`` launches yet are
+    tried first, so every allowed zone gets a history. Otherwise the first candidate is taken.
+
+    :param subnets: The subnets of the VM's VPC, as returned by ``utils.list_subnets``.
+    :param store: The LaunchLatencyStore to estimate from, by default the one of ``get_latency_store``.
+    :return: The chosen subnet dictionary.
+    """
+    allowed = vm_config.get('availability_zones')
+    candidates = [subnet for subnet in subnets if not allowed or subnet['availability_zone'] in allowed]
+    if not candidates:
+        raise ValueError(f"No available subnet in availability zones {', '.join(allowed)} of region "
+                         f"'{vm_config['region']}'.")
+    if vm_config.get('placement') != 'latency':
+        return candidates[0]
+
+    # Subnets are listed default-for-az first, so the first one seen per zone stands for the zone
+    by_zone = {}
+    for subnet in candidates:
+        by_zone.setdefault(subnet['availability_zone'], subnet)
+    try:
+        store = store or get_latency_store()
+        expected = {
+            zone: store.expected_time_to_ready(vm_config['region'], zone, vm_config['instance_type'], ami_id)
+            for zone in by_zone
+        }
+    except sqlite3.Error as e:
+        print(f"Unable to read the launch latency history, using the first subnet: {e}")
+        return candidates[0]
+    zone = min(by_zone, key=lambda zone: -1 if expected[zone] is None else expected[zone])
+    return by_zone[zone]
+
+def print_latency_report(report, percentiles=(50, 90)):
+    """Print a report from ``LaunchLatencyStore.report`` as a table."""
+    group_fields = [field for field in GROUP_FIELDS if report and field in report[0]]
+    columns = [f"{stage}_p{p:g}" for stage in STAGES for p in percentiles]
+    print(' '.join(f"{field:<20}" for field in group_fields) + f" {'count':>6} "
+          + ' '.join(f"{column:>13}" for column in columns))
+    for entry in report:
+        values = ' '.join(
+            f"{entry[column]:>13.1f}" if entry[column] is not None else f"{'-':>13}" for column in columns)
+        print(' '.join(f"{str(entry[field] or '-'):<20}" for field in group_fields) + f" {entry['count']:>6} " + values)
+
+def main():
+    """Print launch latency percentiles from the local history."""
+    parser = argparse.ArgumentParser(description="Report launch latency percentiles recorded by past deployments.")
+    parser.add_argument("--db", type=str, default=LATENCY_DB_PATH, help=f"History database (default: {LATENCY_DB_PATH}).")
+    parser.add_argument("--by", type=str, default="region,availability_zone,instance_type", help=f"Comma-separated fields to group by, among {', '.join(GROUP_FIELDS)}.")
+    parser.add_argument("--region", type=str, default=None, help="Only report launches in this region.")
+    parser.add_argument("--instance-type", type=str, default=None, help="Only report launches of this instance type.")
+    parser.add_argument("--days", type=float, default=None, help="Only report launches from the last DAYS days.")
+    parser.add_argument("--percentiles", type=str, default="50,90", help="Comma-separated percentiles (default: 50,90).")
+    args = parser.parse_args()
+
+    group_by = tuple(field.strip() for field in args.by.split(',') if field.strip())
+    unknown = [field for field in group_by if field not in GROUP_FIELDS]
+    if unknown:
+        parser.error(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(GROUP_FIELDS)}.")
+    percentiles = tuple(float(p) for p in args.percentiles.split(','))
+    where = {}
+    if args.region:
+        where['region'] = args.region
+    if args.instance_type:
+        where['instance_type'] = args.instance_type
+    since = time.time() - args.days * 86400 if args.days is not None else None
+
+    if not os.path.exists(args.db):
+        print(f"No launch history at {args.db}.")
+        return
+    store = LaunchLatencyStore(args.db)
+    report = store.report(group_by, percentiles, since, **where)
+    store.close()
+    if not report:
+        print("No launches recorded for this selection.")
+        return
+    print_latency_report(report, percentiles)
+
+if __name__ == "__main__":
+    main()
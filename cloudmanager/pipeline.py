@@ -0,0 +1,270 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from cloudmanager.deploy import (assign_vm_names, record_public_ip, record_ssh_ready, record_state, vm_result,
+                                 run_initial_setup_commands)
+from cloudmanager.precheck import enabled_regions_for, resolve_aws_region, vcpu_quota_for
+from cloudmanager.readiness import InstanceReadiness, wait_for_ssh
+from cloudmanager.upload import upload_files
+from cloudmanager.collect import collect_vm_results
+from cloudmanager.fanout import run_commands_on_host
+from cloudmanager.teardown import terminate_aws_instances
+from cloudmanager.discovery import DiscoveryCache, account_key
+from cloudmanager.clients import get_ec2_client
+from cloudmanager.tracing import span
+
+# The chain every VM goes through, in order
+STAGES = ('resolve', 'launch', 'ready', 'upload', 'setup', 'run', 'collect', 'teardown')
+
+# The resource each stage uses; every resource has its own bounded worker pool, so a slow
+# stage (e.g. waiting for SSH) never holds up VMs that are ready for another kind of work
+STAGE_RESOURCES = {
+    'resolve': 'api',
+    'launch': 'launch',
+    'ready': 'wait',
+    'upload': 'ssh',
+    'setup': 'ssh',
+    'run': 'ssh',
+    'collect': 'ssh',
+    'teardown': 'api',
+}
+DEFAULT_LIMITS = {'api': 16, 'launch': 8, 'wait': 256, 'ssh': 32}
+
+
+class ProviderPipeline:
+    """
+    The state shared by the VMs of one AWS provider entry in a pipeline run.
+
+    Regions are checked lazily and at most once: the first VM of a region to reach the resolve
+    stage checks the region for every VM in it, the others reuse the result.
+    """
+
+    def __init__(self, aws_config, backend, output_dir, discovery_cache=None, state=None):
+        self.aws_config = aws_config
+        self.backend = backend
+        self.output_dir = output_dir
+        self.access_key = aws_config['credentials']['access_key']
+        self.secret_key = aws_config['credentials']['secret_key']
+        self.account = account_key(self.access_key)
+        self.discovery_cache = discovery_cache if discovery_cache is not None else DiscoveryCache(path=None)
+        self.account_state = state.for_account(self.access_key) if state is not None else None
+        assign_vm_names(aws_config['vm_configs'])
+        self.vm_resources = [None] * len(aws_config['vm_configs'])
+        self.vms_by_region = {}
+        for index, vm_config in enumerate(aws_config['vm_configs']):
+            self.vms_by_region.setdefault(vm_config['region'], []).append((index, vm_config))
+        self.readiness = InstanceReadiness({})
+        self._lock = threading.Lock()
+        self._region_locks = {}
+        self._region_plans = {}
+        self._enabled_regions = None
+
+    def ec2_client(self, region):
+        """Return the shared EC2 client for a region, making it available to the readiness poller."""
+        client = get_ec2_client(self.access_key, self.secret_key, region)
+        with self._lock:
+            self.readiness.ec2_clients.setdefault(region, client)
+        return client
+
+    def region_plan(self, region):
+        """Check a region and resolve the resources of all its VMs, once, and return its precheck plan."""
+        with self._lock:
+            region_lock = self._region_locks.setdefault(region, threading.Lock())
+        with region_lock:
+            if region not in self._region_plans:
+                with span('precheck.region', region=region, vms=len(self.vms_by_region[region])):
+                    self._region_plans[region] = resolve_aws_region(
+                        self.ec2_client(region), region, self.vms_by_region[region], self.vm_resources,
+                        self.discovery_cache, self.account, region in self.enabled_regions())
+            return self._region_plans[region]
+
+    def enabled_regions(self):
+        """Return the regions enabled for the account, listed once."""
+        with self._lock:
+            if self._enabled_regions is None:
+                self._enabled_regions = enabled_regions_for(self.access_key, self.secret_key, list(self.vms_by_region))
+            return self._enabled_regions
+
+
+class VMTask:
+    """One VM moving through the pipeline stages."""
+
+    def __init__(self, provider, index, vm_config):
+        self.provider = provider
+        self.index = index
+        self.vm_config = vm_config
+        self.resources = None
+        self.error = None
+        self.failed_stage = None
+        self.terminated = False
+
+    def result(self):
+        result = vm_result(self.vm_config, self.error)
+        result['failed_stage'] = self.failed_stage
+        result['terminated'] = self.terminated
+        return result
+
+
+class PipelineScheduler:
+    """
+    Run every VM through its own chain of stages instead of global precheck, deploy and teardown phases.
+
+    A VM moves on to its next stage as soon as its current one finishes, so a VM from one provider
+    entry can be running its setup commands while another is still being launched. Concurrency is
+    bounded per resource (see ``STAGE_RESOURCES``) across all providers rather than per phase.
+    A VM that fails is torn down right away if it has an instance; with ``teardown``, every VM is
+    also terminated as soon as its own results are collected, so no instance waits for the slowest one.
+    """
+
+    def __init__(self, limits=None, teardown=True, wait_terminated=False):
+        """
+        :param limits: Maximum concurrent stages per resource, overriding ``DEFAULT_LIMITS``.
+        :param teardown: Whether to terminate each VM once its chain completes.
+        :param wait_terminated: Whether teardown waits until each instance is confirmed terminated.
+        """
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.teardown = teardown
+        self.wait_terminated = wait_terminated
+        self._handlers = {stage: getattr(self, f"_{stage}") for stage in STAGES}
+        self._executors = {}
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._done = threading.Event()
+
+    def run(self, providers):
+        """
+        Run every VM of the given ``ProviderPipeline`` objects to completion.
+
+        :return: The per-VM result dictionaries of ``deploy.vm_result``, in provider and ``vm_configs``
+                 order, with the stage a VM failed in and whether its instance was terminated.
+        """
+        tasks = [
+            VMTask(provider, index, vm_config)
+            for provider in providers
+            for index, vm_config in enumerate(provider.aws_config['vm_configs'])
+        ]
+        if not tasks:
+            return []
+        self._remaining = len(tasks)
+        self._done.clear()
+        self._executors = {
+            resource: ThreadPoolExecutor(max_workers=max(1, limit), thread_name_prefix=f"pipeline-{resource}")
+            for resource, limit in self.limits.items()
+        }
+        try:
+            for task in tasks:
+                self._submit(task, STAGES[0])
+            self._done.wait()
+        finally:
+            for executor in self._executors.values():
+                executor.shutdown(wait=True)
+        return [task.result() for task in tasks]
+
+    def _submit(self, task, stage):
+        self._executors[STAGE_RESOURCES[stage]].submit(self._run_stage, task, stage)
+
+    def _run_stage(self, task, stage):
+        vm_config = task.vm_config
+        try:
+            with span(f'pipeline.{stage}', vm=vm_config['vm_name'], region=vm_config['region']):
+                self._handlers[stage](task)
+        except Exception as e:
+            print(f"[{vm_config['vm_name']}] Stage '{stage}' failed: {e}")
+            if task.error is None:
+                task.error = str(e)
+                task.failed_stage = stage
+            if vm_config.get('instance_id') and not task.terminated:
+                record_state(task.provider.account_state, vm_config, 'failed')
+
+        next_stage = self._next_stage(task, stage)
+        if next_stage is None:
+            with self._lock:
+                self._remaining -= 1
+                if self._remaining == 0:
+                    self._done.set()
+        else:
+            self._submit(task, next_stage)
+
+    def _next_stage(self, task, stage):
+        if stage == 'teardown':
+            return None
+        if task.error is not None:
+            # Skip the rest of the chain, but never leave a failed instance running
+            return 'teardown' if task.vm_config.get('instance_id') else None
+        next_stage = STAGES[STAGES.index(stage) + 1]
+        if next_stage == 'teardown' and not self.teardown:
+            return None
+        return next_stage
+
+    def _resolve(self, task):
+        provider = task.provider
+        vm_config = task.vm_config
+        region = vm_config['region']
+        region_plan = provider.region_plan(region)
+        if not region_plan['available']:
+            raise RuntimeError(f"Region '{region}' is not available.")
+        if not region_plan['instance_types'].get(vm_config['instance_type']):
+            raise RuntimeError(f"Instance type '{vm_config['instance_type']}' is not available in region '{region}'.")
+        code, name = vcpu_quota_for(vm_config['instance_type'])
+        quota = region_plan['vcpus'].get(code)
+        if quota and quota['limit'] is not None and quota['requested'] + quota['in_use'] > quota['limit']:
+            raise RuntimeError(f"'{name}' quota ({code}) in region '{region}' allows {quota['limit']:g} vCPUs, but "
+                               f"{quota['in_use']} are in use and {quota['requested']} more are requested.")
+        task.resources = provider.vm_resources[task.index]
+        if task.resources is None:
+            raise RuntimeError(next(
+                (error for error in region_plan['errors'] if f"'{vm_config['vm_name']}'" in error),
+                f"Unable to resolve resources for '{vm_config['vm_name']}' in region '{region}'."))
+
+    def _launch(self, task):
+        provider = task.provider
+        provider.backend.launch_one(provider.aws_config, task.vm_config, task.resources, provider.output_dir,
+                                    provider.account_state)
+
+    def _ready(self, task):
+        provider = task.provider
+        vm_config = task.vm_config
+        if not vm_config.get('public_ip'):
+            provider.ec2_client(vm_config['region'])
+            provider.readiness.track(vm_config['region'], [vm_config['instance_id']])
+            vm_config['public_ip'] = provider.readiness.wait_for_public_ip(vm_config['instance_id'])
+        record_public_ip(provider.readiness, vm_config, vm_config['public_ip'])
+        wait_for_ssh(vm_config['public_ip'], user='experiment')
+        record_ssh_ready(vm_config, provider.account_state)
+
+    def _upload(self, task):
+        vm_config = task.vm_config
+        if task.resources.get('baked'):
+            return
+        upload_files(vm_config['public_ip'], 'experiment', vm_config.get('files', []), vm_config.get('custom_code_path'))
+
+    def _setup(self, task):
+        vm_config = task.vm_config
+        if not task.resources.get('baked'):
+            run_initial_setup_commands(vm_config['public_ip'], 'experiment', vm_config.get('initial_commands', []),
+                                       label=vm_config['vm_name'])
+        record_state(task.provider.account_state, vm_config, 'provisioned')
+
+    def _run(self, task):
+        vm_config = task.vm_config
+        commands = vm_config.get('run_commands', [])
+        if commands:
+            result = run_commands_on_host(vm_config['public_ip'], 'experiment', commands, label=vm_config['vm_name'])
+            if result['error']:
+                raise RuntimeError(result['error'])
+
+    def _collect(self, task):
+        collect_vm_results(task.vm_config)
+
+    def _teardown(self, task):
+        provider = task.provider
+        vm_config = task.vm_config
+        instance_id = vm_config['instance_id']
+        outcome = terminate_aws_instances(provider.ec2_client(vm_config['region']), [instance_id],
+                                          wait=self.wait_terminated)[instance_id]
+        if outcome['error']:
+            raise RuntimeError(f"Failed to terminate {instance_id}: {outcome['error']}")
+        task.terminated = True
+        print(f"[{vm_config['vm_name']}] Instance {instance_id}: {outcome['previous_state']} -> "
+              f"{outcome['current_state']}")
+        if provider.account_state is not None:
+            provider.account_state.remove(vm_config['vm_name'])
@@ -0,0 +1,322 @@
+import fcntl
+import os
+import threading
+import time
+import yaml
+from contextlib import contextmanager
+from botocore.exceptions import ClientError, WaiterError
+from cloudmanager.bake import bake_hash
+from cloudmanager.clients import get_ec2_client
+from cloudmanager.deploy import render_user_data, record_state
+from cloudmanager.discovery import account_key
+from cloudmanager.state import describe_live_instances
+from cloudmanager.teardown import terminate_aws_instances
+from cloudmanager.utils import write_yaml_atomically
+
+WARM_POOL_PATH = os.path.expanduser('~/.cloudmanager/warm-pool.yaml')
+DEFAULT_MAX_SIZE = 50
+DEFAULT_MAX_PER_KEY = 10
+DEFAULT_MAX_IDLE = 24 * 3600
+
+# start_instances and stop_instances accept at most 1000 IDs per call
+POOL_BATCH_SIZE = 1000
+
+
+def pool_key(account, region, instance_type, ami_id, subnet_id, security_group_ids, key_pair_name, config_hash):
+    """Return the key under which interchangeable stopped instances are pooled."""
+    # A stopped instance keeps its subnet and key pair, and its security groups unless they are
+    # changed, so instances that differ in them are not interchangeable
+    security_groups = ','.join(sorted(security_group_ids or []))
+    return f"{account}/{region}/{instance_type}/{ami_id}/{subnet_id}/{security_groups}/{key_pair_name}/{config_hash[:16]}"
+
+def pool_config_hash(vm_config, ami_id, user_data):
+    """Hash what an instance was provisioned with, so only VMs with identical files and setup reuse it."""
+    return bake_hash(vm_config, ami_id, user_data)
+
+
+class WarmPool:
+    """
+    A local index of stopped, fully provisioned instances that later deployments restart instead of launching.
+
+    Instances are pooled by account, region, instance type, AMI, subnet, security groups, key pair
+    and the hash of their files, setup commands and user_data. The index is a YAML file rewritten
+    atomically on every change and shared by concurrent runs through a lock file next to it.
+    The pool holds at most ``max_size`` instances and ``max_per_key`` per key; instances that
+    do not fit, or that have been stopped for more than ``max_idle`` seconds, are terminated.
+    """
+
+    def __init__(self, path=WARM_POOL_PATH, max_size=DEFAULT_MAX_SIZE, max_per_key=DEFAULT_MAX_PER_KEY,
+                 max_idle=DEFAULT_MAX_IDLE, hibernate=False):
+        """
+        :param path: The pool index file.
+        :param max_size: The maximum number of pooled instances across all keys.
+        :param max_per_key: The maximum number of pooled instances per key.
+        :param max_idle: Seconds a pooled instance may stay stopped before it is terminated.
+        :param hibernate: Hibernate instances instead of stopping them, where their launch allows it.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_per_key = max_per_key
+        self.max_idle = max_idle
+        self.hibernate = hibernate
+        self._lock = threading.Lock()
+        self.instances = {}
+        self._load()
+
+    def claim(self, aws_config, vm_configs, vm_resources, state=None):
+        """
+        Restart pooled instances for the VMs that match them and assign them their instance IDs.
+
+        Expired members of the account are evicted first. Claimed VMs are marked with
+        ``warm_pool_instance_id`` so deploy skips their file upload and setup commands.
+
+        :param vm_configs: The VMs to deploy, without an instance yet.
+        :param vm_resources: The resolved resources of each VM, in ``vm_configs`` order.
+        :param state: An optional DeploymentState in which claimed VMs are recorded as launched.
+        :return: The vm_configs that got a pooled instance.
+        """
+        access_key = aws_config['credentials']['access_key']
+        secret_key = aws_config['credentials']['secret_key']
+        account = account_key(access_key)
+        account_state = state.for_account(access_key) if state is not None else None
+        self.evict(access_key, secret_key)
+        user_data = render_user_data()
+
+        claimed_by_region = {}
+        with self._locked():
+            for vm_config, resources in zip(vm_configs, vm_resources):
+                if resources is None or vm_config.get('instance_id'):
+                    continue
+                key = pool_key(account, vm_config['region'], vm_config['instance_type'], resources['ami_id'],
+                               resources.get('subnet_id'), resources.get('security_group_ids'),
+                               resources.get('key_pair_name'),
+                               pool_config_hash(vm_config, resources['ami_id'], user_data))
+                instance_id = next((instance_id for instance_id, entry in sorted(self.instances.items())
+                                    if entry['key'] == key), None)
+                if instance_id is None:
+                    continue
+                del self.instances[instance_id]
+                claimed_by_region.setdefault(vm_config['region'], []).append((vm_config, instance_id))
+            if claimed_by_region:
+                self._save()
+
+        claimed = []
+        for region, members in claimed_by_region.items():
+            ec2_client = get_ec2_client(access_key, secret_key, region)
+            started = start_pooled_instances(ec2_client, [instance_id for _, instance_id in members])
+            failed = [instance_id for _, instance_id in members if instance_id not in started]
+            if failed:
+                # Out of the pool, these would never be cleaned up; their VMs get new instances instead
+                terminate_aws_instances(ec2_client, failed)
+            for vm_config, instance_id in members:
+                if instance_id not in started:
+                    continue
+                vm_config['instance_id'] = instance_id
+                vm_config['warm_pool_instance_id'] = instance_id
+                tag_claimed_instance(ec2_client, vm_config)
+                # A restarted instance gets a new public IP
+                vm_config.pop('public_ip', None)
+                record_state(account_state, vm_config, 'launched')
+                print(f"[{vm_config['vm_name']}] Claimed warm pool instance {instance_id} in {region}.")
+                claimed.append(vm_config)
+        return claimed
+
+    def release(self, aws_config, vm_configs, state=None):
+        """
+        Stop provisioned VMs and add them to the pool, as far as the pool limits allow.
+
+        :param vm_configs: The deployed VMs to pool; only those recorded as provisioned in ``state``,
+                           when given, are accepted.
+        :return: The per-instance outcomes of the pooled instances, shaped like teardown outcomes.
+        """
+        access_key = aws_config['credentials']['access_key']
+        secret_key = aws_config['credentials']['secret_key']
+        account = account_key(access_key)
+        account_state = state.for_account(access_key) if state is not None else None
+        self.evict(access_key, secret_key)
+        provisioned = None
+        if state is not None:
+            provisioned = {entry['vm_name'] for entry in state.entries(account) if entry['status'] == 'provisioned'}
+        user_data = render_user_data()
+
+        by_region = {}
+        for vm_config in vm_configs:
+            if vm_config.get('instance_id') and (provisioned is None or vm_config['vm_name'] in provisioned):
+                by_region.setdefault(vm_config['region'], []).append(vm_config)
+
+        report = []
+        for region, region_vms in by_region.items():
+            ec2_client = get_ec2_client(access_key, secret_key, region)
+            live = describe_live_instances(ec2_client, [vm_config['instance_id'] for vm_config in region_vms])
+            accepted = []
+            with self._locked():
+                for vm_config in region_vms:
+                    instance = live.get(vm_config['instance_id'])
+                    if instance is None or instance['State']['Name'] not in ('pending', 'running'):
+                        continue
+                    key = pool_key(account, region, instance['InstanceType'], instance['ImageId'],
+                                   instance.get('SubnetId'),
+                                   [group['GroupId'] for group in instance.get('SecurityGroups', [])],
+                                   instance.get('KeyName'),
+                                   pool_config_hash(vm_config, instance['ImageId'], user_data))
+                    if (len(self.instances) >= self.max_size
+                            or sum(entry['key'] == key for entry in self.instances.values()) >= self.max_per_key):
+                        continue
+                    self.instances[vm_config['instance_id']] = {
+                        'key': key,
+                        'account': account,
+                        'region': region,
+                        'instance_type': instance['InstanceType'],
+                        'ami_id': instance['ImageId'],
+                        'last_vm_name': vm_config['vm_name'],
+                        'stopped_at': time.time(),
+                    }
+                    accepted.append(vm_config)
+                if accepted:
+                    self._save()
+
+            outcomes = stop_pooled_instances(ec2_client, [vm_config['instance_id'] for vm_config in accepted],
+                                             self.hibernate)
+            with self._locked():
+                for vm_config in accepted:
+                    outcome = outcomes[vm_config['instance_id']]
+                    if outcome['error']:
+                        # An instance that could not be stopped is left to the regular teardown
+                        self.instances.pop(vm_config['instance_id'], None)
+                        continue
+                    if account_state is not None:
+                        account_state.remove(vm_config['vm_name'])
+                    report.append(dict(outcome, vm_name=vm_config['vm_name'], region=region,
+                                       instance_id=vm_config['instance_id']))
+                self._save()
+        return report
+
+    def evict(self, access_key, secret_key, now=None):
+        """Terminate the account's pooled instances that have been stopped for longer than ``max_idle``."""
+        account = account_key(access_key)
+        now = time.time() if now is None else now
+        with self._locked():
+            expired = {
+                instance_id: entry for instance_id, entry in self.instances.items()
+                if entry['account'] == account and now - entry['stopped_at'] > self.max_idle
+            }
+        by_region = {}
+        for instance_id, entry in expired.items():
+            by_region.setdefault(entry['region'], []).append(instance_id)
+        for region, instance_ids in by_region.items():
+            outcomes = terminate_aws_instances(get_ec2_client(access_key, secret_key, region), instance_ids)
+            with self._locked():
+                for instance_id in instance_ids:
+                    error = outcomes[instance_id]['error']
+                    # An instance that no longer exists is gone from the pool either way
+                    if error and 'InvalidInstanceID' not in error:
+                        print(f"Failed to evict warm pool instance {instance_id} in {region}: {error}")
+                        continue
+                    self.instances.pop(instance_id, None)
+                    print(f"Evicted idle warm pool instance {instance_id} in {region}.")
+                self._save()
+        return len(expired)
+
+    def stats(self):
+        """Return the number of pooled instances per key."""
+        with self._locked():
+            counts = {}
+            for entry in self.instances.values():
+                counts[entry['key']] = counts.get(entry['key'], 0) + 1
+            return counts
+
+    @contextmanager
+    def _locked(self):
+        """
+        Hold the pool against other threads and, through a lock file, other processes, with the
+        index reloaded from disk, so concurrent runs never claim the same instance or lose entries.
+        """
+        with self._lock:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with open(f"{self.path}.lock", 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    self._load()
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                self.instances = (yaml.safe_load(f) or {}).get('instances', {})
+
+    def _save(self):
+        write_yaml_atomically({'instances': self.instances}, self.path)
+
+
+def tag_claimed_instance(ec2_client, vm_config):
+    """Rename a claimed instance after the VM it now runs, so the console and reconcile show the right name."""
+    # A stale Name tag does not affect the deployment, so it is only reported
+    try:
+        ec2_client.create_tags(Resources=[vm_config['instance_id']],
+                               Tags=[{'Key': 'Name', 'Value': vm_config['vm_name']}])
+    except ClientError as e:
+        print(f"[{vm_config['vm_name']}] Unable to tag instance {vm_config['instance_id']}: {e}")
+
+def start_pooled_instances(ec2_client, instance_ids):
+    """
+    Start stopped pool instances, waiting first for any that are still stopping.
+
+    :return: The set of instance IDs that were started.
+    """
+    live = describe_live_instances(ec2_client, instance_ids)
+    stopping = [instance_id for instance_id, instance in live.items() if instance['State']['Name'] == 'stopping']
+    if stopping:
+        try:
+            ec2_client.get_waiter('instance_stopped').wait(InstanceIds=stopping)
+        except WaiterError as e:
+            print(f"Warm pool instances did not finish stopping: {e}")
+    candidates = [
+        instance_id for instance_id, instance in live.items()
+        if instance['State']['Name'] in ('stopped', 'stopping')
+    ]
+
+    started = set()
+    for start in range(0, len(candidates), POOL_BATCH_SIZE):
+        batch = candidates[start:start + POOL_BATCH_SIZE]
+        try:
+            ec2_client.start_instances(InstanceIds=batch)
+            started.update(batch)
+        except ClientError:
+            # One instance in the wrong state fails the whole call, so retry the batch one by one
+            for instance_id in batch:
+                try:
+                    ec2_client.start_instances(InstanceIds=[instance_id])
+                    started.add(instance_id)
+                except ClientError as e:
+                    print(f"Unable to start warm pool instance {instance_id}: {e}")
+    return started
+
+def stop_pooled_instances(ec2_client, instance_ids, hibernate=False):
+    """
+    Stop instances in batches, hibernating them if requested and supported.
+
+    :return: A dictionary mapping each instance ID to its previous state, current state and error.
+    """
+    outcomes = {
+        instance_id: {'previous_state': None, 'current_state': None, 'error': None}
+        for instance_id in instance_ids
+    }
+    for start in range(0, len(instance_ids), POOL_BATCH_SIZE):
+        batch = instance_ids[start:start + POOL_BATCH_SIZE]
+        try:
+            stopping = ec2_client.stop_instances(InstanceIds=batch, Hibernate=hibernate)['StoppingInstances']
+        except ClientError:
+            # Retry one by one, without hibernation for instances that were not launched with it
+            stopping = []
+            for instance_id in batch:
+                try:
+                    stopping.extend(ec2_client.stop_instances(InstanceIds=[instance_id])['StoppingInstances'])
+                except ClientError as e:
+                    outcomes[instance_id]['error'] = str(e)
+        for instance in stopping:
+            outcome = outcomes[instance['InstanceId']]
+            outcome['previous_state'] = instance['PreviousState']['Name']
+            outcome['current_state'] = instance['CurrentState']['Name']
+    return outcomes
@@ -1,95 +1,292 @@
-import boto3
-from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError
-from cloudmanager.utils import divide_configs, get_security_group_with_ssh
+import re
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import NoCredentialsError, PartialCredentialsError, ClientError, BotoCoreError
+from cloudmanager.utils import divide_configs
+from cloudmanager.deploy import assign_vm_names, get_aws_resources
+from cloudmanager.discovery import DiscoveryCache, account_key
+from cloudmanager.clients import get_ec2_client, get_sibling_client
+from cloudmanager.tracing import span
 
+# A region enabled in every account, through which describe_regions is sent when the session has no default
+REGION_LISTING_REGION = 'us-east-1'
 
-def check_aws_configs(aws_configs):
-    error_code = 0
+# describe_instance_types accepts at most 100 instance types per call
+DESCRIBE_TYPES_BATCH_SIZE = 100
+
+# On-Demand vCPU quotas by instance family prefix; every other family counts against the standard quota
+STANDARD_VCPU_QUOTA = ('L-1216C47A', 'Running On-Demand Standard (A, C, D, H, I, M, R, T, Z) instances')
+VCPU_QUOTAS = [
+    ('u-', 'L-43DA4232', 'Running On-Demand High Memory instances'),
+    ('trn', 'L-2C3B7624', 'Running On-Demand Trn instances'),
+    ('inf', 'L-1945791B', 'Running On-Demand Inf instances'),
+    ('hpc', 'L-F7808C92', 'Running On-Demand HPC instances'),
+    ('dl', 'L-6E869C2A', 'Running On-Demand DL instances'),
+    ('vt', 'L-DB2E81BA', 'Running On-Demand G and VT instances'),
+    ('g', 'L-DB2E81BA', 'Running On-Demand G and VT instances'),
+    ('f', 'L-74FC7D96', 'Running On-Demand F instances'),
+    ('p', 'L-417A185B', 'Running On-Demand P instances'),
+    ('x', 'L-7295265B', 'Running On-Demand X instances'),
+]
+
+
+def vcpu_quota_for(instance_type):
+    """Return the (quota code, quota name) of the On-Demand vCPU quota an instance type counts against."""
+    family = instance_type.split('.')[0].lower()
+    letters = re.match(r'[a-z]*-?', family).group(0)
+    for prefix, code, name in VCPU_QUOTAS:
+        if letters.startswith(prefix):
+            return code, name
+    return STANDARD_VCPU_QUOTA
+
+def available_regions(ec2_client):
+    """Return the names of the regions the account can use, with one describe_regions call."""
+    response = ec2_client.describe_regions(AllRegions=True)
+    return {
+        region['RegionName'] for region in response['Regions']
+        if region.get('OptInStatus', 'opt-in-not-required') in ('opt-in-not-required', 'opted-in')
+    }
+
+def enabled_regions_for(access_key, secret_key, regions):
+    """
+    Return the regions enabled for an account, or an empty set if they cannot be listed.
+
+    The list is read through a region that is always enabled, the session default or us-east-1,
+    rather than a configured one, since an opt-in region that is not enabled rejects the call.
+    The configured regions are only tried after those.
+    """
+    for region in [None, REGION_LISTING_REGION] + [region for region in regions if region != REGION_LISTING_REGION]:
+        try:
+            return available_regions(get_ec2_client(access_key, secret_key, region))
+        except (ClientError, BotoCoreError) as e:
+            error = e
+    print(f"Error: Unable to list the AWS regions enabled for this account. {error}")
+    return set()
+
+def offered_instance_types(ec2_client, instance_types):
+    """Return which of the given instance types are offered in the client's region, with one filtered query."""
+    offered = set()
+    paginator = ec2_client.get_paginator('describe_instance_type_offerings')
+    for page in paginator.paginate(
+        LocationType='region',
+        Filters=[{'Name': 'instance-type', 'Values': sorted(instance_types)}]
+    ):
+        offered.update(offering['InstanceType'] for offering in page['InstanceTypeOfferings'])
+    return offered
+
+def instance_type_vcpus(ec2_client, instance_types):
+    """Return the default vCPU count of each given instance type."""
+    vcpus = {}
+    instance_types = sorted(instance_types)
+    for start in range(0, len(instance_types), DESCRIBE_TYPES_BATCH_SIZE):
+        response = ec2_client.describe_instance_types(InstanceTypes=instance_types[start:start + DESCRIBE_TYPES_BATCH_SIZE])
+        for instance_type in response['InstanceTypes']:
+            vcpus[instance_type['InstanceType']] = instance_type['VCpuInfo']['DefaultVCpus']
+    return vcpus
+
+def running_instance_types(ec2_client):
+    """Count the pending and running instances of the client's region by instance type."""
+    counts = {}
+    paginator = ec2_client.get_paginator('describe_instances')
+    for page in paginator.paginate(Filters=[{'Name': 'instance-state-name', 'Values': ['pending', 'running']}]):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                counts[instance['InstanceType']] = counts.get(instance['InstanceType'], 0) + 1
+    return counts
+
+def vcpu_quota_limit(quotas_client, quota_code):
+    """Return the applied value of an EC2 vCPU quota, or its AWS default when none is applied."""
+    try:
+        return quotas_client.get_service_quota(ServiceCode='ec2', QuotaCode=quota_code)['Quota']['Value']
+    except quotas_client.exceptions.NoSuchResourceException:
+        return quotas_client.get_aws_default_service_quota(ServiceCode='ec2', QuotaCode=quota_code)['Quota']['Value']
+
+def check_vcpu_quotas(ec2_client, requested_types, region_plan):
+    """
+    Compare the vCPUs a region's VMs will add against its On-Demand vCPU quotas.
+
+    Requested vCPUs are added to those of instances already running in the region. The
+    outcome is stored per quota in ``region_plan['vcpus']``; any quota that would be exceeded is
+    reported as an error, and a quota that cannot be read as a warning.
+
+    :param requested_types: The number of VMs requested per instance type.
+    """
+    running = running_instance_types(ec2_client)
+    vcpus = instance_type_vcpus(ec2_client, set(requested_types) | set(running))
+
+    quotas = {}
+    for counts, field in ((requested_types, 'requested'), (running, 'in_use')):
+        for instance_type, number in counts.items():
+            code, name = vcpu_quota_for(instance_type)
+            quota = quotas.setdefault(code, {'name': name, 'requested': 0, 'in_use': 0, 'limit': None})
+            quota[field] += number * vcpus.get(instance_type, 0)
+    region_plan['vcpus'] = {code: quota for code, quota in quotas.items() if quota['requested']}
+
+    quotas_client = get_sibling_client(ec2_client, 'service-quotas')
+    if quotas_client is None:
+        region_plan['warnings'].append("vCPU quotas were not checked: no Service Quotas client for this region.")
+        return
+    for code, quota in region_plan['vcpus'].items():
+        try:
+            quota['limit'] = vcpu_quota_limit(quotas_client, code)
+        except (ClientError, BotoCoreError) as e:
+            region_plan['warnings'].append(f"Unable to read the '{quota['name']}' quota ({code}). {e}")
+            continue
+        if quota['requested'] + quota['in_use'] > quota['limit']:
+            region_plan['errors'].append(
+                f"'{quota['name']}' quota ({code}) allows {quota['limit']:g} vCPUs, but {quota['in_use']} are in use "
+                f"and {quota['requested']} more are requested.")
+
+def failed_region_plan(region, error):
+    """Return the plan of a region whose check could not complete."""
+    return {'available': False, 'instance_types': {}, 'vcpus': {}, 'warnings': [],
+            'errors': [f"Unable to check region '{region}'. {error}"]}
+
+def resolve_aws_region(ec2_client, region, indexed_vm_configs, vm_resources, discovery_cache, account,
+                       region_available=True):
+    """
+    Check one region and resolve the resources of the VMs deployed to it.
+
+    Every requested instance type is checked with one offerings query, and their aggregate
+    vCPUs are compared against the region's On-Demand vCPU quotas.
+
+    :param indexed_vm_configs: (index, vm_config) pairs of the VMs in this region.
+    :param vm_resources: The provider's list of resolved resources, filled in at each VM's index.
+    :param region_available: Whether the region is enabled for the account.
+    :return: The region's plan: availability, instance type availability, vCPU quotas, errors and warnings.
+    """
+    region_plan = {'available': region_available, 'instance_types': {}, 'vcpus': {}, 'errors': [], 'warnings': []}
+    if not region_available:
+        region_plan['errors'].append(f"Region '{region}' is not available.")
+        return region_plan
+
+    requested_types = {}
+    for _, vm_config in indexed_vm_configs:
+        requested_types[vm_config['instance_type']] = requested_types.get(vm_config['instance_type'], 0) + 1
+
+    # Check every requested instance type with a single query
+    try:
+        offered = offered_instance_types(ec2_client, requested_types)
+        for instance_type in sorted(requested_types):
+            region_plan['instance_types'][instance_type] = instance_type in offered
+            if instance_type not in offered:
+                region_plan['errors'].append(f"Instance type '{instance_type}' is not available in region '{region}'.")
+    except (ClientError, BotoCoreError) as e:
+        for instance_type in requested_types:
+            region_plan['instance_types'][instance_type] = False
+        region_plan['errors'].append(f"Unable to verify instance types in region '{region}'. {e}")
+
+    # Check that the VMs fit in the vCPU quotas
+    offered_types = {
+        instance_type: number for instance_type, number in requested_types.items()
+        if region_plan['instance_types'][instance_type]
+    }
+    if offered_types:
+        try:
+            check_vcpu_quotas(ec2_client, offered_types, region_plan)
+        except (ClientError, BotoCoreError) as e:
+            region_plan['warnings'].append(f"Unable to check vCPU quotas in region '{region}'. {e}")
+
+    for index, vm_config in indexed_vm_configs:
+        # Resolve VPC, subnet, SSH security group, key pair and AMI
+        try:
+            vm_resources[index] = get_aws_resources(ec2_client, vm_config, discovery_cache, account)
+        except (ClientError, BotoCoreError, ValueError, IndexError, KeyError) as e:
+            region_plan['errors'].append(
+                f"Unable to resolve resources for '{vm_config['vm_name']}' in region '{region}'. {e}")
+
+    return region_plan
+
+def resolve_aws_configs(aws_configs, discovery_cache=None, parallel_regions=16):
+    """
+    Validate AWS configurations and resolve the resources every VM will be deployed with.
+
+    VMs are grouped by region and regions are checked concurrently, so each region, instance
+    type offering, vCPU quota and discovered resource is looked up once per run. The returned
+    plan can be passed straight to ``runner.deploy`` so deployment does not repeat any of these lookups.
+
+    :param aws_configs: The AWS provider entries from the configuration file.
+    :param discovery_cache: An optional DiscoveryCache shared with the deploy step.
+    :param parallel_regions: The maximum number of regions checked at once.
+    :return: A plan dictionary with an ``error_code`` (0 when every check passed) and, for each
+             provider entry in order, its per-region results and the resolved resources of each VM.
+    """
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache(path=None)
+    plan = {'error_code': 0, 'providers': []}
 
     for aws_config in aws_configs:
+        provider_plan = {'regions': {}, 'vm_resources': [None] * len(aws_config['vm_configs'])}
+        plan['providers'].append(provider_plan)
         try:
             # Extract credentials
             access_key = aws_config['credentials']['access_key']
             secret_key = aws_config['credentials']['secret_key']
+            account = account_key(access_key)
+            assign_vm_names(aws_config['vm_configs'])
 
-            for vm_config in aws_config['vm_configs']:
-                region = vm_config['region']
-                instance_type = vm_config['instance_type']
-                vpc_id = vm_config.get('vpc_id', None)
-                subnet_id = vm_config.get('subnet_id', None)
-                security_group_ids = vm_config.get('security_group_ids', [])
-                key_pair_name = vm_config.get('key_pair_name', None)
-
-                # Create an EC2 client for the specific region
-                ec2_client = boto3.client(
-                    'ec2',
-                    aws_access_key_id=access_key,
-                    aws_secret_access_key=secret_key,
-                    region_name=region
-                )
-
-                # Check if the region is available
-                try:
-                    regions_response = ec2_client.describe_regions(RegionNames=[region])
-                    if not regions_response['Regions']:
-                        print(f"Error: Region '{region}' is not available.")
-                        error_code = 1
-                        continue
-
-                except ClientError as e:
-                    print(f"Error: Region '{region}' is not available. {e}")
-                    error_code = 1
-                    continue
-
-                # Check if the instance type is available in the region
+            vms_by_region = {}
+            for index, vm_config in enumerate(aws_config['vm_configs']):
+                vms_by_region.setdefault(vm_config['region'], []).append((index, vm_config))
+            if not vms_by_region:
+                continue
+
+            # One describe_regions call covers every region of the provider entry
+            enabled_regions = enabled_regions_for(access_key, secret_key, list(vms_by_region))
+
+            def check_region(region):
+                # Get the shared EC2 client for the specific region
                 try:
-                    response = ec2_client.describe_instance_type_offerings(
-                        LocationType='region',
-                        Filters=[{'Name': 'instance-type', 'Values': [instance_type]}]
-                    )
-                    if not response['InstanceTypeOfferings']:
-                        print(f"Error: Instance type '{instance_type}' is not available in region '{region}'.")
-                        error_code = 1
-
-                except ClientError as e:
-                    print(f"Error: Unable to verify instance type '{instance_type}' in region '{region}'. {e}")
-                    error_code = 1
-                    
-                if 'vpc_id' in vm_config:
-                    vpc_id = vm_config['vpc_id']
-                else:
-                    vpc_response = ec2_client.describe_vpcs()
-                    vpc_id = vpc_response['Vpcs'][0]['VpcId']  # Assuming the first VPC found
-                # Check for at least one Security Group if not provided
-                if not security_group_ids:
-                    try:
-                        security_group_ids = get_security_group_with_ssh(ec2_client, vpc_id)
-                        if not security_group_ids:
-                            print(f"Error: No Security Groups found in region '{region}' that allow SSH.")
-                            error_code = 1
-                    except ClientError as e:
-                        print(f"Error: Unable to retrieve Security Groups in region '{region}'. {e}")
-                        error_code = 1
-
-                # Check if the Key Pair exists
-                if not key_pair_name:
-                    try:
-                        key_pair_response = ec2_client.describe_key_pairs()
-                        if not key_pair_response['KeyPairs']:
-                            print(f"Error: No Key Pairs found in region '{region}'.")
-                            error_code = 1
-                        else:
-                            key_pair_name = key_pair_response['KeyPairs'][0]['KeyName']
-                    except ClientError as e:
-                        print(f"Error: Unable to retrieve Key Pairs in region '{region}'. {e}")
-                        error_code = 1
+                    ec2_client = get_ec2_client(access_key, secret_key, region)
+                    with span('precheck.region', region=region, vms=len(vms_by_region[region])):
+                        return resolve_aws_region(
+                            ec2_client, region, vms_by_region[region], provider_plan['vm_resources'], discovery_cache,
+                            account, region in enabled_regions)
+                except (ClientError, BotoCoreError) as e:
+                    # A connection error in one region fails that region, not the whole precheck
+                    return failed_region_plan(region, e)
+
+            regions = list(vms_by_region)
+            with ThreadPoolExecutor(max_workers=max(1, min(parallel_regions, len(regions)))) as executor:
+                for region, region_plan in zip(regions, executor.map(check_region, regions)):
+                    provider_plan['regions'][region] = region_plan
 
         except (NoCredentialsError, PartialCredentialsError) as e:
             print(f"Error: AWS credentials are invalid or incomplete. {e}")
-            error_code = 1
+            plan['error_code'] = 1
             break
 
-    return error_code
+    for provider_plan in plan['providers']:
+        for region_plan in provider_plan['regions'].values():
+            if region_plan['errors']:
+                plan['error_code'] = 1
+
+    return plan
+
+def print_precheck_report(plan):
+    """Print one line per region with its instance types and vCPU quota usage, followed by its errors and warnings."""
+    for index, provider_plan in enumerate(plan['providers']):
+        for region, region_plan in sorted(provider_plan['regions'].items()):
+            status = 'ok' if not region_plan['errors'] else 'FAILED'
+            types = ', '.join(
+                f"{instance_type}{'' if offered else ' (not offered)'}"
+                for instance_type, offered in region_plan['instance_types'].items()
+            ) or '-'
+            quotas = ', '.join(
+                f"{quota['requested']}+{quota['in_use']}/{'?' if quota['limit'] is None else format(quota['limit'], 'g')} "
+                f"vCPUs ({code})"
+                for code, quota in region_plan['vcpus'].items()
+            ) or '-'
+            print(f"[provider {index}] {region:<16} {status:<7} types: {types}; quotas: {quotas}")
+            for error in region_plan['errors']:
+                print(f"    Error: {error}")
+            for warning in region_plan['warnings']:
+                print(f"    Warning: {warning}")
+
+def check_aws_configs(aws_configs, discovery_cache=None):
+    """Validate AWS configurations, print the report and return 0 if every check passed, 1 otherwise."""
+    plan = resolve_aws_configs(aws_configs, discovery_cache)
+    print_precheck_report(plan)
+    return plan['error_code']
 
 # Example usage
 if __name__ == "__main__":
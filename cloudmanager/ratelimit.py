@@ -0,0 +1,206 @@
+import threading
+import time
+from cloudmanager.tracing import count
+
+# Error codes AWS services return when a caller exceeds its request rate
+THROTTLE_ERROR_CODES = {
+    'RequestLimitExceeded', 'Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+    'RequestThrottledException', 'TooManyRequestsException', 'SlowDown', 'EC2ThrottledException',
+}
+
+
+class TokenBucket:
+    """
+    A token bucket that hands out reservations instead of polling.
+
+    Each call takes a token right away, going into debt when the bucket is empty, and is told
+    how long to wait for its token to be refilled, so callers are served in arrival order.
+    """
+
+    def __init__(self, rate, burst):
+        """
+        :param rate: Tokens added per second.
+        :param burst: The maximum number of tokens the bucket holds.
+        """
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """Take one token and return the number of seconds to wait before using it."""
+        with self._lock:
+            self._refill()
+            self.tokens -= 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0.0
+
+    def set_rate(self, rate, drain=False):
+        """Change the refill rate; with ``drain``, also drop any saved-up burst."""
+        with self._lock:
+            self._refill()
+            self.rate = rate
+            if drain:
+                self.tokens = min(self.tokens, 0)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+
+class AdaptiveRateLimiter:
+    """
+    Limit the request rate and the number of requests in flight to one (account, region) endpoint.
+
+    Both limits follow AIMD: every throttling error halves them, at most once per ``cooldown``
+    seconds so a burst of throttles counts once, and every successful call raises them additively,
+    so throughput settles just below what the endpoint allows instead of oscillating through retries.
+    """
+
+    def __init__(self, rate=20.0, burst=50, min_rate=1.0, max_rate=100.0, concurrency=16, min_concurrency=1,
+                 max_concurrency=64, backoff=0.5, cooldown=1.0):
+        """
+        :param rate: The initial requests per second.
+        :param burst: Requests that may be sent at once after an idle period.
+        :param concurrency: The initial number of requests allowed in flight.
+        :param backoff: The factor both limits are multiplied by on throttling.
+        :param cooldown: Seconds after a decrease during which further throttles do not decrease again.
+        """
+        self.bucket = TokenBucket(rate, burst)
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.concurrency = float(concurrency)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.backoff = backoff
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.calls = 0
+        self.throttled = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self._last_decrease = float('-inf')
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """Block until a request may be sent and return how long the caller waited."""
+        start = time.monotonic()
+        with self._condition:
+            while self.in_flight >= int(self.concurrency):
+                self._condition.wait()
+            self.in_flight += 1
+        wait = self.bucket.reserve()
+        if wait:
+            time.sleep(wait)
+        delay = time.monotonic() - start
+        with self._condition:
+            self.calls += 1
+            self.queue_seconds += delay
+            self.max_queue_seconds = max(self.max_queue_seconds, delay)
+        return delay
+
+    def release(self, throttled=False, succeeded=False):
+        """
+        Free the slot of a finished request and adapt the limits to its outcome.
+
+        :param throttled: The request was rejected for exceeding the rate limit.
+        :param succeeded: The request succeeded; other failures leave the limits unchanged.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttled += 1
+                now = time.monotonic()
+                if now - self._last_decrease >= self.cooldown:
+                    self._last_decrease = now
+                    self.concurrency = max(self.min_concurrency, self.concurrency * self.backoff)
+                    self.rate = max(self.min_rate, self.rate * self.backoff)
+                    self.bucket.set_rate(self.rate, drain=True)
+            elif succeeded:
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1 / self.concurrency)
+                if self.rate < self.max_rate:
+                    self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+                    self.bucket.set_rate(self.rate)
+            self._condition.notify_all()
+
+    def stats(self):
+        """Return the calls made, throttles seen, queueing delay and current limits."""
+        with self._condition:
+            return {
+                'calls': self.calls,
+                'throttled': self.throttled,
+                'queue_seconds': self.queue_seconds,
+                'max_queue_seconds': self.max_queue_seconds,
+                'rate': self.rate,
+                'concurrency': int(self.concurrency),
+            }
+
+
+class RateLimiterRegistry:
+    """
+    One AdaptiveRateLimiter per (service, account, region), attached to boto3 clients through their events.
+
+    Every attempt, including botocore's own retries, takes a slot and a token before it is sent
+    and gives the slot back with its outcome once the response is in, so all clients of an
+    endpoint share one budget. Throttles and queueing delay are also counted on the shared tracer.
+    """
+
+    def __init__(self, **limiter_options):
+        """
+        :param limiter_options: Keyword arguments for every AdaptiveRateLimiter created.
+        """
+        self.limiter_options = limiter_options
+        self._lock = threading.Lock()
+        self._limiters = {}
+        self._held = threading.local()
+
+    def get(self, key):
+        """Return the limiter for a key, creating it on first use."""
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                limiter = self._limiters[key] = AdaptiveRateLimiter(**self.limiter_options)
+            return limiter
+
+    def attach(self, client, key):
+        """Route every request of a boto3 client through the limiter for ``key``."""
+        limiter = self.get(key)
+        service = client.meta.service_model.service_id.hyphenize()
+        client.meta.events.register(f'before-send.{service}', lambda **kwargs: self._before_send(limiter, service))
+        client.meta.events.register(f'needs-retry.{service}', lambda response=None, **kwargs: self._after_attempt(
+            limiter, service, response))
+        # Exceptions raised while sending skip needs-retry; make sure their slot is released
+        client.meta.events.register(f'after-call-error.{service}', lambda **kwargs: self._after_attempt(
+            limiter, service, None))
+
+    def stats(self):
+        """Return the stats of every limiter, keyed by (service, account, region)."""
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {key: limiter.stats() for key, limiter in limiters.items()}
+
+    def _before_send(self, limiter, service):
+        delay = limiter.acquire()
+        self._held.limiter = limiter
+        if delay:
+            count(f"ratelimit.{service}.queue_ms", int(delay * 1000))
+        # A handler that returns a value replaces the HTTP response, so always return None
+        return None
+
+    def _after_attempt(self, limiter, service, response):
+        if getattr(self._held, 'limiter', None) is not limiter:
+            return None
+        self._held.limiter = None
+        error_code = None
+        if response is not None:
+            error_code = response[1].get('Error', {}).get('Code')
+        throttled = error_code in THROTTLE_ERROR_CODES
+        if throttled:
+            count(f"ratelimit.{service}.throttled")
+        limiter.release(throttled=throttled,
+                        succeeded=response is not None and error_code is None and response[0].status_code < 400)
+        # Returning a value here would be taken as a retry delay
+        return None
+
@@ -0,0 +1,308 @@
+import asyncio
+import random
+import socket
+import threading
+import time
+from cloudmanager.ssh import get_ssh_manager
+
+# describe_instances accepts at most 1000 instance IDs per call
+DESCRIBE_BATCH_SIZE = 1000
+
+
+def backoff_delays(base_interval, max_interval):
+    """Yield exponentially growing delays with jitter, capped at max_interval."""
+    attempt = 0
+    while True:
+        cap = min(max_interval, base_interval * 2 ** attempt)
+        yield cap / 2 + random.uniform(0, cap / 2)
+        attempt += 1
+
+def probe_ssh_banner(host, port=22, timeout=5):
+    """Return True if an SSH server answers with its banner on host:port."""
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            return sock.recv(256).startswith(b'SSH-')
+    except OSError:
+        return False
+
+def probe_ssh_login(host, user):
+    """Return True if the user can log in; the connection is kept open for later commands."""
+    return get_ssh_manager().open(host, user)
+
+def wait_for_ssh(host, user=None, port=22, timeout=300, base_interval=1, max_interval=15):
+    """
+    Wait until a host accepts SSH connections, replacing a fixed sleep after boot.
+
+    The port is probed for an SSH banner first. If a user is given, the wait continues until
+    that user can log in, since user_data may still be creating the account when sshd starts.
+    """
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(base_interval, max_interval)
+    while True:
+        if probe_ssh_banner(host, port) and (user is None or probe_ssh_login(host, user)):
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Timeout waiting for SSH on {host}:{port}")
+        time.sleep(min(next(delays), remaining))
+
+
+async def probe_ssh_banner_async(host, port=22, timeout=5):
+    """Coroutine counterpart of ``probe_ssh_banner``."""
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    try:
+        return (await asyncio.wait_for(reader.read(256), timeout)).startswith(b'SSH-')
+    except (OSError, asyncio.TimeoutError):
+        return False
+    finally:
+        writer.close()
+
+async def wait_for_ssh_async(host, user=None, port=22, timeout=300, base_interval=1, max_interval=15):
+    """Coroutine counterpart of ``wait_for_ssh``; waiting does not hold a thread."""
+    deadline = time.monotonic() + timeout
+    delays = backoff_delays(base_interval, max_interval)
+    while True:
+        if await probe_ssh_banner_async(host, port) and (
+                user is None or await get_ssh_manager().open_async(host, user)):
+            return
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Timeout waiting for SSH on {host}:{port}")
+        await asyncio.sleep(min(next(delays), remaining))
+
+def pending_resolutions(observations, response):
+    """
+    Return (instance ID, public IP, error) for every instance in a describe_instances response
+    that has a public IP or will never get one, noting what was seen in ``observations``.
+    """
+    resolved = []
+    for reservation in response.get('Reservations', []):
+        for instance in reservation['Instances']:
+            instance_id = instance['InstanceId']
+            state = instance['State']['Name']
+            public_ip = instance.get('PublicIpAddress')
+            observe_instance(observations, instance)
+            if public_ip:
+                resolved.append((instance_id, public_ip, None))
+            elif state in ('shutting-down', 'terminated', 'stopping', 'stopped'):
+                resolved.append((instance_id, None, RuntimeError(
+                    f"Instance {instance_id} entered state '{state}' before getting a public IP")))
+    return resolved
+
+def observe_instance(observations, instance):
+    """Note an instance's availability zone and when it was first seen running, for the launch latency history."""
+    observation = observations.setdefault(instance['InstanceId'], {'availability_zone': None, 'running_at': None})
+    observation['availability_zone'] = instance.get('Placement', {}).get('AvailabilityZone')
+    if observation['running_at'] is None and instance['State']['Name'] == 'running':
+        observation['running_at'] = time.monotonic()
+
+def expired(instance_ids, deadlines):
+    """Return the instances whose own deadline has passed."""
+    now = time.monotonic()
+    return {instance_id for instance_id in instance_ids if deadlines[instance_id] <= now}
+
+class InstanceReadiness:
+    """
+    Wait for instances across a fleet to get a public IP.
+
+    Every tracked instance in a region is covered by one batched ``describe_instances`` call per
+    poll, made from a single background thread per region with exponential backoff and jitter.
+    Callers block in ``wait_for_public_ip`` only for their own instance and are released as soon
+    as it has an address. Each instance gets ``timeout`` seconds from when it is tracked, so a
+    poller that is already busy gives late instances as long as early ones. What each poll sees
+    is kept in ``observations`` for launch timings.
+    """
+
+    def __init__(self, ec2_clients, timeout=600, base_interval=2, max_interval=20):
+        """
+        :param ec2_clients: A dictionary mapping region name to an EC2 client for that region.
+        :param timeout: Seconds to wait for each instance, from when it is tracked, before giving up on it.
+        """
+        self.ec2_clients = ec2_clients
+        self.timeout = timeout
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self._lock = threading.Lock()
+        self.observations = {}
+        self._pending = {}
+        self._deadlines = {}
+        self._events = {}
+        self._results = {}
+        self._pollers = {}
+
+    def track(self, region, instance_ids):
+        """Start waiting for the given instances in a region."""
+        deadline = time.monotonic() + self.timeout
+        with self._lock:
+            pending = self._pending.setdefault(region, set())
+            for instance_id in instance_ids:
+                self._events.setdefault(instance_id, threading.Event())
+                self._deadlines.setdefault(instance_id, deadline)
+                pending.add(instance_id)
+            if region not in self._pollers:
+                poller = threading.Thread(target=self._poll, args=(region,), daemon=True)
+                self._pollers[region] = poller
+                poller.start()
+
+    def wait_for_public_ip(self, instance_id):
+        """Block until a tracked instance has a public IP and return it."""
+        # The poller resolves every instance by its deadline; the timeout only guards against a lost poller
+        if not self._events[instance_id].wait(self.timeout + 2 * self.max_interval):
+            raise TimeoutError(f"Timeout waiting for public IP for instance {instance_id}")
+        public_ip, error = self._results[instance_id]
+        if error:
+            raise error
+        return public_ip
+
+    def _resolve(self, instance_id, public_ip=None, error=None):
+        self._results[instance_id] = (public_ip, error)
+        self._events[instance_id].set()
+
+    def _poll(self, region):
+        try:
+            self._poll_region(region)
+        except BaseException as e:
+            # Never leave callers waiting on a poller that is gone
+            with self._lock:
+                stranded = self._pending[region]
+                self._pending[region] = set()
+                del self._pollers[region]
+            for instance_id in stranded:
+                self._resolve(instance_id, error=RuntimeError(
+                    f"Polling for instance {instance_id} in {region} stopped: {e!r}"))
+
+    def _poll_region(self, region):
+        ec2_client = self.ec2_clients[region]
+        delays = backoff_delays(self.base_interval, self.max_interval)
+        while True:
+            with self._lock:
+                pending = sorted(self._pending[region])
+                if not pending:
+                    del self._pollers[region]
+                    return
+
+            for start in range(0, len(pending), DESCRIBE_BATCH_SIZE):
+                batch = pending[start:start + DESCRIBE_BATCH_SIZE]
+                try:
+                    response = ec2_client.describe_instances(InstanceIds=batch)
+                    resolved = pending_resolutions(self.observations, response)
+                except Exception as e:
+                    # Newly created instances may not be visible yet, and connection errors may be
+                    # transient; keep polling until the deadline
+                    print(f"Error describing instances in {region}: {e}")
+                    continue
+                for instance_id, public_ip, error in resolved:
+                    with self._lock:
+                        self._pending[region].discard(instance_id)
+                    self._resolve(instance_id, public_ip=public_ip, error=error)
+
+            with self._lock:
+                timed_out = expired(self._pending[region], self._deadlines)
+                self._pending[region] -= timed_out
+                next_deadline = min((self._deadlines[instance_id] for instance_id in self._pending[region]),
+                                    default=None)
+            for instance_id in timed_out:
+                self._resolve(instance_id, error=TimeoutError(
+                    f"Timeout waiting for public IP for instance {instance_id}"))
+            if next_deadline is not None:
+                time.sleep(max(0, min(next(delays), next_deadline - time.monotonic())))
+
+
+class AsyncInstanceReadiness:
+    """
+    Coroutine counterpart of ``InstanceReadiness`` for the asyncio engine.
+
+    One polling task per region makes the batched ``describe_instances`` calls, offloaded to a
+    worker thread since boto3 is blocking, and resolves a future per instance.
+    """
+
+    def __init__(self, ec2_clients, timeout=600, base_interval=2, max_interval=20):
+        """
+        :param ec2_clients: A dictionary mapping region name to an EC2 client for that region.
+        :param timeout: Seconds to wait for each instance, from when it is tracked, before giving up on it.
+        """
+        self.ec2_clients = ec2_clients
+        self.timeout = timeout
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self.observations = {}
+        self._pending = {}
+        self._deadlines = {}
+        self._futures = {}
+        self._pollers = {}
+
+    def track(self, region, instance_ids):
+        """Start waiting for the given instances in a region; must be called from the event loop."""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.timeout
+        pending = self._pending.setdefault(region, set())
+        for instance_id in instance_ids:
+            self._futures.setdefault(instance_id, loop.create_future())
+            self._deadlines.setdefault(instance_id, deadline)
+            pending.add(instance_id)
+        if region not in self._pollers:
+            self._pollers[region] = asyncio.create_task(self._poll(region), name=f"readiness-{region}")
+
+    async def wait_for_public_ip(self, instance_id):
+        """Wait until a tracked instance has a public IP and return it."""
+        # The poller resolves every instance by its deadline; the timeout only guards against a lost poller
+        try:
+            return await asyncio.wait_for(asyncio.shield(self._futures[instance_id]),
+                                          self.timeout + 2 * self.max_interval)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"Timeout waiting for public IP for instance {instance_id}")
+
+    def _resolve(self, instance_id, public_ip=None, error=None):
+        future = self._futures[instance_id]
+        if future.done():
+            return
+        if error:
+            future.set_exception(error)
+        else:
+            future.set_result(public_ip)
+
+    async def _poll(self, region):
+        try:
+            await self._poll_region(region)
+        except BaseException as e:
+            # Never leave callers waiting on a poller that is gone
+            stranded = self._pending[region]
+            self._pending[region] = set()
+            del self._pollers[region]
+            for instance_id in stranded:
+                self._resolve(instance_id, error=RuntimeError(
+                    f"Polling for instance {instance_id} in {region} stopped: {e!r}"))
+            if isinstance(e, asyncio.CancelledError):
+                raise
+
+    async def _poll_region(self, region):
+        ec2_client = self.ec2_clients[region]
+        delays = backoff_delays(self.base_interval, self.max_interval)
+        while self._pending[region]:
+            pending = sorted(self._pending[region])
+            for start in range(0, len(pending), DESCRIBE_BATCH_SIZE):
+                batch = pending[start:start + DESCRIBE_BATCH_SIZE]
+                try:
+                    response = await asyncio.to_thread(ec2_client.describe_instances, InstanceIds=batch)
+                    resolved = pending_resolutions(self.observations, response)
+                except Exception as e:
+                    # Newly created instances may not be visible yet, and connection errors may be
+                    # transient; keep polling until the deadline
+                    print(f"Error describing instances in {region}: {e}")
+                    continue
+                for instance_id, public_ip, error in resolved:
+                    self._pending[region].discard(instance_id)
+                    self._resolve(instance_id, public_ip=public_ip, error=error)
+
+            timed_out = expired(self._pending[region], self._deadlines)
+            self._pending[region] -= timed_out
+            for instance_id in timed_out:
+                self._resolve(instance_id, error=TimeoutError(
+                    f"Timeout waiting for public IP for instance {instance_id}"))
+            if self._pending[region]:
+                next_deadline = min(self._deadlines[instance_id] for instance_id in self._pending[region])
+                await asyncio.sleep(max(0, min(next(delays), next_deadline - time.monotonic())))
+        del self._pollers[region]
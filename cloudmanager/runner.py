@@ -1,15 +1,35 @@
 import os
 import sys
 import argparse
+import asyncio
 import boto3
-from cloudmanager.utils import divide_configs
-from cloudmanager.precheck import check_aws_configs
-from cloudmanager.deploy import deploy_aws_vm, terminate_aws_instance
+from cloudmanager.utils import divide_configs, PLACEMENT_MODES
+from cloudmanager.precheck import resolve_aws_configs, print_precheck_report
+from cloudmanager.discovery import DiscoveryCache
+from cloudmanager.clients import get_client_pool, get_rate_limiters
+from cloudmanager.ssh import get_ssh_manager
+from cloudmanager.tracing import get_tracer, span
+from cloudmanager.deploy import finish_aws_vms, finish_aws_vms_async, resolved_resources_by_name, vm_result
+from cloudmanager.backends import BACKENDS, get_backend
+from cloudmanager.state import DeploymentState, STATE_FILE_NAME, reconcile_aws_config
+from cloudmanager.teardown import teardown_aws_fleet, teardown_aws_fleet_async, teardown_group_or_report
+from cloudmanager.collect import collect_aws_fleet, COLLECT_PARALLEL
+from cloudmanager.bake import apply_baked_images
+from cloudmanager.pipeline import ProviderPipeline, PipelineScheduler
+from cloudmanager.pool import WarmPool, DEFAULT_MAX_SIZE
 
-def precheck(aws_configs, azure_configs):
-    """Run prechecks for both AWS and Azure configurations."""
+ENGINES = ('threads', 'async')
+
+def precheck(aws_configs, azure_configs, discovery_cache=None):
+    """
+    Run prechecks for both AWS and Azure configurations.
+
+    Returns the resolved AWS plan when every check passed, or None otherwise.
+    """
     print("Running prechecks for AWS configurations...")
-    aws_precheck_passed = check_aws_configs(aws_configs) == 0
+    aws_plan = resolve_aws_configs(aws_configs, discovery_cache)
+    print_precheck_report(aws_plan)
+    aws_precheck_passed = aws_plan['error_code'] == 0
 
     print("Running prechecks for Azure configurations...")
     azure_precheck_passed = True  # Placeholder for Azure precheck logic
@@ -21,17 +41,120 @@ def precheck(aws_configs, azure_configs):
 
     if not aws_precheck_passed or not azure_precheck_passed:
         print("Precheck failed. Exiting...")
-        return False
+        return None
 
     print("Precheck completed successfully for both AWS and Azure.")
-    return True
+    return aws_plan
+
+
+def bake(aws_configs, aws_plan):
+    """Switch every AWS VM to a baked image of its provisioned state, baking any that are missing."""
+    print("Resolving baked images for AWS configurations...")
+    for aws_config, provider_plan in zip(aws_configs, aws_plan['providers']):
+        apply_baked_images(aws_config, provider_plan['vm_resources'])
+
+
+def run_backend(backend, engine, aws_config, output_dir, parallel, discovery_cache, vm_resources, state):
+    """Deploy a provider entry with a launch backend on the chosen engine and return the per-VM results."""
+    args = (aws_config, output_dir, parallel, discovery_cache, vm_resources, state)
+    if engine == 'async':
+        return asyncio.run(backend.deploy_async(*args))
+    return backend.deploy(*args)
+
+
+def reconcile_and_deploy(aws_config, output_dir, parallel, discovery_cache, vm_resources, state, engine='threads',
+                         backend_name='terraform', other_vm_names=()):
+    """
+    Deploy only the VMs of a provider entry that are missing from the recorded, live state.
+
+    :param other_vm_names: The VM names of the other provider entries with the same credentials,
+                           which this entry must not treat as orphans.
+    """
+    plan = reconcile_aws_config(aws_config, state, other_vm_names)
+    print(f"Reconcile: {len(plan['kept'])} VMs kept ({len(plan['resume'])} to resume), "
+          f"{len(plan['create'])} to create, {len(plan['orphans'])} orphans terminated.")
 
+    results = [vm_result(vm_config) for vm_config in plan['kept'] if vm_config not in plan['resume']]
+    if plan['resume']:
+        if engine == 'async':
+            results.extend(asyncio.run(finish_aws_vms_async(aws_config, plan['resume'], parallel, state)))
+        else:
+            results.extend(finish_aws_vms(aws_config, plan['resume'], parallel, state))
+    if plan['create']:
+        # New VMs never use a fleet configuration, so kept VMs are never part of a Terraform apply
+        resources_by_name = resolved_resources_by_name(aws_config['vm_configs'], vm_resources)
+        results.extend(run_backend(
+            get_backend(backend_name), engine, dict(aws_config, vm_configs=plan['create']), output_dir, parallel,
+            discovery_cache, [resources_by_name.get(vm_config['vm_name']) for vm_config in plan['create']], state))
+    return results
 
-def deploy(aws_configs, azure_configs, output_dir):
-    """Deploy both AWS and Azure instances."""
+
+def deploy_from_warm_pool(warm_pool, aws_config, output_dir, parallel, discovery_cache, vm_resources, state,
+                          engine='threads', backend_name='ec2'):
+    """Restart pooled instances for the VMs of a provider entry that match one, and launch the rest."""
+    vm_configs = aws_config['vm_configs']
+    resources_list = vm_resources or [None] * len(vm_configs)
+    claimed = warm_pool.claim(aws_config, vm_configs, resources_list, state)
+    print(f"Warm pool: {len(claimed)}/{len(vm_configs)} VMs restarted from stopped instances.")
+
+    results = []
+    if claimed:
+        if engine == 'async':
+            results.extend(asyncio.run(finish_aws_vms_async(aws_config, claimed, parallel, state)))
+        else:
+            results.extend(finish_aws_vms(aws_config, claimed, parallel, state))
+    remaining = [(vm_config, resources) for vm_config, resources in zip(vm_configs, resources_list)
+                 if vm_config not in claimed]
+    if remaining:
+        results.extend(run_backend(
+            get_backend(backend_name), engine, dict(aws_config, vm_configs=[vm_config for vm_config, _ in remaining]),
+            output_dir, parallel, discovery_cache, [resources for _, resources in remaining], state))
+    return results
+
+
+def deploy(aws_configs, azure_configs, output_dir, parallel=1, fleet=False, aws_plan=None, discovery_cache=None,
+           state=None, reconcile=False, engine='threads', backend_name='terraform', warm_pool=None):
+    """
+    Deploy both AWS and Azure instances and return the per-VM results.
+
+    When ``aws_plan`` comes from precheck, its resolved resources are used as-is. Every VM's
+    progress is recorded in ``state`` if given; with ``reconcile`` only VMs missing from it are deployed.
+    With the 'async' ``engine``, each provider entry is deployed on an asyncio event loop instead of threads.
+    Instances are created by the launch backend named ``backend_name`` (see ``backends.BACKENDS``).
+    With a ``warm_pool``, matching stopped instances are restarted before anything new is launched.
+    """
     print("Starting deployment for AWS configurations...")
-    for aws_config in aws_configs:
-        deploy_aws_vm(aws_config, output_dir)
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache()
+    results = []
+    for index, aws_config in enumerate(aws_configs):
+        vm_resources = aws_plan['providers'][index]['vm_resources'] if aws_plan else None
+        if reconcile:
+            other_vm_names = [
+                vm_config['vm_name']
+                for other_index, other in enumerate(aws_configs)
+                if other_index != index and other['credentials']['access_key'] == aws_config['credentials']['access_key']
+                for vm_config in other['vm_configs']
+            ]
+            results.extend(reconcile_and_deploy(aws_config, output_dir, parallel, discovery_cache, vm_resources, state,
+                                                engine, backend_name, other_vm_names))
+            continue
+        if warm_pool is not None:
+            results.extend(deploy_from_warm_pool(warm_pool, aws_config, output_dir, parallel, discovery_cache,
+                                                 vm_resources, state, engine, backend_name))
+            continue
+        if backend_name == 'terraform':
+            backend = get_backend(backend_name, fleet=fleet, fleet_name=f"aws-fleet-{index}")
+        else:
+            backend = get_backend(backend_name)
+        results.extend(run_backend(backend, engine, aws_config, output_dir, parallel, discovery_cache, vm_resources,
+                                   state))
+    print(f"AWS discovery cache: {discovery_cache.hits} hits, {discovery_cache.misses} misses.")
+
+    failed = [result for result in results if result['error']]
+    for result in failed:
+        print(f"Deployment failed for {result['vm_name']}: {result['error']}")
+    print(f"{len(results) - len(failed)}/{len(results)} AWS VMs deployed successfully.")
     
     print("Starting deployment for Azure configurations...")
     # Placeholder: Implement Azure deployment logic here
@@ -39,32 +162,135 @@ def deploy(aws_configs, azure_configs, output_dir):
     #     deploy_azure_vm(azure_config, output_dir)
     
     print("Deployment completed for both AWS and Azure.")
+    return results
 
 
-def teardown(aws_configs, azure_configs):
-    """Teardown both AWS and Azure instances."""
-    print("Starting teardown for AWS configurations...")
-    for aws_config in aws_configs:
-        region = aws_config['vm_configs'][0]['region']
-        for vm_config in aws_config['vm_configs']:
-            instance_id = vm_config.get('instance_id')  # Ensure the instance_id is available
-            if instance_id:
-                access_key = aws_config['credentials']['access_key']
-                secret_key = aws_config['credentials']['secret_key']
-                terminate_aws_instance(access_key, secret_key, region, instance_id)
+def collect(aws_configs, parallel=COLLECT_PARALLEL, terminate=True, wait=False, state=None):
+    """
+    Download the results of every AWS VM with a 'collect' setting, up to ``parallel`` VMs at once
+    (``COLLECT_PARALLEL`` by default, independent of the deploy parallelism).
+
+    With ``terminate``, each of these VMs is terminated as soon as its own collection has
+    finished instead of waiting for the rest of the fleet.
+
+    :return: The per-instance teardown outcomes of the VMs terminated here.
+    """
+    terminated = []
+    if not any(vm_config.get('collect') for aws_config in aws_configs for vm_config in aws_config['vm_configs']):
+        return terminated
+    print("Collecting results from AWS instances...")
+
+    def terminate_collected(aws_config, vm_config):
+        group_key = (aws_config['credentials']['access_key'], aws_config['credentials']['secret_key'],
+                     vm_config['region'])
+        for outcome in teardown_group_or_report(group_key, [vm_config], wait, state):
+            if outcome['error']:
+                # Left to the final teardown, which retries it and reports the outcome
+                print(f"[{vm_config['vm_name']}] Terminating after collection failed: {outcome['error']}")
             else:
-                print(f"No instance_id found for vm_config: {vm_config['vm_name']}. Skipping termination.")
-    
+                terminated.append(outcome)
+
+    results = collect_aws_fleet(aws_configs, parallel, terminate_collected if terminate else None)
+    failed = [result for result in results if result['error']]
+    for result in failed:
+        print(f"Collecting results failed for {result['vm_name']}: {result['error']}")
+    print(f"{len(results) - len(failed)}/{len(results)} AWS VMs collected successfully.")
+    return terminated
+
+
+def teardown(aws_configs, azure_configs, wait=False, state=None, engine='threads', terminated=None, warm_pool=None):
+    """
+    Teardown both AWS and Azure instances and return the per-instance outcomes.
+
+    Instances in ``terminated``, the outcomes of VMs already terminated after collecting their
+    results, are not terminated again but are included in the report. With a ``warm_pool``,
+    provisioned instances are stopped and pooled instead, as far as the pool limits allow.
+    """
+    print("Starting teardown for AWS configurations...")
+    terminated = list(terminated or [])
+    if warm_pool is not None:
+        for aws_config in aws_configs:
+            pooled = warm_pool.release(aws_config, aws_config['vm_configs'], state)
+            print(f"Warm pool: {len(pooled)} instances stopped and pooled.")
+            terminated.extend(pooled)
+    if terminated:
+        done = {outcome['instance_id'] for outcome in terminated}
+        aws_configs = [
+            dict(aws_config, vm_configs=[vm_config for vm_config in aws_config['vm_configs']
+                                         if vm_config.get('instance_id') not in done])
+            for aws_config in aws_configs
+        ]
+    if engine == 'async':
+        report = terminated + asyncio.run(teardown_aws_fleet_async(aws_configs, wait=wait, state=state))
+    else:
+        report = terminated + teardown_aws_fleet(aws_configs, wait=wait, state=state)
+    for outcome in report:
+        if outcome['error']:
+            print(f"Failed to terminate {outcome['instance_id']} ({outcome['vm_name']}) in {outcome['region']}: {outcome['error']}")
+        else:
+            print(f"Instance {outcome['instance_id']} ({outcome['vm_name']}) in {outcome['region']}: "
+                  f"{outcome['previous_state']} -> {outcome['current_state']}")
+    failed = [outcome for outcome in report if outcome['error']]
+    print(f"{len(report) - len(failed)}/{len(report)} AWS instances torn down.")
+    if warm_pool is not None:
+        print(f"Warm pool: {sum(warm_pool.stats().values())} instances pooled in {warm_pool.path}.")
+
+    ssh_manager = get_ssh_manager()
+    ssh_stats = ssh_manager.stats()
+    ssh_manager.close_all()
+    print(f"SSH connections: {ssh_stats['opened']} opened, {ssh_stats['reused']} reused.")
+
     print("Starting teardown for Azure configurations...")
     # Placeholder: Implement Azure teardown logic here
     # for azure_config in azure_configs:
     #     terminate_azure_instance(azure_config)
     
     print("Teardown completed for both AWS and Azure.")
+    return report
+
+
+def run_pipeline(aws_configs, azure_configs, output_dir, parallel=1, discovery_cache=None, state=None,
+                 backend_name='terraform', wait=False):
+    """
+    Run every VM through its own resolve, launch, provision, run and teardown chain and return the per-VM results.
+
+    Unlike precheck, deploy and teardown, no VM waits for the others at any point: each one is
+    terminated as soon as its own work is done. ``parallel`` bounds concurrent launches.
+    """
+    print("Starting pipelined deployment for AWS configurations...")
+    if discovery_cache is None:
+        discovery_cache = DiscoveryCache()
+    providers = [
+        ProviderPipeline(aws_config, get_backend(backend_name), output_dir, discovery_cache, state)
+        for aws_config in aws_configs
+    ]
+    # --parallel throttles launches only; SSH stages keep their own, wider default bound
+    scheduler = PipelineScheduler(limits={'launch': parallel}, wait_terminated=wait)
+    results = scheduler.run(providers)
+    print(f"AWS discovery cache: {discovery_cache.hits} hits, {discovery_cache.misses} misses.")
+
+    failed = [result for result in results if result['error']]
+    for result in failed:
+        print(f"Pipeline failed for {result['vm_name']} in stage '{result['failed_stage']}': {result['error']}")
+    left_running = [result for result in results if result['instance_id'] and not result['terminated']]
+    for result in left_running:
+        print(f"Instance {result['instance_id']} ({result['vm_name']}) could not be terminated and is still recorded "
+              f"in the state file.")
+    print(f"{len(results) - len(failed)}/{len(results)} AWS VMs completed their pipeline.")
 
+    ssh_manager = get_ssh_manager()
+    ssh_stats = ssh_manager.stats()
+    ssh_manager.close_all()
+    print(f"SSH connections: {ssh_stats['opened']} opened, {ssh_stats['reused']} reused.")
 
+    print("Starting pipelined deployment for Azure configurations...")
+    # Placeholder: Azure VMs will run through the same scheduler once Azure deployment exists
+    return results
 
-def main(config_path=None, output_dir=None):
+
+def main(config_path=None, output_dir=None, parallel=1, fleet=False, refresh_discovery=False, wait_terminated=False,
+         bake_images=False, reconcile=False, state_path=None, trace_path=None, engine='threads',
+         backend_name='terraform', pipeline=False, warm_pool_size=None, placement=None):
     """
     Main function to coordinate precheck, deployment, and teardown processes.
     This function can be called directly with parameters or used as an entry point with argparse.
@@ -74,10 +300,36 @@ def main(config_path=None, output_dir=None):
         parser = argparse.ArgumentParser(description="Run cloud deployment and teardown operations.")
         parser.add_argument("-c", "--config", type=str, required=True, help="Path to the configuration YAML file.")
         parser.add_argument("-o", "--output", type=str, default="./terraform", help="Directory for Terraform files (default: ./terraform).")
+        parser.add_argument("-p", "--parallel", type=int, default=1, help="Maximum number of VMs to deploy concurrently (default: 1).")
+        parser.add_argument("--fleet", action="store_true", help="Create all VMs of a provider entry with a single Terraform apply.")
+        parser.add_argument("--refresh-discovery", action="store_true", help="Ignore cached AWS resource discovery results and look everything up again.")
+        parser.add_argument("--wait-terminated", action="store_true", help="Wait until every instance is confirmed terminated during teardown.")
+        parser.add_argument("--bake", action="store_true", help="Boot VMs from images baked with their files and setup commands, baking any that are missing.")
+        parser.add_argument("--reconcile", action="store_true", help="Deploy only VMs missing from the state file, terminate orphans, and leave the fleet running.")
+        parser.add_argument("--state", type=str, default=None, help=f"Deployment state file (default: <output>/{STATE_FILE_NAME}).")
+        parser.add_argument("--engine", choices=ENGINES, default='threads', help="Run deployment and teardown on a thread pool or on an asyncio event loop (default: threads).")
+        parser.add_argument("--backend", choices=sorted(BACKENDS), default='terraform', help="Create AWS instances with Terraform or directly with batched EC2 run_instances calls (default: terraform).")
+        parser.add_argument("--pipeline", action="store_true", help="Advance every VM through its own launch, setup, run and teardown chain instead of fleet-wide phases.")
+        parser.add_argument("--warm-pool", type=int, nargs='?', const=DEFAULT_MAX_SIZE, default=None, metavar="SIZE", help=f"Stop provisioned instances into a local warm pool of up to SIZE instances (default: {DEFAULT_MAX_SIZE}) instead of terminating them, and restart matching ones before launching new instances. Requires --backend ec2.")
+        parser.add_argument("--placement", choices=PLACEMENT_MODES, default=None, help="Subnet placement for VMs that do not set one: the first candidate, or the availability zone with the fastest recorded launches (default: each VM's 'placement' field).")
+        parser.add_argument("--trace", type=str, default=None, help="Write phase timings and API call counts to <TRACE>.json and a Chrome trace to <TRACE>.trace.json.")
 
         args = parser.parse_args()
         config_path = args.config
         output_dir = args.output
+        parallel = args.parallel
+        fleet = args.fleet
+        refresh_discovery = args.refresh_discovery
+        wait_terminated = args.wait_terminated
+        bake_images = args.bake
+        reconcile = args.reconcile
+        state_path = args.state
+        trace_path = args.trace
+        engine = args.engine
+        backend_name = args.backend
+        pipeline = args.pipeline
+        warm_pool_size = args.warm_pool
+        placement = args.placement
 
     print("\n========== Runner Started ==========\n")
 
@@ -88,21 +340,96 @@ def main(config_path=None, output_dir=None):
     except Exception as e:
         print(f"Error dividing configurations: {e}")
         sys.exit(1)
+    if placement is not None:
+        for aws_config in aws_configs:
+            for vm_config in aws_config['vm_configs']:
+                vm_config.setdefault('placement', placement)
+
+    # Step 2: Perform precheck and resolve the resources every VM will use
+    discovery_cache = DiscoveryCache(refresh=refresh_discovery)
+    if pipeline:
+        # Each VM is checked, deployed and torn down on its own; fleet-wide phases do not apply
+        unsupported = [flag for flag, enabled in (('--fleet', fleet), ('--bake', bake_images),
+                                                 ('--reconcile', reconcile), ('--engine async', engine == 'async'),
+                                                 ('--warm-pool', warm_pool_size is not None))
+                       if enabled]
+        if unsupported:
+            print(f"--pipeline cannot be combined with {', '.join(unsupported)}. Exiting...")
+            sys.exit(1)
+        state = DeploymentState(state_path or os.path.join(output_dir, STATE_FILE_NAME))
+        with span('runner.pipeline'):
+            run_pipeline(aws_configs, azure_configs, output_dir, parallel=parallel, discovery_cache=discovery_cache,
+                         state=state, backend_name=backend_name, wait=wait_terminated)
+        report(trace_path)
+        return
 
-    # Step 2: Perform precheck
-    precheck_passed = precheck(aws_configs, azure_configs)
-    if not precheck_passed:
+    with span('runner.precheck'):
+        aws_plan = precheck(aws_configs, azure_configs, discovery_cache)
+    if aws_plan is None:
         print("Precheck failed. Exiting...")
         sys.exit(1)
 
-    # Step 3: Deploy the instances
-    deploy(aws_configs, azure_configs, output_dir)
+    # Optional: Restart stopped instances from the warm pool instead of launching new ones
+    warm_pool = None
+    if warm_pool_size is not None:
+        # Terraform would recreate or reclaim instances recorded in its state, so pooling needs the EC2 backend
+        if backend_name != 'ec2' or reconcile:
+            print("--warm-pool requires --backend ec2 and cannot be combined with --reconcile. Exiting...")
+            sys.exit(1)
+        warm_pool = WarmPool(max_size=warm_pool_size)
+
+    # Optional: Boot from baked images instead of provisioning every VM from scratch
+    if bake_images:
+        with span('runner.bake'):
+            bake(aws_configs, aws_plan)
+
+    # Step 3: Deploy the instances, recording every VM in the state file as it progresses
+    state = DeploymentState(state_path or os.path.join(output_dir, STATE_FILE_NAME))
+    with span('runner.deploy'):
+        deploy(aws_configs, azure_configs, output_dir, parallel=parallel, fleet=fleet, aws_plan=aws_plan,
+               discovery_cache=discovery_cache, state=state, reconcile=reconcile, engine=engine,
+               backend_name=backend_name, warm_pool=warm_pool)
 
     # Optional: Wait for some time or perform operations before teardown
     # time.sleep(60)  # Wait for 60 seconds
 
-    # Step 4: Teardown the instances
-    teardown(aws_configs, azure_configs)
+    # Step 4: Download results; each VM is terminated as soon as its own results are in
+    with span('runner.collect'):
+        terminated = collect(aws_configs, terminate=not reconcile and warm_pool is None, wait=wait_terminated,
+                             state=state)
+
+    # Step 5: Teardown the instances, unless the fleet is being kept for the next reconcile
+    if reconcile:
+        print(f"Leaving the fleet running; its state is recorded in {state.path}.")
+    else:
+        with span('runner.teardown'):
+            teardown(aws_configs, azure_configs, wait=wait_terminated, state=state, engine=engine,
+                     terminated=terminated, warm_pool=warm_pool)
+
+    report(trace_path)
+
+
+def report(trace_path=None):
+    """Print client reuse and the slowest phases, and write the trace files if requested."""
+    client_stats = get_client_pool().stats()
+    print(f"AWS clients: {client_stats['created']} created, {client_stats['reused']} reused.")
+    # Clients created without a region, such as the one listing enabled regions, use the session default
+    limiters = sorted(get_rate_limiters().stats().items(), key=lambda item: [str(part) for part in item[0]])
+    for (service, account, region), limiter_stats in limiters:
+        if limiter_stats['calls']:
+            print(f"{service} rate limiter {region or 'default region'}: {limiter_stats['calls']} requests, "
+                  f"{limiter_stats['throttled']} throttled, {limiter_stats['queue_seconds']:.2f}s queued "
+                  f"(max {limiter_stats['max_queue_seconds']:.2f}s), now {limiter_stats['rate']:.1f} req/s "
+                  f"and {limiter_stats['concurrency']} in flight.")
+
+    # Report where the time went
+    tracer = get_tracer()
+    print("\nSlowest phases:")
+    tracer.print_summary()
+    if trace_path:
+        tracer.write_json(f"{trace_path}.json")
+        tracer.write_chrome_trace(f"{trace_path}.trace.json")
+        print(f"Trace written to {trace_path}.json and {trace_path}.trace.json")
 
     print("\n========== Runner Completed ==========\n")
 
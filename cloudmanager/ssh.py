@@ -0,0 +1,229 @@
+import asyncio
+import atexit
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+SSH_PRIVATE_KEY_PATH = os.path.expanduser("~/.ssh/id_rsa")
+
+
+class SSHConnectionManager:
+    """
+    Reuse one authenticated OpenSSH connection per host for every ssh and scp call.
+
+    The first call to a host opens a background ControlMaster; later commands and transfers
+    ride on its socket instead of paying a new TCP and SSH handshake. All calls share the same
+    key and host-key options.
+    """
+
+    def __init__(self, key_path=SSH_PRIVATE_KEY_PATH, control_persist=600, connect_timeout=10):
+        """
+        :param key_path: The private key used to authenticate.
+        :param control_persist: Seconds an idle master connection stays open.
+        :param connect_timeout: Seconds to wait for a new connection to be established.
+        """
+        self.key_path = key_path
+        self.control_persist = control_persist
+        self.connect_timeout = connect_timeout
+        self.connections_opened = 0
+        self.connections_reused = 0
+        # Unix socket paths are limited to ~100 characters, so keep the directory short
+        self._control_dir = tempfile.mkdtemp(prefix='cm-ssh-')
+        self._lock = threading.Lock()
+        self._host_locks = {}
+        self._async_host_locks = {}
+        self._async_loop = None
+        self._open = set()
+        self._key_checked = False
+
+    def options(self, master=False):
+        """Return the ssh/scp options shared by every call."""
+        self._ensure_key_permissions()
+        return [
+            '-o', 'StrictHostKeyChecking=no',  # Disable host key checking prompt
+            '-o', 'UserKnownHostsFile=/dev/null',
+            '-o', 'BatchMode=yes',
+            '-o', f'ConnectTimeout={self.connect_timeout}',
+            '-i', self.key_path,  # Specify the private key to use
+            '-o', f"ControlPath={os.path.join(self._control_dir, '%C')}",
+            '-o', f"ControlMaster={'yes' if master else 'no'}",
+            '-o', f'ControlPersist={self.control_persist}',
+        ]
+
+    def open(self, host, user):
+        """Open the master connection to user@host if it is not open yet. Return True on success."""
+        target = f"{user}@{host}"
+        with self._lock:
+            host_lock = self._host_locks.setdefault(target, threading.Lock())
+
+        with host_lock:
+            if target in self._open:
+                if self._check(target):
+                    with self._lock:
+                        self.connections_reused += 1
+                    return True
+                self._open.discard(target)
+
+            # -f backgrounds ssh once authentication succeeds, leaving the master running
+            result = subprocess.run(
+                ['ssh'] + self.options(master=True) + ['-N', '-f', target],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL
+            )
+            if result.returncode != 0:
+                return False
+            self._open.add(target)
+            with self._lock:
+                self.connections_opened += 1
+            return True
+
+    def run(self, host, user, command, **kwargs):
+        """Run a command on user@host over the shared connection and return the CompletedProcess."""
+        self.open(host, user)
+        return subprocess.run(['ssh'] + self.options() + [f"{user}@{host}", command], **kwargs)
+
+    def popen(self, host, user, command, **kwargs):
+        """Start a command on user@host over the shared connection and return the Popen object."""
+        self.open(host, user)
+        return subprocess.Popen(['ssh'] + self.options() + [f"{user}@{host}", command], **kwargs)
+
+    def copy_to(self, host, user, files, remote_path='~', **kwargs):
+        """Copy local files to user@host with a single scp over the shared connection."""
+        if not files:
+            return None
+        self.open(host, user)
+        return subprocess.run(
+            ['scp'] + self.options() + list(files) + [f"{user}@{host}:{remote_path}"],
+            **kwargs
+        )
+
+    async def open_async(self, host, user):
+        """Coroutine counterpart of ``open`` for the asyncio engine. Return True on success."""
+        target = f"{user}@{host}"
+        # asyncio locks belong to one event loop, so start afresh when a new loop is running
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._async_loop = loop
+            self._async_host_locks = {}
+        host_lock = self._async_host_locks.setdefault(target, asyncio.Lock())
+
+        async with host_lock:
+            if target in self._open:
+                if await self._check_async(target):
+                    with self._lock:
+                        self.connections_reused += 1
+                    return True
+                self._open.discard(target)
+
+            process = await asyncio.create_subprocess_exec(
+                'ssh', *self.options(master=True), '-N', '-f', target,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.DEVNULL
+            )
+            if await process.wait() != 0:
+                return False
+            self._open.add(target)
+            with self._lock:
+                self.connections_opened += 1
+            return True
+
+    async def run_async(self, host, user, command, input=None, capture_output=False):
+        """
+        Coroutine counterpart of ``run``: run a command on user@host over the shared connection.
+
+        :param input: Optional bytes, or a binary file streamed in chunks, for the command's standard input.
+        :return: A tuple of the exit code and the captured standard output (None unless ``capture_output``).
+        """
+        await self.open_async(host, user)
+        process = await asyncio.create_subprocess_exec(
+            'ssh', *self.options(), f"{user}@{host}", command,
+            stdin=asyncio.subprocess.PIPE if input is not None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE if capture_output else None
+        )
+        if input is not None and not isinstance(input, bytes):
+            for chunk in iter(lambda: input.read(1024 * 1024), b''):
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+            process.stdin.close()
+            input = None
+        stdout, _ = await process.communicate(input)
+        return process.returncode, stdout
+
+    async def exec_async(self, host, user, command):
+        """Start a command on user@host with piped output and return the asyncio Process."""
+        await self.open_async(host, user)
+        return await asyncio.create_subprocess_exec(
+            'ssh', *self.options(), f"{user}@{host}", command,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+    def close(self, host, user):
+        """Shut down the master connection to user@host."""
+        target = f"{user}@{host}"
+        subprocess.run(
+            ['ssh'] + self.options() + ['-O', 'exit', target],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        self._open.discard(target)
+
+    def close_all(self):
+        """Shut down every master connection."""
+        for target in list(self._open):
+            user, host = target.split('@', 1)
+            self.close(host, user)
+
+    def shutdown(self):
+        """Shut down every master connection and remove the socket directory."""
+        self.close_all()
+        shutil.rmtree(self._control_dir, ignore_errors=True)
+
+    def stats(self):
+        """Return the number of master connections opened and reused so far."""
+        with self._lock:
+            return {'opened': self.connections_opened, 'reused': self.connections_reused}
+
+    def _check(self, target):
+        result = subprocess.run(
+            ['ssh'] + self.options() + ['-O', 'check', target],
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        return result.returncode == 0
+
+    async def _check_async(self, target):
+        process = await asyncio.create_subprocess_exec(
+            'ssh', *self.options(), '-O', 'check', target,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL
+        )
+        return await process.wait() == 0
+
+    def _ensure_key_permissions(self):
+        # Ensure the SSH private key has the correct permissions
+        if not self._key_checked and os.path.exists(self.key_path):
+            os.chmod(self.key_path, 0o600)
+            self._key_checked = True
+
+
+_default_manager = None
+_default_manager_lock = threading.Lock()
+
+
+def get_ssh_manager():
+    """Return the SSH connection manager shared across cloudmanager."""
+    global _default_manager
+    with _default_manager_lock:
+        if _default_manager is None:
+            _default_manager = SSHConnectionManager()
+            atexit.register(_default_manager.shutdown)
+        return _default_manager
@@ -0,0 +1,167 @@
+import os
+import threading
+import time
+import yaml
+from cloudmanager.clients import get_ec2_client
+from cloudmanager.discovery import account_key
+from cloudmanager.teardown import terminate_aws_instances
+from cloudmanager.utils import write_yaml_atomically
+
+STATE_FILE_NAME = 'cloudmanager-state.yaml'
+
+# Instance states that count as a live VM that can be kept on reconcile
+HEALTHY_STATES = ('pending', 'running')
+# Instance states of a VM that is gone; any other unhealthy instance (e.g. stopped) still exists and is terminated
+GONE_STATES = ('shutting-down', 'terminated')
+
+# describe_instances accepts at most 1000 filter values per call
+DESCRIBE_BATCH_SIZE = 1000
+
+
+class DeploymentState:
+    """
+    Durable record of every VM cloudmanager has launched.
+
+    Each VM entry is keyed by account and VM name and is rewritten atomically after every
+    status change, so a crash mid-run still leaves a file listing every instance it created.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.vms = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                self.vms = (yaml.safe_load(f) or {}).get('vms', {})
+
+    def for_account(self, access_key):
+        """Return a view of the state that records VMs under the account of the given access key."""
+        return AccountState(self, account_key(access_key))
+
+    def record(self, account, vm_config, status):
+        """Record a VM's latest status, instance ID and public IP."""
+        with self._lock:
+            self.vms[f"{account}/{vm_config['vm_name']}"] = {
+                'account': account,
+                'vm_name': vm_config['vm_name'],
+                'region': vm_config['region'],
+                'instance_type': vm_config['instance_type'],
+                'instance_id': vm_config.get('instance_id'),
+                'public_ip': vm_config.get('public_ip'),
+                'status': status,
+                'updated_at': time.time(),
+            }
+            self._save()
+
+    def remove(self, account, vm_name):
+        """Forget a VM, typically once it has been terminated."""
+        with self._lock:
+            if self.vms.pop(f"{account}/{vm_name}", None) is not None:
+                self._save()
+
+    def entries(self, account=None):
+        """Return the recorded VMs, optionally only those of one account."""
+        with self._lock:
+            return [dict(entry) for entry in self.vms.values() if account in (None, entry['account'])]
+
+    def _save(self):
+        write_yaml_atomically({'vms': self.vms}, self.path)
+
+
+class AccountState:
+    """A DeploymentState bound to one account, handed to the deploy and teardown paths."""
+
+    def __init__(self, state, account):
+        self.state = state
+        self.account = account
+
+    def record(self, vm_config, status):
+        self.state.record(self.account, vm_config, status)
+
+    def remove(self, vm_name):
+        self.state.remove(self.account, vm_name)
+
+
+def describe_live_instances(ec2_client, instance_ids):
+    """Return {instance_id: instance} for the given IDs with batched calls; unknown IDs are left out."""
+    live = {}
+    for start in range(0, len(instance_ids), DESCRIBE_BATCH_SIZE):
+        batch = instance_ids[start:start + DESCRIBE_BATCH_SIZE]
+        # Filtering by instance-id instead of passing InstanceIds tolerates IDs that no longer exist
+        paginator = ec2_client.get_paginator('describe_instances')
+        for page in paginator.paginate(Filters=[{'Name': 'instance-id', 'Values': batch}]):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    live[instance['InstanceId']] = instance
+    return live
+
+def reconcile_aws_config(aws_config, state, other_vm_names=()):
+    """
+    Compare an AWS provider entry with the recorded state and the live instances behind it.
+
+    VMs whose recorded instance is still pending or running with the same region and instance
+    type are kept and get their instance_id and public_ip filled in. Recorded instances that are
+    no longer wanted, no longer match their VM, or are stopped, are terminated in batches, so
+    they are never leaked. Every other VM is left to be deployed.
+
+    The state is kept per account, so VMs wanted by other provider entries with the same
+    credentials are left alone; they are reconciled with their own entry.
+
+    :param aws_config: The AWS provider entry; every VM must already have a ``vm_name``.
+    :param state: The DeploymentState to reconcile against.
+    :param other_vm_names: The VM names of the other provider entries of the same account.
+    :return: A dictionary with the vm_configs to 'create', the vm_configs 'kept', the kept vm_configs that
+             never finished provisioning and must be 'resumed', and the 'orphans' terminated.
+    """
+    access_key = aws_config['credentials']['access_key']
+    secret_key = aws_config['credentials']['secret_key']
+    account_state = state.for_account(access_key)
+    desired = {vm_config['vm_name']: vm_config for vm_config in aws_config['vm_configs']}
+    other_vm_names = set(other_vm_names) - set(desired)
+    recorded = [
+        entry for entry in state.entries(account_state.account)
+        if entry.get('instance_id') and entry['vm_name'] not in other_vm_names
+    ]
+
+    live = {}
+    for region in {entry['region'] for entry in recorded}:
+        ec2_client = get_ec2_client(access_key, secret_key, region)
+        live.update(describe_live_instances(
+            ec2_client, [entry['instance_id'] for entry in recorded if entry['region'] == region]))
+
+    kept = []
+    resume = []
+    orphans = []
+    for entry in recorded:
+        instance = live.get(entry['instance_id'])
+        vm_config = desired.get(entry['vm_name'])
+        if instance is None or instance['State']['Name'] in GONE_STATES:
+            # The instance is gone or on its way out; forget it so the VM is created again
+            account_state.remove(entry['vm_name'])
+        elif (instance['State']['Name'] in HEALTHY_STATES
+                and vm_config is not None and 'instance_id' not in vm_config
+                and vm_config['region'] == entry['region']
+                and vm_config['instance_type'] == instance['InstanceType']):
+            vm_config['instance_id'] = entry['instance_id']
+            vm_config['public_ip'] = instance.get('PublicIpAddress')
+            account_state.record(vm_config, entry['status'])
+            kept.append(vm_config)
+            if entry['status'] != 'provisioned':
+                resume.append(vm_config)
+        else:
+            orphans.append(entry)
+
+    for region in {entry['region'] for entry in orphans}:
+        ec2_client = get_ec2_client(access_key, secret_key, region)
+        region_orphans = [entry for entry in orphans if entry['region'] == region]
+        outcomes = terminate_aws_instances(ec2_client, [entry['instance_id'] for entry in region_orphans])
+        for entry in region_orphans:
+            error = outcomes[entry['instance_id']]['error']
+            if error:
+                print(f"Failed to terminate orphaned instance {entry['instance_id']} ({entry['vm_name']}) in {region}: {error}")
+            else:
+                account_state.remove(entry['vm_name'])
+                print(f"Terminated orphaned instance {entry['instance_id']} ({entry['vm_name']}) in {region}.")
+
+    create = [vm_config for vm_config in aws_config['vm_configs'] if not vm_config.get('instance_id')]
+    return {'create': create, 'kept': kept, 'resume': resume, 'orphans': orphans}
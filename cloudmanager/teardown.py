@@ -1,32 +1,172 @@
-import boto3
-from botocore.exceptions import ClientError
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError, WaiterError
+from cloudmanager.clients import get_ec2_client
+from cloudmanager.tracing import span
 
-def terminate_aws_instance(region, instance_id):
+# terminate_instances and the instance_terminated waiter accept at most 1000 IDs per call
+TERMINATE_BATCH_SIZE = 1000
+
+
+def terminate_aws_instances(ec2_client, instance_ids, wait=False, delay=5, max_attempts=60):
+    """
+    Terminate instances in one region with one terminate_instances call per batch of IDs.
+
+    :param ec2_client: An EC2 client for the region the instances live in.
+    :param instance_ids: The IDs of the instances to terminate.
+    :param wait: If True, wait with a single batched waiter until every instance is terminated.
+    :return: A dictionary mapping each instance ID to its previous state, current state and error.
+    """
+    outcomes = {
+        instance_id: {'previous_state': None, 'current_state': None, 'error': None}
+        for instance_id in instance_ids
+    }
+
+    for start in range(0, len(instance_ids), TERMINATE_BATCH_SIZE):
+        batch = instance_ids[start:start + TERMINATE_BATCH_SIZE]
+        try:
+            terminating = ec2_client.terminate_instances(InstanceIds=batch)['TerminatingInstances']
+        except ClientError:
+            # One unknown or already-deleted ID fails the whole call, so retry the batch one by one
+            terminating = []
+            for instance_id in batch:
+                try:
+                    terminating.extend(ec2_client.terminate_instances(InstanceIds=[instance_id])['TerminatingInstances'])
+                except ClientError as e:
+                    outcomes[instance_id]['error'] = str(e)
+        for instance in terminating:
+            outcome = outcomes[instance['InstanceId']]
+            outcome['previous_state'] = instance['PreviousState']['Name']
+            outcome['current_state'] = instance['CurrentState']['Name']
+
+        batch = [instance_id for instance_id in batch if not outcomes[instance_id]['error']]
+        if wait and batch:
+            try:
+                ec2_client.get_waiter('instance_terminated').wait(
+                    InstanceIds=batch,
+                    WaiterConfig={'Delay': delay, 'MaxAttempts': max_attempts}
+                )
+                for instance_id in batch:
+                    outcomes[instance_id]['current_state'] = 'terminated'
+            except WaiterError as e:
+                for instance_id in batch:
+                    if outcomes[instance_id]['current_state'] != 'terminated':
+                        outcomes[instance_id]['error'] = f"Termination was not confirmed: {e}"
+
+    return outcomes
+
+def terminate_aws_instance(access_key, secret_key, region, instance_id):
     """Terminate a specific AWS EC2 instance by instance ID."""
-    ec2_client = boto3.client('ec2', region_name=region)
-    
-    try:
-        # Terminate the instance
-        response = ec2_client.terminate_instances(InstanceIds=[instance_id])
-        print(f"Initiated termination for instance: {instance_id}")
-        
-        # Check the status of the instance termination
-        for instance in response['TerminatingInstances']:
-            current_state = instance['CurrentState']['Name']
-            print(f"Instance {instance['InstanceId']} is now in state: {current_state}")
-            
-        return True
-
-    except ClientError as e:
-        print(f"Error terminating instance {instance_id}: {e}")
+    ec2_client = get_ec2_client(access_key, secret_key, region)
+    outcome = terminate_aws_instances(ec2_client, [instance_id])[instance_id]
+    if outcome['error']:
+        print(f"Error terminating instance {instance_id}: {outcome['error']}")
         return False
 
+    print(f"Instance {instance_id} is changing from {outcome['previous_state']} to {outcome['current_state']}.")
+    return True
+
+def teardown_aws_fleet(aws_configs, wait=False, parallel_regions=16, state=None):
+    """
+    Terminate every deployed VM of the AWS provider entries, region by region.
+
+    Instances are grouped by credentials and region, each group is terminated in batches,
+    and groups are processed concurrently.
+
+    :param aws_configs: The AWS provider entries, with ``instance_id`` set on deployed VMs.
+    :param wait: If True, confirm termination with one batched waiter per region.
+    :param parallel_regions: The maximum number of regions torn down at once.
+    :param state: An optional DeploymentState from which terminated VMs are removed.
+    :return: A list of per-instance outcome dictionaries.
+    """
+    groups = group_deployed_vms(aws_configs)
+    report = []
+
+    def teardown_group(group_key):
+        return teardown_group_or_report(group_key, groups[group_key], wait, state)
+
+    if groups:
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel_regions, len(groups)))) as executor:
+            for group_report in executor.map(teardown_group, list(groups)):
+                report.extend(group_report)
+
+    return report
+
+async def teardown_aws_fleet_async(aws_configs, wait=False, parallel_regions=16, state=None):
+    """
+    Coroutine counterpart of ``teardown_aws_fleet`` for the asyncio engine.
+
+    Each (credentials, region) group is terminated in a worker thread, since boto3 is blocking,
+    with at most ``parallel_regions`` groups in flight.
+
+    :return: A list of per-instance outcome dictionaries.
+    """
+    groups = group_deployed_vms(aws_configs)
+    semaphore = asyncio.Semaphore(max(1, parallel_regions))
+
+    async def teardown_group(group_key):
+        async with semaphore:
+            return await asyncio.to_thread(teardown_group_or_report, group_key, groups[group_key], wait, state)
+
+    report = []
+    for group_report in await asyncio.gather(*(teardown_group(group_key) for group_key in groups)):
+        report.extend(group_report)
+    return report
+
+def group_deployed_vms(aws_configs):
+    """Group every deployed VM of the AWS provider entries by (access key, secret key, region)."""
+    groups = {}
+    for aws_config in aws_configs:
+        access_key = aws_config['credentials']['access_key']
+        secret_key = aws_config['credentials']['secret_key']
+        for vm_config in aws_config['vm_configs']:
+            instance_id = vm_config.get('instance_id')
+            if not instance_id:
+                print(f"No instance_id found for vm_config: {vm_config.get('vm_name')}. Skipping termination.")
+                continue
+            groups.setdefault((access_key, secret_key, vm_config['region']), []).append(vm_config)
+    return groups
+
+def teardown_group_instances(group_key, vm_configs, wait=False, state=None):
+    """Terminate one group from ``group_deployed_vms`` and return its per-instance outcomes."""
+    access_key, secret_key, region = group_key
+    ec2_client = get_ec2_client(access_key, secret_key, region)
+    print(f"Terminating {len(vm_configs)} instances in {region}...")
+    with span('teardown.region', region=region, instances=len(vm_configs)):
+        outcomes = terminate_aws_instances(ec2_client, [vm_config['instance_id'] for vm_config in vm_configs], wait=wait)
+    if state is not None:
+        account_state = state.for_account(access_key)
+        for vm_config in vm_configs:
+            if not outcomes[vm_config['instance_id']]['error']:
+                account_state.remove(vm_config['vm_name'])
+    return [
+        dict(outcomes[vm_config['instance_id']], vm_name=vm_config.get('vm_name'), region=region,
+             instance_id=vm_config['instance_id'])
+        for vm_config in vm_configs
+    ]
+
+def teardown_group_or_report(group_key, vm_configs, wait=False, state=None):
+    """
+    Like ``teardown_group_instances``, but an unexpected error, such as an unreachable endpoint,
+    becomes an error outcome for each instance of the group instead of aborting the whole teardown.
+    """
+    try:
+        return teardown_group_instances(group_key, vm_configs, wait, state)
+    except Exception as e:
+        region = group_key[2]
+        print(f"Error terminating instances in {region}: {e}")
+        return [
+            {'previous_state': None, 'current_state': None, 'error': f"Teardown of {region} failed: {e}",
+             'vm_name': vm_config.get('vm_name'), 'region': region, 'instance_id': vm_config['instance_id']}
+            for vm_config in vm_configs
+        ]
+
 # Example usage
 if __name__ == "__main__":
     region = "us-east-1"  # Replace with your desired region
     instance_id = "i-0123456789abcdef0"  # Replace with your instance ID
 
-    success = terminate_aws_instance(region, instance_id)
+    success = terminate_aws_instance(None, None, region, instance_id)
     if success:
         print(f"Instance {instance_id} successfully terminated.")
     else:
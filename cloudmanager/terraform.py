@@ -0,0 +1,190 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from cloudmanager.tracing import span
+
+# Shared provider plugin cache so every working directory links the same provider binaries
+PLUGIN_CACHE_DIR = os.environ.get(
+    'TF_PLUGIN_CACHE_DIR',
+    os.path.expanduser('~/.cloudmanager/terraform-plugin-cache')
+)
+LOCK_FILE = '.terraform.lock.hcl'
+INIT_STAMP_FILE = '.cloudmanager-init'
+PLAN_FILE = 'tfplan'
+
+# The plugin cache is not safe for concurrent writers, so inits are serialized: across threads
+# by _init_lock, and across the coroutines of an event loop by that loop's asyncio lock
+_init_lock = threading.Lock()
+_async_init_locks = weakref.WeakKeyDictionary()
+
+
+def terraform_env(plugin_cache_dir=PLUGIN_CACHE_DIR):
+    """Return the environment used for Terraform commands, with the shared plugin cache enabled."""
+    os.makedirs(plugin_cache_dir, exist_ok=True)
+    env = os.environ.copy()
+    env['TF_PLUGIN_CACHE_DIR'] = plugin_cache_dir
+    env['TF_IN_AUTOMATION'] = '1'
+    return env
+
+def init_fingerprint(output_dir):
+    """Hash the lockfile and the provider blocks that decide whether 'terraform init' must run again."""
+    digest = hashlib.sha256()
+    lock_path = os.path.join(output_dir, LOCK_FILE)
+    if os.path.exists(lock_path):
+        with open(lock_path, 'rb') as f:
+            digest.update(f.read())
+
+    providers = set()
+    for name in sorted(os.listdir(output_dir)):
+        if name.endswith('.tf'):
+            with open(os.path.join(output_dir, name), 'r') as f:
+                content = f.read()
+            providers.update(re.findall(r'^\s*provider\s+"([^"]+)"', content, re.MULTILINE))
+            # Version constraints live in the terraform block, so any change there also forces an init
+            providers.update(re.findall(r'^\s*terraform\s*\{.*?^\}', content, re.MULTILINE | re.DOTALL))
+    for provider in sorted(providers):
+        digest.update(provider.encode())
+
+    return digest.hexdigest()
+
+def needs_init(output_dir):
+    """Return True if the working directory has not been initialized for its current providers."""
+    stamp_path = os.path.join(output_dir, INIT_STAMP_FILE)
+    if not os.path.isdir(os.path.join(output_dir, '.terraform')) or not os.path.exists(stamp_path):
+        return True
+    with open(stamp_path, 'r') as f:
+        return f.read().strip() != init_fingerprint(output_dir)
+
+def terraform_args(step, parallelism=None):
+    """Return the arguments after 'terraform' for one of the steps 'init', 'plan', 'apply' and 'output'."""
+    parallelism_args = [f'-parallelism={parallelism}'] if parallelism else []
+    return {
+        'init': ['init', '-input=false'],
+        'plan': ['plan', '-input=false', '-detailed-exitcode', f'-out={PLAN_FILE}'] + parallelism_args,
+        'apply': ['apply', '-input=false'] + parallelism_args + [PLAN_FILE],
+        'output': ['output', '-json'],
+    }[step]
+
+def check_step(step, returncode, args):
+    """Raise CalledProcessError if a step failed and return its exit code."""
+    # -detailed-exitcode: 0 means no changes, 2 means changes are pending, anything else is an error
+    if returncode not in ((0, 2) if step == 'plan' else (0,)):
+        raise subprocess.CalledProcessError(returncode, ['terraform'] + args)
+    return returncode
+
+@contextmanager
+def timed_step(timings, step, output_dir):
+    """Trace a step and record its duration in ``timings``."""
+    start = time.monotonic()
+    with span(f'terraform.{step}', dir=output_dir):
+        yield
+    timings[step] = time.monotonic() - start
+
+def mark_initialized(output_dir):
+    """Remember the providers the working directory was initialized for, so later runs can skip 'terraform init'."""
+    with open(os.path.join(output_dir, INIT_STAMP_FILE), 'w') as f:
+        f.write(init_fingerprint(output_dir))
+
+def print_timings(output_dir, timings):
+    print(f"Terraform timings for {output_dir}: " + ", ".join(
+        f"{step} {timings[step]:.1f}s" if step in timings else f"{step} skipped"
+        for step in ('init', 'plan', 'apply')
+    ))
+
+def parse_outputs(returncode, stdout):
+    """Turn the result of 'terraform output -json' into a dictionary of values; empty if it failed."""
+    if returncode != 0 or not stdout.strip():
+        return {}
+    outputs = json.loads(stdout)
+    return {name: output.get('value') for name, output in outputs.items()}
+
+def run_terraform(output_dir, parallelism=None, plugin_cache_dir=PLUGIN_CACHE_DIR):
+    """
+    Initialize, plan and apply a Terraform configuration, skipping work that is already done.
+
+    'terraform init' is skipped when the lockfile and provider blocks are unchanged since the
+    last successful init. The plan is saved to a file and only applied when it contains changes.
+
+    :param output_dir: The Terraform working directory.
+    :param parallelism: Optional value for Terraform's -parallelism flag.
+    :param plugin_cache_dir: The shared provider plugin cache directory.
+    :return: A dictionary with the duration in seconds of each step that ran and whether changes were applied.
+    """
+    env = terraform_env(plugin_cache_dir)
+    timings = {}
+
+    def run(step):
+        args = terraform_args(step, parallelism)
+        with timed_step(timings, step, output_dir):
+            returncode = subprocess.run(['terraform'] + args, cwd=output_dir, env=env).returncode
+        return check_step(step, returncode, args)
+
+    with _init_lock:
+        if needs_init(output_dir):
+            run('init')
+            mark_initialized(output_dir)
+    timings['changed'] = run('plan') == 2
+    if timings['changed']:
+        run('apply')
+    print_timings(output_dir, timings)
+    return timings
+
+def read_terraform_outputs(output_dir):
+    """Return the outputs of a Terraform working directory as a dictionary of values."""
+    result = subprocess.run(['terraform'] + terraform_args('output'), cwd=output_dir, capture_output=True, text=True)
+    return parse_outputs(result.returncode, result.stdout)
+
+async def _terraform_async(output_dir, args, env=None, capture_output=False):
+    process = await asyncio.create_subprocess_exec(
+        'terraform', *args,
+        cwd=output_dir,
+        env=env,
+        stdout=asyncio.subprocess.PIPE if capture_output else None
+    )
+    stdout, _ = await process.communicate()
+    return process.returncode, stdout
+
+def _async_init_lock():
+    # An asyncio.Lock belongs to one event loop, and every asyncio.run starts a new one
+    loop = asyncio.get_running_loop()
+    with _init_lock:
+        return _async_init_locks.setdefault(loop, asyncio.Lock())
+
+async def run_terraform_async(output_dir, parallelism=None, plugin_cache_dir=PLUGIN_CACHE_DIR):
+    """
+    Coroutine counterpart of ``run_terraform`` for the asyncio engine.
+
+    Terraform runs as an asyncio subprocess, so waiting on it does not hold a thread. Inits are
+    serialized by an asyncio lock per event loop, so waiting VMs hold no thread either.
+
+    :return: A dictionary with the duration in seconds of each step that ran and whether changes were applied.
+    """
+    env = terraform_env(plugin_cache_dir)
+    timings = {}
+
+    async def run(step):
+        args = terraform_args(step, parallelism)
+        with timed_step(timings, step, output_dir):
+            returncode, _ = await _terraform_async(output_dir, args, env)
+        return check_step(step, returncode, args)
+
+    async with _async_init_lock():
+        if needs_init(output_dir):
+            await run('init')
+            mark_initialized(output_dir)
+    timings['changed'] = await run('plan') == 2
+    if timings['changed']:
+        await run('apply')
+    print_timings(output_dir, timings)
+    return timings
+
+async def read_terraform_outputs_async(output_dir):
+    """Coroutine counterpart of ``read_terraform_outputs``."""
+    return parse_outputs(*await _terraform_async(output_dir, terraform_args('output'), capture_output=True))
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _current_lane():
+    """Identify the asyncio task or, outside of one, the thread a span runs on."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    if task is not None:
+        return ('task', id(task)), task.get_name()
+    thread = threading.current_thread()
+    return thread.ident, thread.name
+
+
+class Tracer:
+    """
+    Record timed spans and counters from any thread.
+
+    Spans carry free-form attributes (VM name, region, ...) so durations can be broken down
+    per VM and per phase. Results export as plain JSON or as a Chrome trace-event file that
+    chrome://tracing and Perfetto can open.
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._thread_ids = {}
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Time the enclosed block and record it under the given phase name."""
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = repr(e)
+            raise
+        finally:
+            end = time.perf_counter()
+            key, lane = _current_lane()
+            with self._lock:
+                tid = self._thread_ids.setdefault(key, (len(self._thread_ids) + 1, lane))[0]
+                self.spans.append({
+                    'name': name,
+                    'start': start - self._origin,
+                    'duration': end - start,
+                    'tid': tid,
+                    'attrs': dict(attrs, error=error) if error else attrs,
+                })
+
+    def count(self, name, amount=1):
+        """Increment a named counter, such as the number of calls to an API operation."""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def phase_totals(self):
+        """Aggregate spans by phase name into count, total and maximum durations, slowest first."""
+        totals = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            phase = totals.setdefault(span['name'], {'name': span['name'], 'count': 0, 'total': 0.0, 'max': 0.0})
+            phase['count'] += 1
+            phase['total'] += span['duration']
+            phase['max'] = max(phase['max'], span['duration'])
+        return sorted(totals.values(), key=lambda phase: phase['total'], reverse=True)
+
+    def write_json(self, path):
+        """Write every span, the per-phase totals and the counters to a JSON file."""
+        with self._lock:
+            data = {'spans': list(self.spans), 'counters': dict(self.counters)}
+        data['phases'] = self.phase_totals()
+        with open(path, 'w') as f:
+            json.dump(data, f, indent=2, default=str)
+
+    def write_chrome_trace(self, path):
+        """Write the spans as a Chrome trace-event file."""
+        with self._lock:
+            spans = list(self.spans)
+            threads = list(self._thread_ids.values())
+            counters = dict(self.counters)
+        events = [
+            {'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': thread_name}}
+            for tid, thread_name in threads
+        ]
+        for span in spans:
+            events.append({
+                'name': span['name'],
+                'cat': span['name'].split('.')[0],
+                'ph': 'X',
+                'ts': span['start'] * 1e6,
+                'dur': span['duration'] * 1e6,
+                'pid': 1,
+                'tid': span['tid'],
+                'args': {key: str(value) for key, value in span['attrs'].items()},
+            })
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'otherData': {'counters': counters}}, f)
+
+    def print_summary(self, top=10):
+        """Print the slowest phases and the busiest counters."""
+        phases = self.phase_totals()[:top]
+        if phases:
+            print(f"{'Phase':<28} {'Count':>6} {'Total (s)':>10} {'Max (s)':>9}")
+            for phase in phases:
+                print(f"{phase['name']:<28} {phase['count']:>6} {phase['total']:>10.2f} {phase['max']:>9.2f}")
+        with self._lock:
+            counters = sorted(self.counters.items(), key=lambda item: item[1], reverse=True)[:top]
+        if counters:
+            print(f"{'Counter':<40} {'Count':>6}")
+            for name, value in counters:
+                print(f"{name:<40} {value:>6}")
+
+
+_tracer = Tracer()
+
+
+def get_tracer():
+    """Return the tracer shared across cloudmanager."""
+    return _tracer
+
+def span(name, **attrs):
+    """Time a block with the shared tracer: ``with span('deploy.upload', vm=vm_name): ...``."""
+    return _tracer.span(name, **attrs)
+
+def count(name, amount=1):
+    """Increment a counter on the shared tracer."""
+    _tracer.count(name, amount)
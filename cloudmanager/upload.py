@@ -0,0 +1,176 @@
+import asyncio
+import hashlib
+import os
+import tarfile
+import tempfile
+import threading
+from cloudmanager.ssh import get_ssh_manager
+
+UPLOAD_CACHE_DIR = os.path.expanduser('~/.cloudmanager/upload-cache')
+
+# Hashes and bundles are computed once per process and shared by every target VM
+_lock = threading.Lock()
+_hash_cache = {}
+_bundle_locks = {}
+
+
+def file_sha256(path):
+    """Return the SHA-256 of a local file, reusing the result while its size and mtime are unchanged."""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _lock:
+        if key in _hash_cache:
+            return _hash_cache[key]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    with _lock:
+        _hash_cache[key] = digest.hexdigest()
+    return _hash_cache[key]
+
+def collect_upload_entries(files, custom_code_path=None):
+    """
+    List the (local path, remote path relative to the home directory) pairs to upload.
+
+    Files land in the home directory under their base name, as a plain scp to '~' would do.
+    Directories, including custom_code_path, are uploaded recursively under their base name.
+    """
+    paths = list(files)
+    if custom_code_path:
+        paths.append(custom_code_path)
+
+    entries = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        base = os.path.basename(os.path.normpath(path))
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                for name in sorted(names):
+                    local_path = os.path.join(root, name)
+                    entries.append((local_path, os.path.join(base, os.path.relpath(local_path, path))))
+        else:
+            entries.append((path, base))
+    return entries
+
+def build_bundle(entries, cache_dir=UPLOAD_CACHE_DIR):
+    """
+    Pack the given (local path, remote path, sha256) entries into a compressed tar archive.
+
+    Bundles are named after the hash of their contents, so the same set of files is
+    compressed once no matter how many VMs receive it.
+    """
+    bundle_key = hashlib.sha256(
+        '\n'.join(f"{sha} {arcname}" for _, arcname, sha in sorted(entries, key=lambda e: e[1])).encode()
+    ).hexdigest()
+    bundle_path = os.path.join(cache_dir, f"{bundle_key}.tar.gz")
+
+    with _lock:
+        bundle_lock = _bundle_locks.setdefault(bundle_key, threading.Lock())
+    with bundle_lock:
+        if not os.path.exists(bundle_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f, tarfile.open(fileobj=f, mode='w:gz') as tar:
+                for local_path, arcname, _ in entries:
+                    tar.add(local_path, arcname=arcname)
+            os.replace(tmp_path, bundle_path)
+    return bundle_path
+
+UNPACK_COMMAND = 'tar -xzf - -C ~'
+# The file names are read from stdin, so any number of them fits; xargs splits them into
+# command lines below ARG_MAX. Missing files make sha256sum fail, which is expected.
+REMOTE_SHA256_COMMAND = 'cd ~ && xargs -0 sha256sum -- 2>/dev/null; true'
+
+def hash_upload_entries(files, custom_code_path=None):
+    """Return the (local path, remote path, sha256) entries to upload."""
+    return [
+        (local_path, arcname, file_sha256(local_path))
+        for local_path, arcname in collect_upload_entries(files, custom_code_path)
+    ]
+
+def remote_sha256_input(arcnames):
+    """Return the NUL-separated file names that ``REMOTE_SHA256_COMMAND`` reads from stdin."""
+    return b''.join(arcname.encode() + b'\0' for arcname in arcnames)
+
+def parse_sha256sum(output):
+    """Map each file listed in sha256sum output to its hash."""
+    hashes = {}
+    for line in output.splitlines():
+        sha, _, arcname = line.partition('  ')
+        if arcname:
+            hashes[arcname] = sha
+    return hashes
+
+def pending_entries(entries, remote):
+    """Return the entries whose content does not already match on the remote side."""
+    return [entry for entry in entries if remote.get(entry[1]) != entry[2]]
+
+def upload_report(host, user, entries, pending):
+    """Print what was skipped and return the upload counts."""
+    skipped = len(entries) - len(pending)
+    if skipped:
+        print(f"Skipped {skipped} files already present on {user}@{host}")
+    return {'uploaded': len(pending), 'skipped': skipped}
+
+def remote_sha256s(host, user, arcnames, ssh_manager):
+    """Return the SHA-256 of each given file that already exists in the remote home directory."""
+    if not arcnames:
+        return {}
+    result = ssh_manager.run(host, user, REMOTE_SHA256_COMMAND, input=remote_sha256_input(arcnames),
+                             capture_output=True)
+    return parse_sha256sum(result.stdout.decode())
+
+async def remote_sha256s_async(host, user, arcnames, ssh_manager):
+    """Coroutine counterpart of ``remote_sha256s``."""
+    if not arcnames:
+        return {}
+    _, stdout = await ssh_manager.run_async(host, user, REMOTE_SHA256_COMMAND, input=remote_sha256_input(arcnames),
+                                            capture_output=True)
+    return parse_sha256sum(stdout.decode())
+
+def upload_files(host, user, files, custom_code_path=None, ssh_manager=None):
+    """
+    Upload files and custom_code_path to a host as one compressed stream, skipping unchanged files.
+
+    Files whose content already matches on the remote side are left out. The rest are packed
+    into a cached tar.gz bundle, streamed over the host's shared SSH connection and unpacked
+    into the home directory.
+
+    :return: A dictionary with the number of files uploaded and skipped.
+    """
+    ssh_manager = ssh_manager or get_ssh_manager()
+    entries = hash_upload_entries(files, custom_code_path)
+    remote = remote_sha256s(host, user, [arcname for _, arcname, _ in entries], ssh_manager)
+    pending = pending_entries(entries, remote)
+
+    if pending:
+        bundle_path = build_bundle(pending)
+        print(f"Uploading {len(pending)} files to {user}@{host}:~ ({os.path.getsize(bundle_path)} bytes compressed)")
+        with open(bundle_path, 'rb') as bundle:
+            ssh_manager.run(host, user, UNPACK_COMMAND, stdin=bundle, check=True)
+    return upload_report(host, user, entries, pending)
+
+async def upload_files_async(host, user, files, custom_code_path=None, ssh_manager=None):
+    """
+    Coroutine counterpart of ``upload_files``.
+
+    Hashing and bundling run in a worker thread; the remote checksum and the upload stream run
+    as asyncio subprocesses over the host's shared SSH connection.
+
+    :return: A dictionary with the number of files uploaded and skipped.
+    """
+    ssh_manager = ssh_manager or get_ssh_manager()
+    entries = await asyncio.to_thread(hash_upload_entries, files, custom_code_path)
+    remote = await remote_sha256s_async(host, user, [arcname for _, arcname, _ in entries], ssh_manager)
+    pending = pending_entries(entries, remote)
+
+    if pending:
+        bundle_path = await asyncio.to_thread(build_bundle, pending)
+        print(f"Uploading {len(pending)} files to {user}@{host}:~ ({os.path.getsize(bundle_path)} bytes compressed)")
+        with open(bundle_path, 'rb') as bundle:
+            returncode, _ = await ssh_manager.run_async(host, user, UNPACK_COMMAND, input=bundle)
+        if returncode != 0:
+            raise RuntimeError(f"Unpacking the upload on {user}@{host} exited with code {returncode}")
+    return upload_report(host, user, entries, pending)
@@ -1,13 +1,151 @@
+import copy
+import itertools
+import os
+import re
+import tempfile
 import yaml
 
+# Field types accepted in a vm_configs entry. Fields that deploy writes back (instance_id,
+# public_ip, resolved resource IDs, ...) are listed too, so dumped configs validate again.
+VM_CONFIG_FIELD_TYPES = {
+    'region': str,
+    'instance_type': str,
+    'vm_name': str,
+    'custom_code_path': str,
+    'files': list,
+    'initial_commands': list,
+    'run_commands': list,
+    'collect': dict,
+    'image': dict,
+    'vpc_id': str,
+    'subnet_id': str,
+    'availability_zones': list,
+    'placement': str,
+    'security_group_ids': list,
+    'key_pair_name': str,
+    'instance_id': str,
+    'public_ip': str,
+    'baked_ami_id': str,
+    'warm_pool_instance_id': str,
+}
+VM_CONFIG_REQUIRED_FIELDS = ('region', 'instance_type')
+# How a subnet is chosen when a VM does not set subnet_id: 'default' takes the first candidate,
+# 'latency' the availability zone where past launches of the same type became SSH-ready fastest
+PLACEMENT_MODES = ('default', 'latency')
+# Fields a matrix may vary; each axis is a list of scalar values
+MATRIX_AXIS_TYPES = (str, int, float)
+
+
+def _compile_vm_config_validator():
+    """Build the vm_configs entry validator once, as a list of (field, check, message) rules."""
+    rules = []
+    for field, field_type in VM_CONFIG_FIELD_TYPES.items():
+        rules.append((field, lambda value, field_type=field_type: isinstance(value, field_type),
+                      f"must be a {field_type.__name__}"))
+    rules.append(('count', lambda value: isinstance(value, int) and not isinstance(value, bool) and value >= 1,
+                  "must be a positive integer"))
+    rules.append(('matrix', lambda value: isinstance(value, dict) and bool(value) and all(
+        field in VM_CONFIG_FIELD_TYPES and isinstance(values, list) and values
+        and all(isinstance(item, MATRIX_AXIS_TYPES) for item in values)
+        for field, values in value.items()
+    ), "must map VM config fields to non-empty lists of values"))
+    rules.append(('collect', lambda value: isinstance(value.get('paths'), list) and bool(value['paths'])
+                  and all(isinstance(path, str) for path in value['paths'])
+                  and isinstance(value.get('local_dir', ''), str),
+                  "must have a non-empty 'paths' list of remote globs and an optional 'local_dir'"))
+    rules.append(('availability_zones', lambda value: bool(value) and all(isinstance(zone, str) for zone in value),
+                  "must be a non-empty list of availability zone names"))
+    rules.append(('placement', lambda value: value in PLACEMENT_MODES,
+                  f"must be one of: {', '.join(PLACEMENT_MODES)}"))
+    return rules
+
+_VM_CONFIG_RULES = _compile_vm_config_validator()
+
+
+def validate_vm_config_entry(entry, position):
+    """Raise ValueError if a vm_configs entry has a field of the wrong type or misses a required field."""
+    if not isinstance(entry, dict):
+        raise ValueError(f"vm_configs entry {position} must be a mapping.")
+    for field, check, message in _VM_CONFIG_RULES:
+        if field in entry and not check(entry[field]):
+            raise ValueError(f"vm_configs entry {position}: '{field}' {message}.")
+    provided = set(entry) | set(entry.get('matrix') or {})
+    for field in VM_CONFIG_REQUIRED_FIELDS:
+        if field not in provided:
+            raise ValueError(f"vm_configs entry {position} is missing '{field}'.")
+
+def _name_part(value):
+    return re.sub(r'[^A-Za-z0-9-]+', '-', str(value)).strip('-')
+
+def expand_vm_configs(entries, names=None, counters=None):
+    """
+    Lazily expand vm_configs entries into one VM config per VM.
+
+    An entry with a ``matrix`` mapping fields to lists of values yields one VM per combination,
+    and ``count`` repeats each VM. Every yielded VM gets a unique ``vm_name``: expanded VMs are
+    named ``<vm_name or 'vm<entry position>'>-<matrix values>-<n>``, and plain entries without a
+    name keep the default ``test-vm-<region>-<index>``. Entries are validated once, before they are expanded.
+
+    :param entries: The raw vm_configs list from the configuration file.
+    :param names: The VM names already taken, e.g. by other provider entries; new names are added to it.
+    :param counters: A dictionary with the next entry 'position' and VM 'index', shared with other
+                     provider entries so their default names keep counting; it is updated in place.
+    :raises ValueError: If an entry is invalid or two VMs end up with the same name.
+    """
+    names = set() if names is None else names
+    counters = {'position': 0, 'index': 0} if counters is None else counters
+    for entry in entries:
+        position = counters['position']
+        counters['position'] += 1
+        validate_vm_config_entry(entry, position)
+        matrix = entry.get('matrix')
+        count = entry.get('count', 1)
+        base = {key: value for key, value in entry.items() if key not in ('matrix', 'count')}
+
+        if matrix is None and count == 1:
+            combinations = [((), {})]
+        else:
+            fields = list(matrix or {})
+            combinations = (
+                (values, dict(zip(fields, values)))
+                for values in itertools.product(*(matrix[field] for field in fields))
+            )
+
+        for values, overrides in combinations:
+            for copy_index in range(count):
+                vm_config = copy.deepcopy(base)
+                vm_config.update(overrides)
+                if matrix is not None or count > 1:
+                    prefix = base.get('vm_name') or f"vm{position}"
+                    parts = [prefix] + [_name_part(value) for value in values] + [str(copy_index)]
+                    vm_config['vm_name'] = '-'.join(parts)
+                else:
+                    vm_config.setdefault('vm_name', f"test-vm-{vm_config['region']}-{counters['index']}")
+                if vm_config['vm_name'] in names:
+                    raise ValueError(f"Duplicate vm_name '{vm_config['vm_name']}' in vm_configs entry {position}.")
+                names.add(vm_config['vm_name'])
+                counters['index'] += 1
+                yield vm_config
+
 def divide_configs(config_file_path):
+    """
+    Load a configuration file and split its provider entries into AWS and Azure lists.
+
+    Each provider's ``vm_configs`` is expanded with ``expand_vm_configs``, so later steps see
+    one validated VM config per VM. Names are unique across all provider entries, since VMs of
+    different entries share Terraform directories and state keys by name. Entry positions in
+    errors and default names count across entries.
+    """
     with open(config_file_path, 'r') as file:
         config = yaml.safe_load(file)
 
     aws_configs = []
     azure_configs = []
 
+    names = set()
+    counters = {'position': 0, 'index': 0}
     for provider in config['Config']['cloud_providers']:
+        provider['vm_configs'] = list(expand_vm_configs(provider.get('vm_configs') or [], names, counters))
         if provider['name'].lower() == 'aws':
             aws_configs.append(provider)
         elif provider['name'].lower() == 'azure':
@@ -15,18 +153,95 @@ def divide_configs(config_file_path):
 
     return aws_configs, azure_configs
 
+def first_paginated(ec2_client, operation, key, **kwargs):
+    """Return the first item of a paginated describe call, fetching pages only until one is found."""
+    for page in ec2_client.get_paginator(operation).paginate(**kwargs):
+        if page[key]:
+            return page[key][0]
+    return None
+
+def get_vpc_id(ec2_client):
+    """Return the region's default VPC, or the first VPC if there is no default one."""
+    vpc = first_paginated(ec2_client, 'describe_vpcs', 'Vpcs', Filters=[{'Name': 'is-default', 'Values': ['true']}])
+    if vpc is None:
+        vpc = first_paginated(ec2_client, 'describe_vpcs', 'Vpcs')
+    if vpc is None:
+        raise ValueError("No VPC found in the region.")
+    return vpc['VpcId']
+
+def get_subnet_id(ec2_client, vpc_id):
+    """Return an available subnet of the VPC, preferring the default subnet of an availability zone."""
+    filters = [{'Name': 'vpc-id', 'Values': [vpc_id]}, {'Name': 'state', 'Values': ['available']}]
+    subnet = first_paginated(ec2_client, 'describe_subnets', 'Subnets',
+                             Filters=filters + [{'Name': 'default-for-az', 'Values': ['true']}])
+    if subnet is None:
+        subnet = first_paginated(ec2_client, 'describe_subnets', 'Subnets', Filters=filters)
+    if subnet is None:
+        raise ValueError(f"No available subnet found in VPC {vpc_id}.")
+    return subnet['SubnetId']
+
+def list_subnets(ec2_client, vpc_id):
+    """
+    Return the available subnets of the VPC with their availability zones.
+
+    Default subnets of an availability zone come first, then the others, each in AZ order.
+    """
+    subnets = []
+    paginator = ec2_client.get_paginator('describe_subnets')
+    for page in paginator.paginate(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]},
+                                            {'Name': 'state', 'Values': ['available']}]):
+        for subnet in page['Subnets']:
+            subnets.append({
+                'subnet_id': subnet['SubnetId'],
+                'availability_zone': subnet['AvailabilityZone'],
+                'default_for_az': bool(subnet.get('DefaultForAz')),
+            })
+    subnets.sort(key=lambda subnet: (not subnet['default_for_az'], subnet['availability_zone'], subnet['subnet_id']))
+    return subnets
+
+def get_subnet_availability_zone(ec2_client, subnet_id):
+    """Return the availability zone of a subnet."""
+    return ec2_client.describe_subnets(SubnetIds=[subnet_id])['Subnets'][0]['AvailabilityZone']
+
+def get_key_pair_name(ec2_client):
+    """Return the name of the region's first key pair (describe_key_pairs is not paginated)."""
+    key_pairs = ec2_client.describe_key_pairs()['KeyPairs']
+    if not key_pairs:
+        raise ValueError("No key pair found in the region.")
+    return key_pairs[0]['KeyName']
+
 def get_security_group_with_ssh(ec2_client, vpc_id):
-    """Find a security group in the specified VPC that allows SSH access."""
-    sg_response = ec2_client.describe_security_groups(Filters=[{'Name': 'vpc-id', 'Values': [vpc_id]}])
-    for sg in sg_response['SecurityGroups']:
-        for rule in sg['IpPermissions']:
-            if rule.get('FromPort') == 22 and rule.get('ToPort') == 22:
-                for ip_range in rule.get('IpRanges', []):
-                    if ip_range.get('CidrIp') == '0.0.0.0/0':
-                        return [sg['GroupId']]
-    
+    """
+    Find a security group in the specified VPC that allows SSH access.
+
+    The port and CIDR filters run server-side, so only candidate groups are returned. They can
+    match different rules of the same group, so each candidate's rules are still checked here.
+    """
+    paginator = ec2_client.get_paginator('describe_security_groups')
+    for page in paginator.paginate(Filters=[
+        {'Name': 'vpc-id', 'Values': [vpc_id]},
+        {'Name': 'ip-permission.from-port', 'Values': ['22']},
+        {'Name': 'ip-permission.to-port', 'Values': ['22']},
+        {'Name': 'ip-permission.cidr', 'Values': ['0.0.0.0/0']},
+    ]):
+        for sg in page['SecurityGroups']:
+            for rule in sg['IpPermissions']:
+                if rule.get('FromPort') == 22 and rule.get('ToPort') == 22:
+                    for ip_range in rule.get('IpRanges', []):
+                        if ip_range.get('CidrIp') == '0.0.0.0/0':
+                            return [sg['GroupId']]
+
     raise ValueError("No security group allowing SSH access found in the specified VPC.")
 
+def write_yaml_atomically(data, output_path):
+    """Write data to a YAML file through a temporary file, so readers never see a partial file."""
+    directory = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as yaml_file:
+        yaml.dump(data, yaml_file, default_flow_style=False)
+    os.replace(tmp_path, output_path)
+
 def dump_config_to_yaml(config, output_path):
     """
     Dumps the given configuration dictionary to a YAML file.
@@ -35,8 +250,7 @@ def dump_config_to_yaml(config, output_path):
     :param output_path: The path where the YAML file should be saved.
     """
     try:
-        with open(output_path, 'w') as yaml_file:
-            yaml.dump(config, yaml_file, default_flow_style=False)
+        write_yaml_atomically(config, output_path)
         print(f"Configuration successfully dumped to {output_path}")
     except Exception as e:
-        print(f"Error dumping configuration to YAML: {e}")
\ No newline at end of file
+        print(f"Error dumping configuration to YAML: {e}")
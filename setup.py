@@ -12,6 +12,8 @@ setup(
     entry_points={
         "console_scripts": [
             "cloudmanager=cloudmanager.runner:main",  # This will create a `cloudmanager` command
+            "cloudmanager-exec=cloudmanager.fanout:main",  # Run ad-hoc commands across a deployed fleet
+            "cloudmanager-latency=cloudmanager.latency:main",  # Report recorded launch latency percentiles
         ],
     },
 )
@@ -0,0 +1,29 @@
+import boto3
+import pytest
+from moto import mock_aws
+from cloudmanager import clients
+
+
+@pytest.fixture
+def aws(monkeypatch, tmp_path):
+    """Run a test against moto's in-memory AWS, with fresh pooled clients and a temporary home directory."""
+    monkeypatch.setenv('AWS_ACCESS_KEY_ID', 'testing')
+    monkeypatch.setenv('AWS_SECRET_ACCESS_KEY', 'testing')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'us-east-1')
+    monkeypatch.setenv('HOME', str(tmp_path))
+    (tmp_path / '.ssh').mkdir()
+    (tmp_path / '.ssh' / 'id_rsa.pub').write_text('ssh-rsa AAAA test@example\n')
+    # Clients cached by an earlier test were created outside this test's mock
+    monkeypatch.setattr(clients, '_default_pool', clients.ClientPool())
+    with mock_aws():
+        yield
+
+
+@pytest.fixture
+def aws_config():
+    return {'credentials': {'access_key': 'testing', 'secret_key': 'testing'}, 'vm_configs': []}
+
+
+@pytest.fixture
+def ec2(aws):
+    return boto3.client('ec2', region_name='us-east-1')
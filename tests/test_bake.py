@@ -0,0 +1,49 @@
+import boto3
+from cloudmanager.bake import apply_baked_images
+
+REGIONS = ['us-east-1', 'us-west-2']
+
+
+def base_resources(region, image_name):
+    ec2 = boto3.client('ec2', region_name=region)
+    if not ec2.describe_key_pairs(Filters=[{'Name': 'key-name', 'Values': ['test-key']}])['KeyPairs']:
+        ec2.create_key_pair(KeyName='test-key')
+    return {
+        'ami_id': ec2.describe_images(Filters=[{'Name': 'name', 'Values': [image_name]}])['Images'][0]['ImageId'],
+        'subnet_id': ec2.describe_subnets()['Subnets'][0]['SubnetId'],
+        'security_group_ids': [ec2.describe_security_groups(GroupNames=['default'])['SecurityGroups'][0]['GroupId']],
+        'key_pair_name': 'test-key',
+    }
+
+
+def test_apply_baked_images_bakes_once_and_copies_across_regions(ec2, aws_config):
+    image_name = ec2.describe_images()['Images'][0]['Name']
+    aws_config['vm_configs'] = [
+        {'vm_name': f'vm-{region}', 'region': region, 'instance_type': 't3.micro',
+         'initial_commands': ['echo setup']}
+        for region in REGIONS
+    ]
+    provisioned = []
+
+    def provision(public_ip, vm_config):
+        provisioned.append(vm_config['vm_name'])
+
+    resources = [base_resources(region, image_name) for region in REGIONS]
+    apply_baked_images(aws_config, resources, provision=provision)
+
+    assert provisioned == ['vm-us-east-1']
+    baked = [vm_config['baked_ami_id'] for vm_config in aws_config['vm_configs']]
+    assert [vm_resources['ami_id'] for vm_resources in resources] == baked
+    assert all(vm_resources['baked'] for vm_resources in resources)
+    # The second region booted from a copy of the image baked in the first one
+    copy = boto3.client('ec2', region_name='us-west-2').describe_images(ImageIds=[baked[1]])['Images'][0]
+    assert copy['ImageId'] != baked[0]
+
+    # A second run finds the baked images in both regions and provisions nothing
+    for vm_config in aws_config['vm_configs']:
+        del vm_config['baked_ami_id']
+    resources = [base_resources(region, image_name) for region in REGIONS]
+    apply_baked_images(aws_config, resources, provision=provision)
+
+    assert provisioned == ['vm-us-east-1']
+    assert [vm_config['baked_ami_id'] for vm_config in aws_config['vm_configs']] == baked
@@ -0,0 +1,85 @@
+import os
+import subprocess
+import pytest
+from botocore.exceptions import EndpointConnectionError
+from cloudmanager import collect as collect_module
+from cloudmanager import runner, teardown
+
+REGION = 'us-east-1'
+
+
+@pytest.fixture
+def fleet(ec2, aws_config):
+    image_id = ec2.describe_images()['Images'][0]['ImageId']
+    for index in range(3):
+        instance = ec2.run_instances(ImageId=image_id, InstanceType='t3.micro', MinCount=1, MaxCount=1)['Instances'][0]
+        aws_config['vm_configs'].append({
+            'vm_name': f'vm-{index}', 'region': REGION, 'instance_type': 't3.micro',
+            'instance_id': instance['InstanceId'], 'public_ip': f'10.0.0.{index}',
+            'collect': {'paths': ['results']},
+        })
+    return aws_config
+
+def instance_state(ec2, instance_id):
+    return ec2.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]['State']['Name']
+
+
+def test_failed_terminate_after_collection_is_left_to_teardown(ec2, fleet, monkeypatch):
+    collected = []
+    monkeypatch.setattr(collect_module, 'collect_vm_results', lambda vm_config: collected.append(vm_config['vm_name']))
+    unreachable = fleet['vm_configs'][0]['instance_id']
+    terminate = teardown.terminate_aws_instances
+
+    def flaky_terminate(ec2_client, instance_ids, **kwargs):
+        if unreachable in instance_ids:
+            raise EndpointConnectionError(endpoint_url='https://ec2.us-east-1.amazonaws.com')
+        return terminate(ec2_client, instance_ids, **kwargs)
+
+    monkeypatch.setattr(teardown, 'terminate_aws_instances', flaky_terminate)
+    terminated = runner.collect([fleet])
+
+    assert sorted(collected) == ['vm-0', 'vm-1', 'vm-2']
+    assert sorted(outcome['vm_name'] for outcome in terminated) == ['vm-1', 'vm-2']
+    assert instance_state(ec2, unreachable) == 'running'
+
+    # The endpoint is back for the final teardown, which terminates only what collection did not
+    monkeypatch.setattr(teardown, 'terminate_aws_instances', terminate)
+    report = runner.teardown([fleet], [], terminated=terminated)
+    assert all(outcome['error'] is None for outcome in report)
+    assert instance_state(ec2, unreachable) == 'terminated'
+
+
+
+class LocalShell:
+    """Runs the remote commands of an ssh manager in a local shell, with ``home`` as the home directory."""
+
+    def __init__(self, home, prelude=''):
+        self.env = dict(os.environ, HOME=str(home))
+        self.prelude = prelude
+
+    def popen(self, host, user, command, **kwargs):
+        return subprocess.Popen(['bash', '-c', self.prelude + command], env=self.env, **kwargs)
+
+
+def test_file_shrinking_while_sent_keeps_the_stream_in_sync(tmp_path):
+    home = tmp_path / 'home'
+    home.mkdir()
+    for name, content in (('a.log', b'hello'), ('shrunk.log', b'abc'), ('b.log', b'world')):
+        (home / name).write_bytes(content)
+    # stat reports shrunk.log 5 bytes longer than what tail then reads, as if it was truncated in between
+    shell = LocalShell(home, prelude=(
+        'stat() { s=$(command stat "$@") || return; case "$4" in *shrunk*) s=$(( s + 5 ));; esac; echo "$s"; }; '
+        'export -f stat; '
+    ))
+    local_dir = tmp_path / 'results'
+    transfers = collect_module.plan_transfers({'a.log': 5, 'shrunk.log': 8, 'b.log': 5}, str(local_dir))
+
+    assert collect_module.download_files('host', 'user', transfers, shell) == 18
+    assert (local_dir / 'a.log').read_bytes() == b'hello'
+    assert (local_dir / 'shrunk.log').read_bytes() == b'abc' + b'\0' * 5
+    assert (local_dir / 'b.log').read_bytes() == b'world'
+
+    # The padded copy is longer than the remote file, so the next collection starts it over
+    assert collect_module.plan_transfers({'a.log': 5, 'shrunk.log': 3, 'b.log': 5}, str(local_dir)) == [
+        ('shrunk.log', str(local_dir / 'shrunk.log'), 0),
+    ]
@@ -0,0 +1,89 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+from cloudmanager import discovery
+from cloudmanager.deploy import get_aws_resources
+from cloudmanager.discovery import DiscoveryCache, DEFAULT_TTLS
+from cloudmanager.utils import get_key_pair_name
+
+REGION = 'us-east-1'
+
+
+@pytest.fixture
+def ec2_client():
+    return boto3.client('ec2', region_name=REGION, aws_access_key_id='testing', aws_secret_access_key='testing')
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(discovery.time, 'time', lambda: now[0])
+    return now
+
+def add_key_pairs(stubber, key_name):
+    stubber.add_response('describe_key_pairs', {'KeyPairs': [{'KeyName': key_name}]})
+
+def add_resource_discovery(stubber):
+    stubber.add_response('describe_vpcs', {'Vpcs': [{'VpcId': 'vpc-1'}]})
+    stubber.add_response('describe_images', {'Images': [{'ImageId': 'ami-1', 'CreationDate': '2024-01-01T00:00:00.000Z'}]})
+    stubber.add_response('describe_subnets', {'Subnets': [{'SubnetId': 'subnet-1', 'AvailabilityZone': 'us-east-1a'}]})
+    stubber.add_response('describe_security_groups', {'SecurityGroups': [{
+        'GroupId': 'sg-1',
+        'IpPermissions': [{'FromPort': 22, 'ToPort': 22, 'IpRanges': [{'CidrIp': '0.0.0.0/0'}]}],
+    }]})
+    add_key_pairs(stubber, 'key-1')
+
+def lookup_key_pair(cache, ec2_client):
+    return cache.lookup('account', REGION, 'key_pair', 'first', lambda: get_key_pair_name(ec2_client))
+
+
+def test_warm_cache_makes_no_describe_calls(ec2_client, tmp_path):
+    path = str(tmp_path / 'discovery-cache.json')
+    with Stubber(ec2_client) as stubber:
+        add_resource_discovery(stubber)
+        cold = get_aws_resources(ec2_client, {'region': REGION}, DiscoveryCache(path=path), 'account')
+        stubber.assert_no_pending_responses()
+
+        # No responses are queued, so any describe call would fail
+        cache = DiscoveryCache(path=path)
+        assert get_aws_resources(ec2_client, {'region': REGION}, cache, 'account') == cold
+    assert (cache.hits, cache.misses) == (5, 0)
+
+
+def test_expired_entries_are_fetched_again(ec2_client, clock):
+    cache = DiscoveryCache(path=None)
+    with Stubber(ec2_client) as stubber:
+        add_key_pairs(stubber, 'key-1')
+        add_key_pairs(stubber, 'key-2')
+        assert lookup_key_pair(cache, ec2_client) == 'key-1'
+        clock[0] += DEFAULT_TTLS['key_pair'] - 1
+        assert lookup_key_pair(cache, ec2_client) == 'key-1'
+        clock[0] += 2
+        assert lookup_key_pair(cache, ec2_client) == 'key-2'
+        stubber.assert_no_pending_responses()
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_refresh_ignores_entries_on_disk(ec2_client, tmp_path):
+    path = str(tmp_path / 'discovery-cache.json')
+    with Stubber(ec2_client) as stubber:
+        add_key_pairs(stubber, 'key-1')
+        add_key_pairs(stubber, 'key-2')
+        assert lookup_key_pair(DiscoveryCache(path=path), ec2_client) == 'key-1'
+        assert lookup_key_pair(DiscoveryCache(path=path, refresh=True), ec2_client) == 'key-2'
+        stubber.assert_no_pending_responses()
+    # The refreshed value replaced the old one on disk
+    assert lookup_key_pair(DiscoveryCache(path=path), ec2_client) == 'key-2'
+
+
+def test_invalidate_drops_only_matching_entries(ec2_client, tmp_path):
+    path = str(tmp_path / 'discovery-cache.json')
+    cache = DiscoveryCache(path=path)
+    cache.lookup('account', REGION, 'vpc', 'default', lambda: 'vpc-1')
+    with Stubber(ec2_client) as stubber:
+        add_key_pairs(stubber, 'key-1')
+        add_key_pairs(stubber, 'key-2')
+        assert lookup_key_pair(cache, ec2_client) == 'key-1'
+        cache.invalidate(region=REGION, kind='key_pair')
+        assert lookup_key_pair(cache, ec2_client) == 'key-2'
+        stubber.assert_no_pending_responses()
+    assert DiscoveryCache(path=path).lookup('account', REGION, 'vpc', 'default', lambda: 'unexpected') == 'vpc-1'
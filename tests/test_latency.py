@@ -0,0 +1,95 @@
+import pytest
+from cloudmanager import deploy, latency
+from cloudmanager.deploy import get_aws_resources
+from cloudmanager.discovery import DiscoveryCache
+from cloudmanager.latency import LaunchLatencyStore, LaunchTimings, place_subnet
+
+REGION = 'us-east-1'
+
+
+@pytest.fixture(autouse=True)
+def any_image(monkeypatch):
+    # moto does not publish the Ubuntu images the default selector looks for
+    monkeypatch.setattr(deploy, 'get_ami_id', lambda ec2_client, vm_config=None: 'ami-test')
+
+def vm_config(**fields):
+    return dict({'region': REGION, 'security_group_ids': ['sg-test'], 'key_pair_name': 'test-key'}, **fields)
+
+def subnet_zones(ec2):
+    return {subnet['SubnetId']: subnet['AvailabilityZone'] for subnet in ec2.describe_subnets()['Subnets']}
+
+
+def test_default_subnet_records_its_availability_zone(ec2):
+    resources = get_aws_resources(ec2, vm_config(), DiscoveryCache(path=None), 'account')
+    assert resources['availability_zone'] == subnet_zones(ec2)[resources['subnet_id']]
+
+
+def test_given_subnet_records_its_availability_zone(ec2):
+    subnet_id, zone = sorted(subnet_zones(ec2).items())[-1]
+    resources = get_aws_resources(ec2, vm_config(subnet_id=subnet_id), DiscoveryCache(path=None), 'account')
+    assert (resources['subnet_id'], resources['availability_zone']) == (subnet_id, zone)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = LaunchLatencyStore(str(tmp_path / 'latency.sqlite'))
+    yield store
+    store.close()
+
+def record(store, zone, *seconds, ami_id='ami-test', instance_type='t3.micro'):
+    for ssh in seconds:
+        store.record({'region': REGION, 'availability_zone': zone, 'instance_type': instance_type,
+                      'ami_id': ami_id, 'launch': 1.0, 'ssh': ssh})
+
+def subnets(*zones):
+    return [{'subnet_id': f'subnet-{zone}', 'availability_zone': zone} for zone in zones]
+
+
+def test_store_keeps_only_the_newest_samples(store, monkeypatch):
+    monkeypatch.setattr(latency, 'MAX_SAMPLES_PER_KEY', 3)
+    for index, ssh in enumerate([100, 10, 20, 30]):
+        store.record({'recorded_at': index, 'region': REGION, 'availability_zone': 'us-east-1a',
+                      'instance_type': 't3.micro', 'ssh': ssh})
+    assert store.percentiles(region=REGION) == {'count': 3, 'p50': 20, 'p90': 28, 'p99': 29.8}
+    assert store.samples('running') == []
+
+
+def test_expected_time_to_ready_falls_back_to_every_image(store):
+    record(store, 'us-east-1a', 30, 40)
+    record(store, 'us-east-1a', 50, ami_id='ami-other')
+    assert store.expected_time_to_ready(REGION, 'us-east-1a', 't3.micro', 'ami-test') == 40
+    record(store, 'us-east-1a', 35)
+    assert store.expected_time_to_ready(REGION, 'us-east-1a', 't3.micro', 'ami-test') == 35
+    assert store.expected_time_to_ready(REGION, 'us-east-1b', 't3.micro', 'ami-test') is None
+
+
+def test_latency_placement_tries_new_zones_then_the_fastest(store):
+    config = vm_config(instance_type='t3.micro', placement='latency')
+    record(store, 'us-east-1a', 60, 60, 60)
+    record(store, 'us-east-1b', 20, 25, 30)
+    assert place_subnet(subnets('us-east-1a', 'us-east-1b', 'us-east-1c'), config, store=store)['subnet_id'] == \
+        'subnet-us-east-1c'
+    record(store, 'us-east-1c', 90, 90, 90)
+    assert place_subnet(subnets('us-east-1a', 'us-east-1b', 'us-east-1c'), config, store=store)['subnet_id'] == \
+        'subnet-us-east-1b'
+    # Only the allowed zones are candidates, whatever the history of the others
+    config['availability_zones'] = ['us-east-1a', 'us-east-1c']
+    assert place_subnet(subnets('us-east-1a', 'us-east-1b', 'us-east-1c'), config, store=store)['subnet_id'] == \
+        'subnet-us-east-1a'
+    config['availability_zones'] = ['us-east-1d']
+    with pytest.raises(ValueError):
+        place_subnet(subnets('us-east-1a'), config, store=store)
+
+
+def test_launch_timings_record_the_chosen_zone(store):
+    timings = LaunchTimings(store)
+    config = vm_config(vm_name='vm-0', instance_type='t3.micro')
+    timings.start([(config, {'ami_id': 'ami-test', 'availability_zone': 'us-east-1b'})])
+    timings.mark(config, 'running')
+    sample = timings.finish(config)
+
+    assert sample['availability_zone'] == 'us-east-1b'
+    assert sample['running'] <= sample['ssh']
+    assert store.samples(availability_zone='us-east-1b', ami_id='ami-test') == [sample['ssh']]
+    # VMs without a running timer, e.g. restarted warm pool instances, are not recorded
+    assert timings.finish(config) is None
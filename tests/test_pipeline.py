@@ -0,0 +1,63 @@
+import threading
+import time
+from types import SimpleNamespace
+from cloudmanager.pipeline import DEFAULT_LIMITS, STAGE_RESOURCES, STAGES, PipelineScheduler
+
+
+class RecordingScheduler(PipelineScheduler):
+    """A scheduler whose stages only record how many of each resource's stages run at once."""
+
+    def __init__(self, fail=None, **kwargs):
+        super().__init__(**kwargs)
+        self.fail = fail or {}
+        self.running = {resource: 0 for resource in DEFAULT_LIMITS}
+        self.peak = {resource: 0 for resource in DEFAULT_LIMITS}
+        self.stages = {}
+        self._counter_lock = threading.Lock()
+        self._handlers = {stage: (lambda task, stage=stage: self._record(task, stage)) for stage in STAGES}
+
+    def _record(self, task, stage):
+        resource = STAGE_RESOURCES[stage]
+        vm_name = task.vm_config['vm_name']
+        with self._counter_lock:
+            self.stages.setdefault(vm_name, []).append(stage)
+            self.running[resource] += 1
+            self.peak[resource] = max(self.peak[resource], self.running[resource])
+        try:
+            time.sleep(0.02)
+            if stage == 'launch':
+                task.vm_config['instance_id'] = f"i-{vm_name}"
+            if self.fail.get(vm_name) == stage:
+                raise RuntimeError(f"{stage} failed")
+            if stage == 'teardown':
+                task.terminated = True
+        finally:
+            with self._counter_lock:
+                self.running[resource] -= 1
+
+def provider(vm_count):
+    vm_configs = [{'vm_name': f'vm-{index}', 'region': 'us-east-1'} for index in range(vm_count)]
+    return SimpleNamespace(aws_config={'vm_configs': vm_configs}, account_state=None)
+
+
+def test_launch_limit_leaves_the_ssh_pool_at_its_default():
+    scheduler = RecordingScheduler(limits={'launch': 2})
+    results = scheduler.run([provider(12)])
+
+    assert scheduler.limits['ssh'] == DEFAULT_LIMITS['ssh']
+    assert scheduler.peak['launch'] == 2
+    assert scheduler.peak['ssh'] > 2
+    assert all(result['error'] is None and result['terminated'] for result in results)
+
+
+def test_failed_vm_skips_to_teardown_without_stopping_the_others():
+    scheduler = RecordingScheduler(fail={'vm-1': 'setup', 'vm-2': 'resolve'})
+    results = {result['vm_name']: result for result in scheduler.run([provider(3)])}
+
+    assert scheduler.stages['vm-0'] == list(STAGES)
+    assert scheduler.stages['vm-1'] == ['resolve', 'launch', 'ready', 'upload', 'setup', 'teardown']
+    # Nothing was launched, so there is nothing to tear down
+    assert scheduler.stages['vm-2'] == ['resolve']
+    assert (results['vm-1']['failed_stage'], results['vm-1']['terminated']) == ('setup', True)
+    assert (results['vm-2']['failed_stage'], results['vm-2']['terminated']) == ('resolve', False)
+    assert results['vm-0']['error'] is None
@@ -0,0 +1,115 @@
+import time
+from cloudmanager.pool import WarmPool, DEFAULT_MAX_IDLE
+
+
+def default_resources(ec2, subnet_index=0):
+    subnets = sorted(ec2.describe_subnets()['Subnets'], key=lambda subnet: subnet['SubnetId'])
+    security_group = ec2.describe_security_groups(GroupNames=['default'])['SecurityGroups'][0]
+    if not ec2.describe_key_pairs(Filters=[{'Name': 'key-name', 'Values': ['test-key']}])['KeyPairs']:
+        ec2.create_key_pair(KeyName='test-key')
+    return {
+        'ami_id': ec2.describe_images()['Images'][0]['ImageId'],
+        'subnet_id': subnets[subnet_index]['SubnetId'],
+        'security_group_ids': [security_group['GroupId']],
+        'key_pair_name': 'test-key',
+    }
+
+def launch(ec2, vm_name, resources):
+    instance = ec2.run_instances(
+        ImageId=resources['ami_id'],
+        InstanceType='t3.micro',
+        SubnetId=resources['subnet_id'],
+        SecurityGroupIds=resources['security_group_ids'],
+        KeyName=resources['key_pair_name'],
+        MinCount=1,
+        MaxCount=1,
+        TagSpecifications=[{'ResourceType': 'instance', 'Tags': [{'Key': 'Name', 'Value': vm_name}]}]
+    )['Instances'][0]
+    return {'vm_name': vm_name, 'region': 'us-east-1', 'instance_type': 't3.micro',
+            'instance_id': instance['InstanceId']}
+
+def instance_state(ec2, instance_id):
+    return ec2.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]['State']['Name']
+
+def instance_name(ec2, instance_id):
+    instance = ec2.describe_instances(InstanceIds=[instance_id])['Reservations'][0]['Instances'][0]
+    return next(tag['Value'] for tag in instance['Tags'] if tag['Key'] == 'Name')
+
+def new_vm(vm_name):
+    return {'vm_name': vm_name, 'region': 'us-east-1', 'instance_type': 't3.micro'}
+
+
+def test_release_then_claim_restarts_and_renames_instance(ec2, aws_config, tmp_path):
+    resources = default_resources(ec2)
+    vm_config = launch(ec2, 'old-vm', resources)
+    pool_path = str(tmp_path / 'warm-pool.yaml')
+
+    report = WarmPool(path=pool_path).release(aws_config, [vm_config])
+    assert [outcome['instance_id'] for outcome in report] == [vm_config['instance_id']]
+    assert instance_state(ec2, vm_config['instance_id']) == 'stopped'
+
+    # A later run loads the pool from disk
+    pool = WarmPool(path=pool_path)
+    claimed_vm = new_vm('new-vm')
+    assert pool.claim(aws_config, [claimed_vm], [resources]) == [claimed_vm]
+    assert claimed_vm['instance_id'] == vm_config['instance_id']
+    assert claimed_vm['warm_pool_instance_id'] == vm_config['instance_id']
+    assert instance_state(ec2, claimed_vm['instance_id']) == 'running'
+    assert instance_name(ec2, claimed_vm['instance_id']) == 'new-vm'
+    assert pool.stats() == {}
+
+
+def test_claim_requires_matching_subnet(ec2, aws_config, tmp_path):
+    resources = default_resources(ec2)
+    pool = WarmPool(path=str(tmp_path / 'warm-pool.yaml'))
+    pool.release(aws_config, [launch(ec2, 'old-vm', resources)])
+
+    other_subnet = default_resources(ec2, subnet_index=1)
+    assert other_subnet['subnet_id'] != resources['subnet_id']
+    assert pool.claim(aws_config, [new_vm('new-vm')], [other_subnet]) == []
+    assert sum(pool.stats().values()) == 1
+
+
+def test_instance_is_claimed_once_across_pool_objects(ec2, aws_config, tmp_path):
+    resources = default_resources(ec2)
+    pool_path = str(tmp_path / 'warm-pool.yaml')
+    WarmPool(path=pool_path).release(aws_config, [launch(ec2, 'old-vm', resources)])
+
+    # Both loaded the index before either claimed, like two concurrent runs
+    first, second = WarmPool(path=pool_path), WarmPool(path=pool_path)
+    assert len(first.claim(aws_config, [new_vm('vm-a')], [resources])) == 1
+    assert second.claim(aws_config, [new_vm('vm-b')], [resources]) == []
+
+
+def test_evict_terminates_idle_instances(ec2, aws_config, tmp_path):
+    resources = default_resources(ec2)
+    vm_config = launch(ec2, 'old-vm', resources)
+    pool = WarmPool(path=str(tmp_path / 'warm-pool.yaml'))
+    pool.release(aws_config, [vm_config])
+
+    assert pool.evict('testing', 'testing') == 0
+    assert pool.evict('testing', 'testing', now=time.time() + DEFAULT_MAX_IDLE + 1) == 1
+    assert instance_state(ec2, vm_config['instance_id']) == 'terminated'
+    assert pool.stats() == {}
+
+
+def test_release_respects_per_key_limit(ec2, aws_config, tmp_path):
+    resources = default_resources(ec2)
+    vm_configs = [launch(ec2, f'vm-{index}', resources) for index in range(3)]
+    pool = WarmPool(path=str(tmp_path / 'warm-pool.yaml'), max_per_key=2)
+
+    report = pool.release(aws_config, vm_configs)
+    assert len(report) == 2
+    assert list(pool.stats().values()) == [2]
+    # The instance that did not fit is left running for the regular teardown
+    assert instance_state(ec2, vm_configs[2]['instance_id']) == 'running'
+
+
+def test_release_respects_size_limit(ec2, aws_config, tmp_path):
+    vm_configs = [launch(ec2, f'vm-{index}', default_resources(ec2, subnet_index=index)) for index in range(3)]
+    pool = WarmPool(path=str(tmp_path / 'warm-pool.yaml'), max_size=2)
+
+    report = pool.release(aws_config, vm_configs)
+    assert len(report) == 2
+    assert len(pool.stats()) == 2
+    assert instance_state(ec2, vm_configs[2]['instance_id']) == 'running'
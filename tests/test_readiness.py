@@ -0,0 +1,65 @@
+import asyncio
+import threading
+import time
+import pytest
+from cloudmanager.readiness import AsyncInstanceReadiness, InstanceReadiness
+
+REGION = 'us-east-1'
+
+
+class FakeEC2:
+    """Answers describe_instances with a pending instance until its public IP is assigned."""
+
+    def __init__(self):
+        self.public_ips = {}
+        self.calls = []
+
+    def describe_instances(self, InstanceIds):
+        self.calls.append(sorted(InstanceIds))
+        instances = []
+        for instance_id in InstanceIds:
+            public_ip = self.public_ips.get(instance_id)
+            instance = {'InstanceId': instance_id, 'State': {'Name': 'running' if public_ip else 'pending'}}
+            if public_ip:
+                instance['PublicIpAddress'] = public_ip
+            instances.append(instance)
+        return {'Reservations': [{'Instances': instances}]}
+
+
+def test_late_instance_gets_its_own_timeout():
+    ec2 = FakeEC2()
+    readiness = InstanceReadiness({REGION: ec2}, timeout=1.0, base_interval=0.05, max_interval=0.1)
+    readiness.track(REGION, ['i-early'])
+    time.sleep(0.6)
+    # Tracked into a poller that has been running for 0.6 seconds of its 1 second
+    readiness.track(REGION, ['i-late'])
+    threading.Timer(0.8, ec2.public_ips.__setitem__, ('i-late', '10.0.0.2')).start()
+
+    with pytest.raises(TimeoutError):
+        readiness.wait_for_public_ip('i-early')
+    assert readiness.wait_for_public_ip('i-late') == '10.0.0.2'
+
+
+def test_instances_share_batched_describe_calls():
+    ec2 = FakeEC2()
+    ec2.public_ips.update({'i-1': '10.0.0.1', 'i-2': '10.0.0.2'})
+    readiness = InstanceReadiness({REGION: ec2}, base_interval=0.05, max_interval=0.1)
+    readiness.track(REGION, ['i-1', 'i-2'])
+    assert [readiness.wait_for_public_ip('i-1'), readiness.wait_for_public_ip('i-2')] == ['10.0.0.1', '10.0.0.2']
+    assert ec2.calls == [['i-1', 'i-2']]
+
+
+def test_async_late_instance_gets_its_own_timeout():
+    ec2 = FakeEC2()
+
+    async def scenario():
+        readiness = AsyncInstanceReadiness({REGION: ec2}, timeout=1.0, base_interval=0.05, max_interval=0.1)
+        readiness.track(REGION, ['i-early'])
+        await asyncio.sleep(0.6)
+        readiness.track(REGION, ['i-late'])
+        asyncio.get_running_loop().call_later(0.8, ec2.public_ips.__setitem__, 'i-late', '10.0.0.2')
+        with pytest.raises(TimeoutError):
+            await readiness.wait_for_public_ip('i-early')
+        return await readiness.wait_for_public_ip('i-late')
+
+    assert asyncio.run(scenario()) == '10.0.0.2'
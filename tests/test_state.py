@@ -0,0 +1,58 @@
+import boto3
+from cloudmanager.state import DeploymentState, reconcile_aws_config
+
+REGION = 'us-east-1'
+
+
+def provider(*vm_names):
+    return {
+        'credentials': {'access_key': 'testing', 'secret_key': 'testing'},
+        'vm_configs': [{'vm_name': vm_name, 'region': REGION, 'instance_type': 't3.micro'} for vm_name in vm_names],
+    }
+
+def launch_and_record(ec2, state, aws_config):
+    """Launch every VM of a provider entry and record it as provisioned, like a finished deploy."""
+    image_id = ec2.describe_images()['Images'][0]['ImageId']
+    account_state = state.for_account('testing')
+    for vm_config in aws_config['vm_configs']:
+        instance = ec2.run_instances(ImageId=image_id, InstanceType='t3.micro', MinCount=1, MaxCount=1)['Instances'][0]
+        account_state.record(dict(vm_config, instance_id=instance['InstanceId']), 'provisioned')
+
+def instance_states(ec2):
+    return sorted(instance['State']['Name']
+                  for reservation in ec2.describe_instances()['Reservations']
+                  for instance in reservation['Instances'])
+
+
+def test_reconcile_keeps_vms_of_other_entries_on_the_same_account(ec2, tmp_path):
+    state = DeploymentState(str(tmp_path / 'state.yaml'))
+    first, second = provider('a-0', 'a-1'), provider('b-0')
+    launch_and_record(ec2, state, first)
+    launch_and_record(ec2, state, second)
+
+    # The next run uses fresh configs, as loaded from the configuration file
+    first, second = provider('a-0', 'a-1'), provider('b-0')
+    first_plan = reconcile_aws_config(first, state, other_vm_names=['b-0'])
+    second_plan = reconcile_aws_config(second, state, other_vm_names=['a-0', 'a-1'])
+
+    assert [vm_config['vm_name'] for vm_config in first_plan['kept']] == ['a-0', 'a-1']
+    assert [vm_config['vm_name'] for vm_config in second_plan['kept']] == ['b-0']
+    assert first_plan['orphans'] == second_plan['orphans'] == []
+    assert first_plan['create'] == second_plan['create'] == []
+    assert instance_states(ec2) == ['running'] * 3
+
+
+def test_reconcile_terminates_removed_and_stopped_vms(ec2, tmp_path):
+    state = DeploymentState(str(tmp_path / 'state.yaml'))
+    launch_and_record(ec2, state, provider('vm-0', 'vm-1', 'vm-2'))
+    stopped = next(entry['instance_id'] for entry in state.entries() if entry['vm_name'] == 'vm-1')
+    ec2.stop_instances(InstanceIds=[stopped])
+
+    # vm-2 was removed from the configuration, and vm-1 is stopped
+    plan = reconcile_aws_config(provider('vm-0', 'vm-1'), state)
+
+    assert [vm_config['vm_name'] for vm_config in plan['kept']] == ['vm-0']
+    assert [vm_config['vm_name'] for vm_config in plan['create']] == ['vm-1']
+    assert sorted(entry['vm_name'] for entry in plan['orphans']) == ['vm-1', 'vm-2']
+    assert instance_states(ec2) == ['running', 'terminated', 'terminated']
+    assert [entry['vm_name'] for entry in state.entries()] == ['vm-0']